@@ -0,0 +1,221 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from content_store import DuplicateImageError
+from image_stream import CHUNK_SIZE, HEADER_CHUNK_SIZE, InvalidImageError, TruncatedImageError, RejectedImageError
+from metrics import get_metrics
+from retry import RetryableError
+from proxy_manager import PROXY_BLOCKED_STATUS, proxy_label
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class AsyncDownloader:
+    def __init__(self, crawler, concurrency=256, per_host=32, writer_threads=4):
+        """
+        Downloads images on one asyncio event loop instead of a thread per download.
+        Thousands of slow connections cost a few coroutines, not thousands of threads.
+        Disk writes run on a small thread pool so they never block the loop.
+        :param crawler: AutoCrawler. Supplies paths, retry policy and image writers.
+        :param concurrency: Maximum number of downloads in flight.
+        :param per_host: Maximum number of connections to a single host.
+        :param writer_threads: Threads writing and committing images.
+        """
+        if aiohttp is None:
+            raise ImportError('--download-engine async requires aiohttp. (pip install aiohttp)')
+
+        self.crawler = crawler
+        self.concurrency = max(1, int(concurrency))
+        self.per_host = max(1, int(per_host))
+        self.writer_threads = writer_threads
+
+    def download_images(self, keyword, links, site_name, max_count=0, manifest=None, stats=None, budget=None):
+        """
+        Same as AutoCrawler.download_images.
+        :return: Number of images saved (including ones saved by a previous run of the task)
+        """
+        return asyncio.run(self.run(keyword, links, site_name, max_count, manifest, stats, budget))
+
+    async def run(self, keyword, links, site_name, max_count, manifest, stats, budget=None):
+        loop = asyncio.get_running_loop()
+        total = len(links) if hasattr(links, '__len__') else None
+        success_count = manifest.done_count() if manifest else 0
+
+        if max_count == 0:
+            max_count = total if total is not None else float('inf')
+
+        if total is not None and total <= max_count:
+            target = total
+        else:
+            target = max_count if max_count != float('inf') else '?'
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host,
+                                         force_close=not self.crawler.http_keep_alive)
+        timeout = aiohttp.ClientTimeout(sock_connect=10, sock_read=30)
+        link_iter = iter(links)
+        index = -1
+        pending = {}
+
+        with ThreadPoolExecutor(max_workers=self.writer_threads) as writers:
+            # Compare Content-Length with the bytes on the wire, same as the requests engine.
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout, auto_decompress=False) as session:
+                try:
+                    while True:
+                        # Never keep more downloads in flight than needed to reach max_count.
+                        while len(pending) < self.concurrency and success_count + len(pending) < max_count and \
+                                (budget is None or budget.wants_downloads(len(pending))):
+                            # LinkStream blocks until the collector finds the next link.
+                            link = await loop.run_in_executor(None, next, link_iter, _END)
+                            if link is _END:
+                                break
+                            index = manifest.add_link(link) if manifest else index + 1
+                            if manifest and manifest.is_done(index):
+                                continue
+                            if self.crawler.is_known_link(keyword, site_name, link):
+                                continue
+                            logger.debug('Downloading {} from {}: {} / {}'.format(keyword, site_name,
+                                                                           success_count + len(pending) + 1, target))
+                            task = asyncio.ensure_future(
+                                self.download_image(session, writers, keyword, link, index, site_name))
+                            pending[task] = (index, link)
+
+                        if not pending:
+                            break
+
+                        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            index_done, link_done = pending.pop(task)
+                            if self.crawler.finish_image(index_done, task.result(), manifest, stats, link_done, budget):
+                                success_count += 1
+                finally:
+                    # If run is cancelled, let downloads clean up before the session and writer threads close.
+                    for task in pending:
+                        task.cancel()
+                    await asyncio.gather(*pending, return_exceptions=True)
+
+        return success_count
+
+    async def download_image(self, session, writers, keyword, link, index, site_name):
+        """
+        :return: (path, sniffer) if a valid image was saved, otherwise None
+        """
+        loop = asyncio.get_running_loop()
+        no_ext_path = '{}/{}/{}/{}'.format(self.crawler.download_path.replace('"', ''), keyword, site_name,
+                                           str(index).zfill(4))
+
+        start = time.monotonic()
+
+        try:
+            if str(link).startswith('data:image/jpeg;base64') or str(link).startswith('data:image/png;base64'):
+                data = self.crawler.base64_to_object(link)
+                result = await loop.run_in_executor(writers, self.crawler.save_image, [data], no_ext_path, len(data),
+                                                    link)
+            else:
+                result = await self.crawler.get_retry_policy().call_async(
+                    lambda: self.fetch_image(session, writers, link, no_ext_path, site_name), url=link,
+                    retry_on=(RetryableError, TruncatedImageError, aiohttp.ClientError, asyncio.TimeoutError))
+
+            self.crawler.record_download(keyword, site_name, 'ok', time.monotonic() - start, result[1])
+            return result
+
+        except RejectedImageError as e:
+            logger.debug('Rejected image - {} ({})'.format(link, e))
+            self.crawler.record_download(keyword, site_name, 'rejected', time.monotonic() - start)
+            get_metrics().inc('images_rejected_total', site=site_name, reason=e.reason)
+            return None
+
+        except InvalidImageError as e:
+            logger.debug('Unreadable file - {} ({})'.format(link, e))
+            self.crawler.record_download(keyword, site_name, 'invalid', time.monotonic() - start)
+            return None
+
+        except DuplicateImageError:
+            logger.debug('Duplicate image - {}'.format(link))
+            self.crawler.record_download(keyword, site_name, 'duplicate', time.monotonic() - start)
+            return None
+
+        except Exception as e:
+            logger.warning('Download failed - {}'.format(e))
+            self.crawler.record_download(keyword, site_name, 'failed', time.monotonic() - start)
+            return None
+
+    async def fetch_image(self, session, writers, link, no_ext_path, site_name=None):
+        loop = asyncio.get_running_loop()
+
+        # aiohttp has no socks support, only http proxies are used.
+        with self.crawler.use_proxy(site_name, (aiohttp.ClientConnectionError, asyncio.TimeoutError, RetryableError),
+                                    schemes=('http', 'https')) as proxy:
+            response = await session.get(link, proxy=proxy)
+            if proxy and response.status in PROXY_BLOCKED_STATUS:
+                response.release()
+                raise RetryableError('HTTP {} through {}'.format(response.status, proxy_label(proxy)))
+
+        async with response:
+            if response.status == 429 or response.status >= 500:
+                raise RetryableError('HTTP {}'.format(response.status))
+            if response.status != 200:
+                raise InvalidImageError('HTTP {}'.format(response.status))
+
+            writer = await loop.run_in_executor(writers, self.crawler.open_image_writer, no_ext_path,
+                                                response.content_length, link)
+            job = None  # last job of the writer on the writer threads
+
+            def run_writer(func, *args):
+                nonlocal job
+                job = writers.submit(func, *args)
+                return asyncio.wrap_future(job)
+
+            try:
+                # Batch small network reads so each hop to the writer thread moves CHUNK_SIZE.
+                # With an image filter only the header goes first, so a rejected image stops the download early.
+                buffer = bytearray()
+                flush_size = HEADER_CHUNK_SIZE if self.crawler.image_filter is not None else CHUNK_SIZE
+                while True:
+                    chunk = await response.content.read(flush_size - len(buffer))
+                    if not chunk:
+                        break
+                    buffer += chunk
+                    if len(buffer) >= flush_size:
+                        await run_writer(writer.write, bytes(buffer))
+                        buffer = bytearray()
+                        flush_size = CHUNK_SIZE
+                if buffer:
+                    await run_writer(writer.write, bytes(buffer))
+
+                return await run_writer(writer.commit)
+            except BaseException:
+                # Removing the temporary file blocks too. Shielded, so it finishes even if cancelled again.
+                await asyncio.shield(loop.run_in_executor(writers, self.abort_writer, writer, job))
+                raise
+
+    @staticmethod
+    def abort_writer(writer, job):
+        # A cancelled write keeps running on its thread. Abort after it, never on the same file at once.
+        if job is not None and not job.cancel():
+            wait([job])
+        writer.abort()
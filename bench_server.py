@@ -0,0 +1,383 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import argparse
+import html
+import io
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+from PIL import Image
+
+# 1x1 gif. Google preloads thumbnails as data: urls and keeps the real url in data-iurl.
+PLACEHOLDER_SRC = 'data:image/gif;base64,R0lGODlhAQABAIAAAP///wAAACH5BAEAAAAALAAAAAABAAEAAAICRAEAOw=='
+
+# Result boxes with the classes and attributes each collector scrapes. {url} is an image url.
+RESULT_TEMPLATES = {
+    'google': '<div class="bRMDJf islir" data-ri="{index}"><img src="' + PLACEHOLDER_SRC + '" data-iurl="{url}"></div>',
+    'naver': '<div class="photo_bx api_ani_send _photoBox"><img class="_image _listImage" src="{url}"></div>',
+    'unsplash': '<div class="ripi6"><figure itemprop="image">'
+                '<img class="YVj9w" srcset="{url}?w=400 400w, {url}?w=800 800w"></figure></div>',
+    'flickr': '<div class="view photo-list-photo-view awake" style="background-image: url(&quot;{url}&quot;)"></div>',
+}
+
+# Detail views of full resolution mode, opened by clicking a result box. {url} is the full resolution url.
+# Google hides its loading bar once the image is loaded.
+DETAIL_TEMPLATES = {
+    'google': '<div id="islsp"><div class="v4dQwb"><img class="n3VNCb" src="{url}">'
+              '<div class="k7O2sd" style="display: none;"></div></div></div>',
+    'naver': '<div class="image _imageBox"><img class="_image" src="{url}"></div>',
+}
+
+# "Load more" buttons matching the collectors' more_xpath. Naver only scrolls.
+MORE_BUTTONS = {
+    'google': '<input type="button" value="Show more results">',
+    'unsplash': '<div class="gDCZZ"><button>Load more</button></div>',
+    'flickr': '<div class="infinite-scroll-load-more"><button>Load more results</button></div>',
+}
+
+PAGE_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<style>
+#results > div {{ height: 120px; margin: 4px; background: #ddd; }}
+#results img {{ width: 100px; height: 100px; }}
+#more {{ display: none; }}
+</style>
+</head>
+<body>
+<div id="results">{results}</div>
+<div id="more">{more}</div>
+<div id="detail"></div>
+<script>
+var site = {site}, keyword = {keyword}, pageSize = {page_size}, total = {total}, moreEvery = {more_every};
+var next = pageSize, pages = 1, loading = false, blocked = {blocked};
+var results = document.getElementById('results'), more = document.getElementById('more');
+var detail = document.getElementById('detail'), detailIndex = -1;
+
+function showMore() {{
+    blocked = true;
+    more.style.display = 'block';
+}}
+
+function loadPage() {{
+    if (loading || blocked || next >= total) return;
+    loading = true;
+    fetch('/' + site + '/more?keyword=' + encodeURIComponent(keyword) + '&start=' + next)
+        .then(function (response) {{
+            if (!response.ok) throw new Error('HTTP ' + response.status);  // ex) 429, the next scroll retries
+            return response.text();
+        }})
+        .then(function (text) {{
+            results.insertAdjacentHTML('beforeend', text);
+            next += pageSize;
+            pages += 1;
+            loading = false;
+            if (moreEvery && pages % moreEvery === 0 && next < total) showMore();
+        }})
+        .catch(function () {{ loading = false; }});
+}}
+
+function openDetail(index) {{
+    if (index < 0 || index >= total) return;
+    detailIndex = index;
+    var bar = detail.querySelector('.k7O2sd');
+    if (bar) bar.setAttribute('style', 'display: block;');
+    fetch('/' + site + '/detail?keyword=' + encodeURIComponent(keyword) + '&index=' + index)
+        .then(function (response) {{
+            if (response.status === 429) return null;
+            return response.ok ? response.text() : '';
+        }})
+        .then(function (text) {{
+            if (index !== detailIndex) return;  // stepped to another result meanwhile
+            if (text === null) setTimeout(function () {{ openDetail(index); }}, 500);
+            else detail.innerHTML = text;
+        }});
+}}
+
+results.addEventListener('click', function (event) {{
+    var box = event.target;
+    while (box && box.parentNode !== results) box = box.parentNode;
+    if (box) openDetail(Array.prototype.indexOf.call(results.children, box));
+}});
+
+document.addEventListener('keydown', function (event) {{
+    if (event.key === 'ArrowRight' && detailIndex >= 0) openDetail(detailIndex + 1);
+}});
+
+window.addEventListener('scroll', function () {{
+    if (window.innerHeight + window.scrollY >= document.body.scrollHeight - 200) loadPage();
+}});
+
+if (more.firstElementChild) {{
+    more.firstElementChild.addEventListener('click', function () {{
+        more.style.display = 'none';
+        blocked = false;
+        loadPage();
+    }});
+}}
+if (blocked) showMore();
+</script>
+</body>
+</html>
+"""
+
+
+def make_base_jpeg(width=64, height=48):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (90, 140, 200)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class BenchServer:
+    def __init__(self, host='127.0.0.1', port=0, page_size=50, max_results=1000, more_every=4, page_latency=0.0,
+                 image_size=100 * 1024, image_latency=0.0, error_rate=0.0, throttle=0, truncate_rate=0.0, rate_limit=0,
+                 seed=0):
+        """
+        Local stand-in for the search sites and their image CDN, for benchmarks without network access.
+        Result pages mimic the xpaths of the thumbnail collectors, with infinite scroll and "load more" buttons.
+        Unsplash search JSON (/unsplash/napi/search/photos) and numbered flickr result pages (&page=N)
+        stand in for the endpoints of the HTTP collectors.
+        Clicking a google or naver result opens its detail view from /<site>/detail, for full resolution mode.
+        The right arrow key steps to the next result.
+        Every image url serves a distinct valid jpeg, so the content store doesn't deduplicate them.
+        :param page_size: Results per page load and per scroll.
+        :param max_results: Results per keyword before the end of results.
+        :param more_every: Show the site's "load more" button every this many pages. (0: never)
+        :param page_latency: Seconds before serving each page or scroll batch.
+        :param image_size: Bytes per image.
+        :param image_latency: Seconds before the first byte of each image.
+        :param error_rate: Fraction of image requests answered with 503.
+        :param throttle: Bytes per second per image response. (0: unlimited)
+        :param truncate_rate: Fraction of image responses cut off halfway, with the full Content-Length.
+        :param rate_limit: Requests per second over all clients, with bursts of as many. Others get 429. (0: unlimited)
+        """
+        self.page_size = page_size
+        self.max_results = max_results
+        self.more_every = more_every
+        self.page_latency = page_latency
+        self.image_size = image_size
+        self.image_latency = image_latency
+        self.error_rate = error_rate
+        self.throttle = throttle
+        self.truncate_rate = truncate_rate
+        self.rate_limit = rate_limit
+        self.tokens = max(1, rate_limit)
+        self.tokens_time = time.monotonic()
+        self.tokens_lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.base_jpeg = make_base_jpeg()
+
+        self.httpd = ThreadingHTTPServer((host, port), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    @property
+    def base_urls(self):
+        """
+        :return: CollectLinks / AutoCrawler base_urls pointing at this server
+        """
+        return {site: '{}/{}'.format(self.url, site) for site in RESULT_TEMPLATES}
+
+    def image_url(self, site, keyword, index):
+        return '{}/img/{}/{}/{}.jpg'.format(self.url, site, quote(keyword), index)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def results(self, site, keyword, start):
+        end = min(start + self.page_size, self.max_results)
+        template = RESULT_TEMPLATES[site]
+        return ''.join(template.format(url=html.escape(self.image_url(site, keyword, i)), index=i)
+                       for i in range(start, end))
+
+    def full_image_url(self, site, keyword, index):
+        return self.image_url(site, keyword, index) + '?size=full'
+
+    def detail(self, site, keyword, index):
+        """
+        :return: Detail view of result index, None past the end of results
+        """
+        if not 0 <= index < self.max_results:
+            return None
+        return DETAIL_TEMPLATES[site].format(url=html.escape(self.full_image_url(site, keyword, index)))
+
+    def search_json(self, keyword, page, per_page):
+        # Shape of unsplash's /napi/search/photos response, with the fields HttpCollectLinks reads.
+        start = (page - 1) * per_page
+        end = min(start + per_page, self.max_results)
+        results = [{'id': str(i), 'urls': {size: '{}?w={}'.format(self.image_url('unsplash', keyword, i), width)
+                                           for size, width in [('small', 400), ('regular', 1080), ('full', 2400)]}}
+                   for i in range(start, end)]
+        return json.dumps({'total': self.max_results, 'total_pages': -(-self.max_results // per_page),
+                           'results': results})
+
+    def page(self, site, keyword, page=1):
+        start = (page - 1) * self.page_size
+        return PAGE_HTML.format(results=self.results(site, keyword, start), more=MORE_BUTTONS.get(site, ''),
+                                site=json.dumps(site), keyword=json.dumps(keyword), page_size=self.page_size,
+                                total=self.max_results, more_every=self.more_every if site in MORE_BUTTONS else 0,
+                                # Unsplash shows its button before infinite scroll starts.
+                                blocked='true' if site == 'unsplash' else 'false')
+
+    def image(self, site, keyword, index):
+        # Padding after the end of the jpeg makes every image distinct without changing what it decodes to.
+        tag = '{}/{}/{}'.format(site, keyword, index).encode('utf-8')
+        padding = max(0, self.image_size - len(self.base_jpeg) - len(tag))
+        return self.base_jpeg + tag + b'\0' * padding
+
+    def allow_request(self):
+        # Token bucket refilled at rate_limit per second.
+        if not self.rate_limit:
+            return True
+        with self.tokens_lock:
+            now = time.monotonic()
+            self.tokens = min(max(1, self.rate_limit), self.tokens + (now - self.tokens_time) * self.rate_limit)
+            self.tokens_time = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def should_fail(self):
+        return self.draw(self.error_rate)
+
+    def should_truncate(self):
+        return self.draw(self.truncate_rate)
+
+    def draw(self, rate):
+        if not rate:
+            return False
+        with self.random_lock:
+            return self.random.random() < rate
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                query = parse_qs(url.query)
+                parts = [unquote(part) for part in url.path.strip('/').split('/')]
+
+                if not server.allow_request():
+                    self.send_body('Too many requests', 'text/plain', status=429, headers={'Retry-After': '1'})
+                elif parts[0] == 'img' and len(parts) == 4:
+                    self.send_image(parts[1], parts[2], parts[3])
+                elif parts[0] == 'unsplash' and parts[1:] == ['napi', 'search', 'photos']:
+                    time.sleep(server.page_latency)
+                    self.send_body(server.search_json(query.get('query', [''])[0], int(query.get('page', ['1'])[0]),
+                                                      int(query.get('per_page', ['20'])[0])), 'application/json')
+                elif parts[0] in DETAIL_TEMPLATES and len(parts) > 1 and parts[1] == 'detail':
+                    time.sleep(server.page_latency)
+                    body = server.detail(parts[0], query.get('keyword', [''])[0], int(query.get('index', ['0'])[0]))
+                    if body is None:
+                        self.send_body('Not found', 'text/plain', status=404)
+                    else:
+                        self.send_body(body, 'text/html')
+                elif parts[0] in RESULT_TEMPLATES and len(parts) > 1 and parts[1] == 'more':
+                    time.sleep(server.page_latency)
+                    start = int(query.get('start', ['0'])[0])
+                    self.send_body(server.results(parts[0], query.get('keyword', [''])[0], start), 'text/html')
+                elif parts[0] in RESULT_TEMPLATES:
+                    time.sleep(server.page_latency)
+                    keyword = (query.get('q') or query.get('query') or query.get('text') or [parts[-1]])[0]
+                    self.send_body(server.page(parts[0], keyword, int(query.get('page', ['1'])[0])), 'text/html')
+                else:
+                    self.send_body('Not found', 'text/plain', status=404)
+
+            def send_body(self, body, content_type, status=200, headers=None):
+                data = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type + '; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_image(self, site, keyword, name):
+                time.sleep(server.image_latency)
+                if server.should_fail():
+                    self.send_body('Service unavailable', 'text/plain', status=503)
+                    return
+
+                data = server.image(site, keyword, name.split('.')[0])
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+
+                if server.should_truncate():
+                    data = data[:len(data) // 2]
+                    self.close_connection = True
+
+                chunk_size = 16 * 1024
+                for offset in range(0, len(data), chunk_size):
+                    chunk = data[offset:offset + chunk_size]
+                    self.wfile.write(chunk)
+                    if server.throttle:
+                        time.sleep(len(chunk) / server.throttle)
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on.')
+    parser.add_argument('--page-size', type=int, default=50, help='Results per page load and per scroll.')
+    parser.add_argument('--max-results', type=int, default=1000, help='Results per keyword.')
+    parser.add_argument('--more-every', type=int, default=4,
+                        help='Show the "load more" button every this many pages. (0: never)')
+    parser.add_argument('--page-latency', type=float, default=0, help='Seconds before serving each page.')
+    parser.add_argument('--image-size', type=int, default=100 * 1024, help='Bytes per image.')
+    parser.add_argument('--image-latency', type=float, default=0, help='Seconds before each image response.')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of image requests answered with 503.')
+    parser.add_argument('--throttle', type=int, default=0, help='Bytes per second per image response. (0: unlimited)')
+    parser.add_argument('--truncate-rate', type=float, default=0,
+                        help='Fraction of image responses cut off halfway.')
+    parser.add_argument('--rate-limit', type=float, default=0,
+                        help='Requests per second served before answering 429. (0: unlimited)')
+    args = parser.parse_args()
+
+    bench = BenchServer(port=args.port, page_size=args.page_size, max_results=args.max_results,
+                        more_every=args.more_every, page_latency=args.page_latency, image_size=args.image_size,
+                        image_latency=args.image_latency, error_rate=args.error_rate, throttle=args.throttle,
+                        truncate_rate=args.truncate_rate, rate_limit=args.rate_limit)
+    print('Serving on {}'.format(bench.url))
+    print('--base-urls "{}"'.format(','.join('{}:{}'.format(site, url) for site, url in bench.base_urls.items())))
+    bench.httpd.serve_forever()
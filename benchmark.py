@@ -0,0 +1,182 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+import main
+from main import AutoCrawler, Sites, setup_logging
+from bench_server import BenchServer
+from metrics import Metrics, get_metrics
+from scheduler import SiteScheduler, ScheduledTask
+
+logger = logging.getLogger(__name__)
+
+SITE_CODES = {
+    'google': Sites.GOOGLE,
+    'naver': Sites.NAVER,
+    'unsplash': Sites.UNSPLASH,
+    'flickr': Sites.FLICKR,
+}
+
+
+def percentile(values, p):
+    # Nearest rank
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, int(round(p / 100 * len(values))))
+    return values[min(rank, len(values)) - 1]
+
+
+def counter_total(snapshot, name, **labels):
+    return sum(counter['value'] for counter in snapshot['counters']
+               if counter['name'] == name and all(counter['labels'].get(k) == v for k, v in labels.items()))
+
+
+def run_download_task(args):
+    """
+    Downloads a fixed list of links, without collecting them with a browser.
+    """
+    keyword, site_name, links = args
+    count = main._worker_crawler.download_images(keyword, links, site_name, max_count=main._worker_crawler.limit)
+    return {'keyword': keyword, 'site': site_name, 'status': 'done', 'count': count, 'error': None,
+            'metrics': get_metrics().drain()}
+
+
+def run_benchmark(crawler, bench, mode='download', keywords=('bench',), sites=('google',), n_images=100):
+    """
+    Runs one task per (keyword, site) through SiteScheduler, like AutoCrawler.do_crawling.
+    :param mode: 'download' - image downloads only, 'crawl' - collect links with chrome and download them
+    :param n_images: Images per task
+    :return: Summary dict
+    """
+    tasks = []
+    for keyword in keywords:
+        for site in sites:
+            if mode == 'download':
+                links = [bench.image_url(site, keyword, i) for i in range(n_images)]
+                tasks.append(ScheduledTask((keyword, site, links), site))
+            else:
+                tasks.append(ScheduledTask([keyword, SITE_CODES[site]], site))
+
+    func = run_download_task if mode == 'download' else main.run_task
+    scheduler = SiteScheduler(crawler.n_threads, crawler.site_concurrency)
+    metrics = Metrics()
+    task_seconds = []
+    failed = 0
+
+    start = time.time()
+    for task, result, error in scheduler.run(tasks, func, initializer=main.init_worker, initargs=(crawler,)):
+        if error is not None or result['status'] != 'done':
+            failed += 1
+            logger.warning('Task failed - {} : {} - {}'.format(task.site, task.args[0],
+                                                                error if error is not None else result['error']))
+        if result is not None and 'metrics' in result:
+            metrics.merge(result['metrics'])
+        task_seconds.append(task.elapsed)
+    wall_seconds = time.time() - start
+
+    snapshot = metrics.snapshot()
+    links = counter_total(snapshot, 'links_collected_total') if mode == 'crawl' else n_images * len(tasks)
+    images = counter_total(snapshot, 'downloads_total', result='ok')
+    n_bytes = counter_total(snapshot, 'download_bytes_total')
+
+    return {
+        'mode': mode,
+        'engine': crawler.download_engine,
+        'tasks': len(tasks),
+        'failed': failed,
+        'wall_seconds': round(wall_seconds, 3),
+        'links': links,
+        'images': images,
+        'bytes': n_bytes,
+        'retries': counter_total(snapshot, 'retries_total'),
+        'links_per_second': round(links / wall_seconds, 2),
+        'images_per_second': round(images / wall_seconds, 2),
+        'mb_per_second': round(n_bytes / wall_seconds / 1024 / 1024, 3),
+        'task_p50_seconds': round(percentile(task_seconds, 50), 3),
+        'task_p99_seconds': round(percentile(task_seconds, 99), 3),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmark against bench_server.py stand-in sites.')
+    parser.add_argument('--mode', type=str, default='download',
+                        help='"download" - image downloads only, "crawl" - collect links with chrome and download them')
+    parser.add_argument('--label', type=str, default='', help='Name of this run in the output. ex) a git commit')
+    parser.add_argument('--output', type=str, default='',
+                        help='Appends the summary as a JSON line to this file, to compare versions.')
+    parser.add_argument('--keywords', type=int, default=4, help='Number of keywords.')
+    parser.add_argument('--sites', type=str, default='google,naver,unsplash,flickr', help='Comma separated sites.')
+    parser.add_argument('--images', type=int, default=200, help='Images per task.')
+    parser.add_argument('--download-path', type=str, default='bench_download',
+                        help='Download folder. Removed before the run.')
+    parser.add_argument('--threads', type=int, default=4, help='Number of worker processes.')
+    parser.add_argument('--download-threads', type=int, default=8, help='Concurrent image downloads per task.')
+    parser.add_argument('--download-engine', type=str, default='thread', help='"thread" or "async"')
+    parser.add_argument('--content-store', type=str, default='false', help='Use the content store (boolean)')
+    parser.add_argument('--full-resolution', type=str, default='false',
+                        help='Collect full resolution links from detail views in crawl mode (boolean)')
+    parser.add_argument('--http-collectors', type=str, default='',
+                        help='Sites collected over HTTP instead of chrome in crawl mode. ex) "unsplash,flickr"')
+    parser.add_argument('--max-attempts', type=int, default=4, help='Attempts per page load and image download.')
+    parser.add_argument('--page-size', type=int, default=50, help='Results per page load and per scroll.')
+    parser.add_argument('--more-every', type=int, default=4,
+                        help='Show the "load more" button every this many pages. (0: never)')
+    parser.add_argument('--page-latency', type=float, default=0, help='Seconds before serving each page.')
+    parser.add_argument('--image-size', type=int, default=100 * 1024, help='Bytes per image.')
+    parser.add_argument('--image-latency', type=float, default=0, help='Seconds before each image response.')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of image requests answered with 503.')
+    parser.add_argument('--throttle', type=int, default=0, help='Bytes per second per image response. (0: unlimited)')
+    parser.add_argument('--truncate-rate', type=float, default=0, help='Fraction of image responses cut off halfway.')
+    parser.add_argument('--rate-limit', type=float, default=0,
+                        help='Requests per second the stand-in server serves before answering 429. (0: unlimited)')
+    parser.add_argument('--log-level', type=str, default='warning', help='"debug", "info", "warning" or "error"')
+    args = parser.parse_args()
+
+    setup_logging(args.log_level)
+
+    _sites = [site.strip() for site in args.sites.split(',') if site.strip()]
+    _keywords = ['bench{}'.format(i) for i in range(args.keywords)]
+
+    bench = BenchServer(page_size=args.page_size, max_results=args.images, more_every=args.more_every,
+                        page_latency=args.page_latency, image_size=args.image_size, image_latency=args.image_latency,
+                        error_rate=args.error_rate, throttle=args.throttle, truncate_rate=args.truncate_rate,
+                        rate_limit=args.rate_limit).start()
+
+    shutil.rmtree(args.download_path, ignore_errors=True)
+    crawler = AutoCrawler(n_threads=args.threads, download_path=args.download_path, no_gui=True, limit=args.images,
+                          download_threads=args.download_threads, download_engine=str(args.download_engine).lower(),
+                          content_store=str(args.content_store).lower() != 'false', resume=False,
+                          full_resolution=str(args.full_resolution).lower() != 'false',
+                          max_attempts=args.max_attempts, log_level=args.log_level, base_urls=bench.base_urls,
+                          http_collectors=[site.strip() for site in args.http_collectors.split(',') if site.strip()])
+
+    try:
+        summary = run_benchmark(crawler, bench, args.mode, _keywords, _sites, args.images)
+    finally:
+        bench.stop()
+
+    summary = dict(summary, label=args.label, time=time.time(), options=vars(args))
+    print(json.dumps(summary, indent=2))
+
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(summary, ensure_ascii=False) + '\n')
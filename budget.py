@@ -0,0 +1,145 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Downloads in flight under a byte budget until the first image tells the size of images of the task.
+SIZE_PROBE_DOWNLOADS = 4
+
+
+class CrawlBudget:
+    def __init__(self, max_images=0, max_seconds=0, max_bytes=0, overcollect=1.25, max_overcollect=5.0, done=0,
+                 prior_weight=10):
+        """
+        Time, image count and byte budget of one keyword/site task, shared by its link collector and downloader.
+        Collectors stop scrolling and downloaders stop submitting as soon as the budget is met.
+        :param max_images: Images to save. (0: no limit)
+        :param max_seconds: Wall clock seconds from now. (0: no limit)
+        :param max_bytes: Bytes of saved images. (0: no limit)
+        :param overcollect: Links collected per wanted image before any download finished.
+                            Replaced by the observed failure rate as downloads finish.
+        :param max_overcollect: Upper bound of links collected per wanted image.
+        :param done: Images saved by a previous run of the task. ex) TaskManifest.done_count()
+        :param prior_weight: Downloads the initial overcollect counts as when estimating the failure rate.
+        """
+        self.max_images = max_images or 0
+        self.max_seconds = max_seconds or 0
+        self.max_bytes = max_bytes or 0
+        self.overcollect = max(1.0, overcollect)
+        self.max_overcollect = max(self.overcollect, max_overcollect)
+        self.prior_weight = prior_weight
+        self.deadline = time.monotonic() + self.max_seconds if self.max_seconds else None
+
+        self.saved = done
+        self.failed = 0
+        self.bytes = 0
+        self.sized = 0  # images saved by this run, whose sizes are in bytes
+        self.skipped = 0  # links collected but never downloaded, ex) known to the url index
+        self.lock = threading.Lock()
+
+    def record(self, ok, nbytes=0):
+        """
+        Records the result of one download.
+        :param ok: True if an image was saved
+        :param nbytes: Size of the saved image
+        """
+        with self.lock:
+            if ok:
+                self.saved += 1
+                self.sized += 1
+                self.bytes += nbytes
+            else:
+                self.failed += 1
+
+    def skip(self):
+        """
+        Records a collected link that is not downloaded at all. It doesn't count towards the links wanted.
+        """
+        with self.lock:
+            self.skipped += 1
+
+    def success_rate(self):
+        # Smoothed towards 1 / overcollect, so a few early failures don't make collectors scroll forever.
+        with self.lock:
+            return (self.saved + self.prior_weight / self.overcollect) / \
+                   (self.saved + self.failed + self.prior_weight)
+
+    def image_target(self):
+        """
+        :return: Images to save: max_images, or fewer once the average image size says max_bytes is reached first.
+                 None if neither limits the task yet.
+        """
+        targets = [self.max_images] if self.max_images else []
+        with self.lock:
+            if self.max_bytes and self.sized:
+                targets.append(self.saved + math.ceil(max(0, self.max_bytes - self.bytes) * self.sized / self.bytes)
+                               if self.bytes else self.saved)
+        return min(targets) if targets else None
+
+    def link_target(self):
+        """
+        :return: Links worth collecting to save image_target(), from the observed failure rate, plus the links
+                 skipped so far. None if no limit.
+        """
+        target = self.image_target()
+        if target is None:
+            return None
+        factor = min(self.max_overcollect, 1 / self.success_rate())
+        with self.lock:
+            return math.ceil(target * factor) + self.skipped
+
+    def remaining_seconds(self):
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def exhausted(self):
+        """
+        :return: 'time', 'bytes' or 'count' if the budget is met, otherwise None
+        """
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return 'time'
+        with self.lock:
+            if self.max_bytes and self.bytes >= self.max_bytes:
+                return 'bytes'
+            if self.max_images and self.saved >= self.max_images:
+                return 'count'
+        return None
+
+    def wants_links(self, count):
+        """
+        :param count: Links (or result elements) collected so far
+        :return: True while collecting more links is worth it
+        """
+        if self.exhausted():
+            return False
+        target = self.link_target()
+        return target is None or count < target
+
+    def wants_downloads(self, in_flight):
+        """
+        :param in_flight: Downloads submitted and not finished yet
+        :return: True while starting another download is worth it
+        """
+        if self.exhausted():
+            return False
+        if self.max_bytes and not self.sized and in_flight >= SIZE_PROBE_DOWNLOADS:
+            return False
+        target = self.image_target()
+        with self.lock:
+            return target is None or self.saved + in_flight < target
@@ -14,32 +14,207 @@ Copyright 2018 YoongiKim
    limitations under the License.
 """
 
+import json
+import logging
 import time
 from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.by import By
-from selenium.common.exceptions import ElementNotVisibleException, StaleElementReferenceException
+from selenium.common.exceptions import StaleElementReferenceException, WebDriverException
 import platform
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.action_chains import ActionChains
 from webdriver_manager.chrome import ChromeDriverManager
 import os.path as osp
+import queue
+import re
+import threading
+from retry import RetryPolicy, RetryError
+from metrics import get_metrics
+from url_index import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+
+PAGE_STATE_JS = """
+var xpath = arguments[0];
+return {
+    count: document.evaluate('count(' + xpath + ')', document, null, XPathResult.NUMBER_TYPE, null).numberValue,
+    height: document.body.scrollHeight
+};
+"""
+
+# Scrolls to the bottom and resolves once new results stop rendering for a moment, or on timeout.
+WAIT_FOR_GROWTH_JS = """
+var xpath = arguments[0], timeout = arguments[1], done = arguments[arguments.length - 1];
+function state() {
+    return {
+        count: document.evaluate('count(' + xpath + ')', document, null, XPathResult.NUMBER_TYPE, null).numberValue,
+        height: document.body.scrollHeight
+    };
+}
+var start = state(), finished = false, settle = null;
+var observer = new MutationObserver(function () {
+    var now = state();
+    if (now.count > start.count || now.height > start.height) {
+        clearTimeout(settle);
+        settle = setTimeout(function () { finish(); }, 300);
+    }
+});
+function finish() {
+    if (finished) return;
+    finished = true;
+    observer.disconnect();
+    clearTimeout(settle);
+    clearTimeout(timer);
+    done(state());
+}
+observer.observe(document.body, {childList: true, subtree: true});
+var timer = setTimeout(finish, timeout);
+window.scrollTo(0, document.body.scrollHeight);
+"""
+
+
+# Like WebElement.get_attribute: src/href are resolved urls and style is the normalized css text.
+SCRAPE_ATTRIBUTES_JS = """
+var xpath = arguments[0], childXpath = arguments[1], attributes = arguments[2], start = arguments[3];
+function snapshot(expression, context) {
+    var result = document.evaluate(expression, context, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    var nodes = [];
+    for (var i = 0; i < result.snapshotLength; i++) nodes.push(result.snapshotItem(i));
+    return nodes;
+}
+function read(node, name) {
+    if (!node.hasAttribute(name)) return null;
+    if (name === 'src' || name === 'href') return node[name];
+    if (name === 'style') return node.style.cssText;
+    return node.getAttribute(name);
+}
+var nodes = snapshot(xpath, document), items = [];
+for (var i = start; i < nodes.length; i++) {
+    var targets = childXpath ? snapshot(childXpath, nodes[i]) : [nodes[i]];
+    for (var j = 0; j < targets.length; j++) {
+        var item = {_index: i};
+        for (var k = 0; k < attributes.length; k++) item[attributes[k]] = read(targets[j], attributes[k]);
+        items.push(item);
+    }
+}
+return {count: nodes.length, items: items};
+"""
+
+# Src of the image in the open detail view, or null while it is still loading. arguments[0]: image xpath,
+# arguments[1]: xpath of a loading bar to wait for (or null).
+DETAIL_SRC_JS = """
+var first = function (xpath) {
+    return document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+};
+if (arguments[1]) {
+    var bar = first(arguments[1]);
+    if (bar && bar.getAttribute('style') !== 'display: none;') return null;
+}
+var img = first(arguments[0]);
+return img && img.src && img.src.indexOf('data:') !== 0 ? img.src : null;
+"""
+
+# Results per chunk of detail views resolved by one browser.
+DETAIL_CHUNK = 20
+
+# Overridable with CollectLinks(base_urls=...), ex) to run against bench_server.py
+SITE_URLS = {
+    'google': 'https://www.google.com',
+    'naver': 'https://search.naver.com',
+    'unsplash': 'https://unsplash.com',
+    'flickr': 'https://www.flickr.com',
+}
+
+BACKGROUND_URL_RE = re.compile(r'background-image:\s*url\(["\']?(.*?)["\']?\)')
+
+# Url patterns blocked per resource type with network capture. (Network.setBlockedURLs, * is a wildcard)
+BLOCKED_URL_PATTERNS = {
+    'font': ['*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot'],
+    'media': ['*.mp4', '*.webm', '*.m3u8', '*.mp3', '*.ogg'],
+    'stylesheet': ['*.css'],
+}
+
+# Image requests of result thumbnails per site, recorded with network capture.
+NETWORK_IMAGE_PATTERNS = {
+    'google': re.compile(r'^https?://encrypted-tbn\d\.gstatic\.com/images\?'),
+    'naver': re.compile(r'^https?://search\.pstatic\.net/'),
+    'unsplash': re.compile(r'^https?://images\.unsplash\.com/photo-'),
+    'flickr': re.compile(r'^https?://live\.staticflickr\.com/'),
+}
+
+# Chrome flags of the lightweight profile used with network capture.
+LIGHT_CHROME_ARGUMENTS = [
+    '--disable-extensions', '--disable-background-networking', '--disable-component-update',
+    '--disable-default-apps', '--disable-sync', '--disable-translate', '--no-first-run', '--mute-audio',
+    '--disable-features=MediaRouter,OptimizationHints,Translate', '--disk-cache-size=33554432',
+]
 
 
 class CollectLinks:
-    def __init__(self, no_gui=False, proxy=None):
+    def __init__(self, no_gui=False, proxy=None, driver_pool=None, retry_policy=None, base_urls=None,
+                 proxy_manager=None, proxy_site=None, detail_workers=1, network_capture=False,
+                 block_resources=('font', 'media'), budget=None):
+        """
+        :param driver_pool: DriverPool to borrow a warm browser from. The browser is returned to it instead of closed.
+        :param retry_policy: RetryPolicy for page loads and clicks. Also rate limits them per host.
+        :param base_urls: Overrides SITE_URLS per site. ex) {'google': 'http://127.0.0.1:8000/google'}
+        :param proxy_manager: ProxyManager that chose proxy. Page loads are reported to it under proxy_site.
+        :param detail_workers: Browsers resolving detail views at once in google_full and naver_full.
+                               The extra ones come from driver_pool.
+        :param network_capture: Lightweight chrome profile that blocks block_resources, and collect thumbnail
+                                urls from the image requests of the page too, not only from the result xpaths.
+                                driver_pool must be created with the same network_capture.
+        :param block_resources: Resource types blocked with network_capture. ('font', 'media', 'stylesheet')
+        :param budget: CrawlBudget of the task. Collecting stops once it wants no more links.
+        """
+        self.no_gui = no_gui
+        self.budget = budget
+        self.detail_workers = max(1, int(detail_workers))
+        self.network_capture = network_capture
+        self.block_resources = tuple(block_resources)
+        self.proxy = proxy
+        self.proxy_manager = proxy_manager
+        self.proxy_site = proxy_site
+        self.base_urls = dict(SITE_URLS, **(base_urls or {}))
+        self.driver_pool = driver_pool
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.metrics = get_metrics()
+        self.labels = {}  # site and keyword of the running collector, for metrics
+
+        self.browser = None
+        self.open_browser()
+
+    def open_browser(self):
+        """
+        Borrows a browser from driver_pool or starts one. Collectors without a browser override this.
+        """
+        if self.driver_pool is not None:
+            self.browser = self.driver_pool.acquire(self.proxy)
+        else:
+            self.browser = self.create_browser(self.no_gui, self.proxy, self.network_capture)
+
+        if self.network_capture:
+            self.start_network_capture()
+
+    @staticmethod
+    def create_browser(no_gui=False, proxy=None, network_capture=False):
+        """
+        :param network_capture: Lightweight profile, and a performance log of network events for captured_image_links.
+        """
+        start = time.monotonic()
         executable = ''
 
         if platform.system() == 'Windows':
-            print('Detected OS : Windows')
+            logger.info('Detected OS : Windows')
             executable = './chromedriver/chromedriver_win.exe'
         elif platform.system() == 'Linux':
-            print('Detected OS : Linux')
+            logger.info('Detected OS : Linux')
             executable = './chromedriver/chromedriver_linux'
         elif platform.system() == 'Darwin':
-            print('Detected OS : Mac')
+            logger.info('Detected OS : Mac')
             executable = './chromedriver/chromedriver_mac'
         else:
             raise OSError('Unknown OS Type')
@@ -55,547 +230,835 @@ class CollectLinks:
             chrome_options.add_argument('--headless')
         if proxy:
             chrome_options.add_argument("--proxy-server={}".format(proxy))
-        self.browser = webdriver.Chrome(ChromeDriverManager().install(), chrome_options=chrome_options)
+        if network_capture:
+            for argument in LIGHT_CHROME_ARGUMENTS:
+                chrome_options.add_argument(argument)
+            chrome_options.add_experimental_option('prefs', {'profile.default_content_setting_values.notifications': 2,
+                                                             'profile.default_content_setting_values.geolocation': 2})
+            chrome_options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+        browser = webdriver.Chrome(ChromeDriverManager().install(), chrome_options=chrome_options)
 
         browser_version = 'Failed to detect version'
         chromedriver_version = 'Failed to detect version'
         major_version_different = False
 
-        if 'browserVersion' in self.browser.capabilities:
-            browser_version = str(self.browser.capabilities['browserVersion'])
+        if 'browserVersion' in browser.capabilities:
+            browser_version = str(browser.capabilities['browserVersion'])
 
-        if 'chrome' in self.browser.capabilities:
-            if 'chromedriverVersion' in self.browser.capabilities['chrome']:
-                chromedriver_version = str(self.browser.capabilities['chrome']['chromedriverVersion']).split(' ')[0]
+        if 'chrome' in browser.capabilities:
+            if 'chromedriverVersion' in browser.capabilities['chrome']:
+                chromedriver_version = str(browser.capabilities['chrome']['chromedriverVersion']).split(' ')[0]
 
         if browser_version.split('.')[0] != chromedriver_version.split('.')[0]:
             major_version_different = True
 
-        print('_________________________________')
-        print('Current web-browser version:\t{}'.format(browser_version))
-        print('Current chrome-driver version:\t{}'.format(chromedriver_version))
+        logger.info('_________________________________')
+        logger.info('Current web-browser version:\t{}'.format(browser_version))
+        logger.info('Current chrome-driver version:\t{}'.format(chromedriver_version))
         if major_version_different:
-            print('warning: Version different')
-            print(
+            logger.warning('warning: Version different')
+            logger.warning(
                 'Download correct version at "http://chromedriver.chromium.org/downloads" and place in "./chromedriver"')
-        print('_________________________________')
+        logger.info('_________________________________')
+
+        get_metrics().observe('driver_start_seconds', time.monotonic() - start)
+        return browser
+
+    def start_network_capture(self):
+        patterns = [pattern for resource in self.block_resources for pattern in BLOCKED_URL_PATTERNS.get(resource, [])]
+        try:
+            self.browser.execute_cdp_cmd('Network.enable', {})
+            self.browser.execute_cdp_cmd('Network.setBlockedURLs', {'urls': patterns})
+            self.browser.get_log('performance')  # drops events of an earlier task of a pooled browser
+        except Exception as e:
+            logger.warning('Network capture unavailable, collecting from result xpaths only - {}'.format(e))
+            self.network_capture = False
+
+    def captured_image_links(self, site):
+        """
+        Image urls of site thumbnails requested since the last call, in request order.
+        Requests count as soon as they are sent, so lazy thumbnails need no base64 fallback.
+        :return: [] without network capture
+        """
+        if not self.network_capture:
+            return []
+
+        pattern = NETWORK_IMAGE_PATTERNS[site]
+        links = []
+        for entry in self.browser.get_log('performance'):
+            try:
+                message = json.loads(entry['message'])['message']
+            except (KeyError, ValueError):
+                continue
+            if message.get('method') != 'Network.requestWillBeSent':
+                continue
+            params = message.get('params', {})
+            url = params.get('request', {}).get('url', '')
+            if params.get('type') == 'Image' and pattern.match(url):
+                links.append(url)
+        return links
+
+    def spawn(self):
+        """
+        :return: CollectLinks with a browser of its own and the same settings. Close it when done.
+        """
+        collect = CollectLinks(no_gui=self.no_gui, proxy=self.proxy, driver_pool=self.driver_pool,
+                               retry_policy=self.retry_policy, base_urls=self.base_urls,
+                               proxy_manager=self.proxy_manager, proxy_site=self.proxy_site,
+                               network_capture=self.network_capture, block_resources=self.block_resources,
+                               budget=self.budget)
+        collect.labels = self.labels
+        return collect
+
+    def want_more(self, count, max_count=None):
+        """
+        :param count: Links (or result elements) collected so far
+        :param max_count: Hard limit of count. (0 or None: no limit)
+        :return: True while count is at most max_count and the budget wants more links
+        """
+        if max_count and count > max_count:
+            return False
+        return self.budget is None or self.budget.wants_links(count)
+
+    def close(self):
+        if self.driver_pool is not None:
+            self.driver_pool.release(self.browser)
+        else:
+            self.browser.close()
 
     def get_scroll(self):
         pos = self.browser.execute_script("return window.pageYOffset;")
         return pos
 
+    def site_url(self, site, path):
+        return self.base_urls[site].rstrip('/') + path
+
+    def load(self, url):
+        start = time.monotonic()
+        with self.metrics.timer('page_load_seconds', **self.labels):
+            try:
+                self.retry_policy.call(lambda: self.browser.get(url), url=url, retry_on=(WebDriverException,))
+            except RetryError:
+                if self.proxy_manager is not None:
+                    self.proxy_manager.report(self.proxy, self.proxy_site, False)
+                raise
+        if self.proxy_manager is not None:
+            self.proxy_manager.report(self.proxy, self.proxy_site, True, time.monotonic() - start)
+
     def wait_and_click(self, xpath):
-        #  Sometimes click fails unreasonably. So tries to click at all cost.
-        try:
+        #  Sometimes click fails unreasonably. So retries with a refresh, up to retry_policy.max_attempts.
+        def click():
             w = WebDriverWait(self.browser, 15)
             elem = w.until(EC.element_to_be_clickable((By.XPATH, xpath)))
             self.highlight(elem)
             elem.click()
-        except Exception as e:
-            print('Click time out - {}'.format(xpath))
-            print('Exception {}'.format(e))
-            print('Refreshing browser...')
+            return elem
+
+        def refresh(e):
+            logger.warning('Click time out - {}'.format(xpath))
+            logger.warning('Exception {}'.format(e))
+            logger.info('Refreshing browser...')
             self.browser.refresh()
-            time.sleep(2)
-            return self.wait_and_click(xpath)
 
-        return elem
+        return self.retry_policy.call(click, url=self.browser.current_url, on_retry=refresh)
 
     def highlight(self, element):
         self.browser.execute_script("arguments[0].setAttribute('style', arguments[1]);", element,
                                     "background: yellow; border: 2px solid red;")
 
+    def scroll_batches(self, count_xpath, max_count=None, more_xpath=None, timeout=5, patience=2):
+        """
+        Scrolls to the bottom until the number of count_xpath elements and the page height stop growing.
+        Each wait ends as soon as new results are rendered (in-page MutationObserver) instead of sleeping.
+        When results stop growing, a visible more_xpath button is clicked before giving up.
+        Yields the element count at the start and after every batch of new results.
+        :param max_count: Stops once more than max_count elements are loaded or the budget is met. (0 or None: no limit)
+        :param timeout: Seconds to wait for new results per scroll.
+        :param patience: Scrolls without new results (after clicking more_xpath) before the end of results.
+        """
+        self.browser.set_script_timeout(timeout + 5)
+
+        state = self.browser.execute_script(PAGE_STATE_JS, count_xpath)
+        yield state['count']
+
+        stalls = 0
+        clicked = False
+
+        while self.want_more(state['count'], max_count):
+            with self.metrics.timer('scroll_batch_seconds', **self.labels):
+                new_state = self.browser.execute_async_script(WAIT_FOR_GROWTH_JS, count_xpath, timeout * 1000)
+
+            if new_state['count'] > state['count'] or new_state['height'] > state['height']:
+                stalls = 0
+                clicked = False
+                grew = new_state['count'] > state['count']
+                state = new_state
+                if grew:
+                    yield state['count']
+                continue
+
+            # Click "more" once per stall. A button that loads nothing must not loop forever.
+            if more_xpath and not clicked and self.click_if_visible(more_xpath):
+                clicked = True
+                continue
+
+            stalls += 1
+            if stalls >= patience:
+                logger.debug('Reached end of results - {} elements'.format(state['count']))
+                break
+
+    def scrape_attributes(self, xpath, attributes, child_xpath=None, start=0):
+        """
+        Reads attributes of many elements with one execute_script call instead of one get_attribute call each.
+        :param xpath: Elements to scrape, ex) result grid boxes
+        :param attributes: ex) ['src', 'data-iurl']
+        :param child_xpath: Scrape elements matching this xpath inside each element instead. ex) './/img'
+        :param start: Skips the first elements of xpath, which were scraped by a previous pass.
+        :return: (number of xpath elements, list of {attribute: value} per scraped element)
+                 Each item has the index of its xpath element in '_index' too.
+        """
+        with self.metrics.timer('scrape_seconds', **self.labels):
+            result = self.browser.execute_script(SCRAPE_ATTRIBUTES_JS, xpath, child_xpath, attributes, start)
+        return int(result['count']), result['items']
+
+    def scrape_links(self, xpath, attributes, scrape, child_xpath=None, start=0):
+        """
+        Scrapes the elements of xpath from start and turns each into links with scrape.
+        :param scrape: ex) lambda imgs: self.scrape_naver(imgs)
+        :return: (start of the next pass, links) The next pass starts at the first element without a link yet,
+                 ex) a thumbnail still showing its lazy load placeholder, so it is read again once loaded.
+        """
+        count, items = self.scrape_attributes(xpath, attributes, child_xpath, start)
+        next_start = count
+        links = []
+        for item in items:
+            item_links = [link for link in scrape([item]) if link and not str(link).startswith('data:')]
+            if item_links:
+                links += item_links
+            else:
+                next_start = min(next_start, item['_index'])
+        return next_start, links
+
+    def scraped_batches(self, batches, xpath, attributes, scrape, child_xpath=None):
+        """
+        Yields the links of the elements of xpath after every batch of batches (ex. scroll_batches),
+        and once more at the end for placeholders that were still loading.
+        Elements are read until they have a link. Links of later elements may repeat, new_links drops them.
+        """
+        start = 0
+        for _ in batches:
+            logger.debug('Scraping links')
+            start, links = self.scrape_links(xpath, attributes, scrape, child_xpath, start)
+            yield links
+        yield self.scrape_links(xpath, attributes, scrape, child_xpath, start)[1]
+
+    def click_if_visible(self, xpath):
+        for elem in self.browser.find_elements(By.XPATH, xpath):
+            try:
+                if elem.is_displayed():
+                    self.highlight(elem)
+                    self.browser.execute_script("arguments[0].click();", elem)
+                    return True
+            except StaleElementReferenceException:
+                pass
+        return False
+
     @staticmethod
     def remove_duplicates(_list):
         return list(dict.fromkeys(_list))
 
+    def new_links(self, seen, links):
+        # Yields links not seen yet in this task, keeping order. Sizes of one image count as seen.
+        for link in links:
+            if not link:
+                continue
+            key = canonicalize_url(link)
+            if key not in seen:
+                seen.add(key)
+                self.metrics.inc('links_collected_total', **self.labels)
+                yield link
+
     def google(self, keyword, add_url="", max_count=10000):
-        self.browser.get("https://www.google.com/search?q={}&source=lnms&tbm=isch{}".format(keyword, add_url))
+        return list(self.google_iter(keyword, add_url, max_count))
 
-        time.sleep(1)
+    def google_iter(self, keyword, add_url="", max_count=10000):
+        """
+        Yields links as each scroll batch is scraped. Closing the generator stops collection.
+        """
+        self.labels = {'site': 'google', 'keyword': keyword}
+        seen = set()
 
-        print('Scrolling down')
+        try:
+            self.load(self.site_url('google', "/search?q={}&source=lnms&tbm=isch{}".format(keyword, add_url)))
 
-        elem = self.browser.find_element_by_tag_name("body")
+            logger.debug('Scrolling down')
 
-        for i in range(60):
-            elem.send_keys(Keys.PAGE_DOWN)
-            time.sleep(0.2)
+            xpath = '//div[@class="bRMDJf islir"]'
 
-        try:
             # You may need to change this. Because google image changes rapidly.
             # btn_more = self.browser.find_element(By.XPATH, '//input[@value="결과 더보기"]')
-            # self.wait_and_click('//input[@id="smb"]')
-            self.wait_and_click('//input[@type="button"]')
+            batches = self.scroll_batches(xpath, max_count, more_xpath='//input[@type="button"]')
+            for links in self.scraped_batches(batches, xpath, ['src', 'data-iurl'], self.scrape_google, './/img'):
+                yield from self.new_links(seen, links + self.captured_image_links('google'))
 
-        except ElementNotVisibleException:
-            pass
-
-        while True:
-            for i in range(60):
-                elem.send_keys(Keys.PAGE_DOWN)
-                time.sleep(0.2)
-            photo_grid_boxes = self.browser.find_elements(By.XPATH, '//div[@class="bRMDJf islir"]')
-            if len(photo_grid_boxes) > max_count: break
-        
-        print('Scraping links')
+        finally:
+            logger.info('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('google', keyword, len(seen)))
+            self.close()
 
+    @staticmethod
+    def scrape_google(imgs):
         links = []
 
-        for box in photo_grid_boxes:
-            try:
-                imgs = box.find_elements(By.TAG_NAME, 'img')
-
-                for img in imgs:
-                    # self.highlight(img)
-                    src = img.get_attribute("src")
-
-                    # Google seems to preload 20 images as base64
-                    if str(src).startswith('data:'):
-                        src = img.get_attribute("data-iurl")
-                    links.append(src)
-
-            except Exception as e:
-                print('[Exception occurred while collecting links from google] {}'.format(e))
-
-        links = self.remove_duplicates(links)
+        for img in imgs:
+            src = img['src']
 
-        print('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('google', keyword, len(links)))
-        self.browser.close()
+            # Google seems to preload 20 images as base64
+            if str(src).startswith('data:'):
+                src = img['data-iurl']
+            if src:
+                links.append(src)
 
         return links
 
     def naver(self, keyword, add_url="", max_count=10000):
-        self.browser.get(
-            "https://search.naver.com/search.naver?where=image&sm=tab_jum&query={}{}".format(keyword, add_url))
+        return list(self.naver_iter(keyword, add_url, max_count))
 
-        time.sleep(1)
+    def naver_iter(self, keyword, add_url="", max_count=10000):
+        self.labels = {'site': 'naver', 'keyword': keyword}
+        seen = set()
 
-        print('Scrolling down')
+        try:
+            self.load(self.site_url(
+                'naver', "/search.naver?where=image&sm=tab_jum&query={}{}".format(keyword, add_url)))
 
-        elem = self.browser.find_element_by_tag_name("body")
+            logger.debug('Scrolling down')
 
-        while True:
-            for i in range(60):
-                elem.send_keys(Keys.PAGE_DOWN)
-                time.sleep(0.2)
+            xpath = '//div[@class="photo_bx api_ani_send _photoBox"]//img[@class="_image _listImage"]'
 
-            imgs = self.browser.find_elements(By.XPATH,
-                                            '//div[@class="photo_bx api_ani_send _photoBox"]//img[@class="_image _listImage"]')
-            if len(imgs) > max_count: break
-            
+            batches = self.scroll_batches(xpath, max_count)
+            for links in self.scraped_batches(batches, xpath, ['src'], self.scrape_naver):
+                yield from self.new_links(seen, links + self.captured_image_links('naver'))
 
-        print('Scraping links')
+        finally:
+            logger.info('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('naver', keyword, len(seen)))
+            self.close()
 
+    @staticmethod
+    def scrape_naver(imgs):
         links = []
 
         for img in imgs:
-            try:
-                src = img.get_attribute("src")
-                if src[0] != 'd':
-                    links.append(src)
-            except Exception as e:
-                print('[Exception occurred while collecting links from naver] {}'.format(e))
-
-        links = self.remove_duplicates(links)
-
-        print('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('naver', keyword, len(links)))
-        self.browser.close()
+            src = img['src']
+            if src and src[0] != 'd':
+                links.append(src)
 
         return links
 
     def unsplash(self, keyword, add_url="", srcset_idx=0, max_count=10000):
-        self.browser.get("https://unsplash.com/s/photos/{}".format(keyword)) # , add_url
-
-        time.sleep(1)
+        return list(self.unsplash_iter(keyword, add_url, srcset_idx, max_count))
 
-        print('Scrolling down')
-
-        elem = self.browser.find_element_by_tag_name("body")
-
-        for i in range(60):
-            elem.send_keys(Keys.PAGE_DOWN)
-            time.sleep(0.2)
+    def unsplash_iter(self, keyword, add_url="", srcset_idx=0, max_count=10000):
+        self.labels = {'site': 'unsplash', 'keyword': keyword}
+        seen = set()
 
         try:
-            # You may need to change this. Because google image changes rapidly.
-            # btn_more = self.browser.find_element(By.XPATH, '//input[@value="결과 더보기"]')
-            # self.wait_and_click('//input[@id="smb"]')
-            # self.wait_and_click('//div[@class="gDCZZ"]/button')
-            button = self.browser.find_element_by_xpath('//div[@class="gDCZZ"]//button')
-            self.highlight(button)
-            time.sleep(1)
-            button.send_keys(Keys.ENTER)
-        except Exception as e:
-            print(e)
-            # pass
-        
-        # reached_page_end = False
-        # last_height = self.browser.execute_script("return document.body.scrollHeight")
-        
-        while True:
-            # for i in range(30):
-            #     elem.send_keys(Keys.PAGE_DOWN)
-            #     time.sleep(0.4)
-            # time.sleep(1)
-
-            photo_grid_boxes = self.browser.find_elements(By.XPATH, '//div[@class="ripi6"]//figure[@itemprop="image"]')
-            # new_height = self.browser.execute_script("return document.body.scrollHeight")
-            # if last_height == new_height:
-            #     reached_page_end = True
-            # else:
-            #     last_height = new_height 
+            self.load(self.site_url('unsplash', "/s/photos/{}".format(keyword))) # , add_url
 
-            try:
-                loading = self.browser.find_element_by_xpath('//div[@class="MvqOi"]') # loading icon
-                self.browser.execute_script("arguments[0].scrollIntoView(true);", loading)
-                elem.send_keys(Keys.PAGE_UP)
-                time.sleep(1)
-            except:
-                break
+            logger.debug('Scrolling down')
 
-            if len(photo_grid_boxes) > max_count:
-                break
-            else:
-                continue
+            xpath = '//div[@class="ripi6"]//figure[@itemprop="image"]'
 
-        print('Scraping links')
+            # "Load more" button, then infinite scroll.
+            batches = self.scroll_batches(xpath, max_count, more_xpath='//div[@class="gDCZZ"]//button')
+            for links in self.scraped_batches(batches, xpath, ['srcset', 'data-iurl'],
+                                              lambda imgs: self.scrape_unsplash(imgs, srcset_idx),
+                                              './/img[@class="YVj9w"]'):
+                if srcset_idx == 0:  # network requests are thumbnails
+                    links += self.captured_image_links('unsplash')
+                yield from self.new_links(seen, links)
 
+        finally:
+            logger.info('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('unsplash', keyword, len(seen)))
+            self.close()
+
+    @staticmethod
+    def scrape_unsplash(imgs, srcset_idx=0):
         links = []
 
-        for box in photo_grid_boxes:
+        for img in imgs:
             try:
-                imgs = box.find_elements(By.XPATH, './/img[@class="YVj9w"]') # By.TAG_NAME, 'img')
-
-                for img in imgs:
-                    # self.highlight(img)
-                    src = img.get_attribute("srcset")
-                    src = src.split(', ')[srcset_idx].split(' ')[:-1] # 800w
-                    src = ' '.join(src)
+                src = img['srcset']
+                src = src.split(', ')[srcset_idx].split(' ')[:-1] # 800w
+                src = ' '.join(src)
 
-                    # Google seems to preload 20 images as base64
-                    if str(src).startswith('data:'):
-                        src = img.get_attribute("data-iurl")
-                    links.append(src)
+                # Google seems to preload 20 images as base64
+                if str(src).startswith('data:'):
+                    src = img['data-iurl']
+                links.append(src)
 
             except Exception as e:
-                print('[Exception occurred while collecting links from unsplash] {}'.format(e))
-
-        links = self.remove_duplicates(links)
-
-        print('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('unsplash', keyword, len(links)))
-        self.browser.close()
+                logger.warning('[Exception occurred while collecting links from unsplash] {}'.format(e))
 
         return links
 
     def flickr(self, keyword, add_url="", max_count=10000, full=False):
-        self.browser.get("https://www.flickr.com/search/?text={}&media=photos{}".format(keyword, add_url))
+        return list(self.flickr_iter(keyword, add_url, max_count, full))
 
-        time.sleep(1)
+    def flickr_iter(self, keyword, add_url="", max_count=10000, full=False):
+        self.labels = {'site': 'flickr', 'keyword': keyword}
+        seen = set()
 
-        print('Scrolling down')
+        try:
+            self.load(self.site_url('flickr', "/search/?text={}&media=photos{}".format(keyword, add_url)))
 
-        elem = self.browser.find_element_by_tag_name("body")
+            logger.debug('Scrolling down')
 
-        for i in range(60):
-            elem.send_keys(Keys.PAGE_DOWN)
-            time.sleep(0.2)
+            elem = self.browser.find_element_by_tag_name("body")
 
-        # try:
-        #     button = self.browser.find_element_by_xpath('.//div[@class="infinite-scroll-load-more"]/button')
-        #     self.highlight(button)
-        #     time.sleep(1)
-        #     self.browser.execute_script("arguments[0].click();", button)
-        # except:
-        #     pass
-        # # ActionChains(self.browser).move_to_element(button).click(button).perform()
-        
+            xpath = '//div[@class="view photo-list-photo-view awake"]'
 
-        # for i in range(100):
-        #     elem.send_keys(Keys.PAGE_DOWN)
-        #     time.sleep(0.2)
+            batches = self.scroll_batches(xpath, max_count, more_xpath='//div[@class="infinite-scroll-load-more"]//button')
+            if full:
+                for _ in batches:
+                    pass
+                logger.debug('Scraping links')
+                yield from self.new_links(seen, self.flickr_full_links(elem, max_count))
+            else:
+                for links in self.scraped_batches(batches, xpath, ['style'], self.scrape_flickr):
+                    yield from self.new_links(seen, links + self.captured_image_links('flickr'))
 
-        time.sleep(2)
-        
-        # reached_page_end = False
-        # last_height = self.browser.execute_script("return document.body.scrollHeight")
-        
-        while True:
-            imgs = self.browser.find_elements(By.XPATH,
-                                          '//div[@class="view photo-list-photo-view awake"]')
-            
-            if len(imgs) > max_count:
-                break
-            
-            self.browser.execute_script("arguments[0].scrollIntoView(true);", imgs[-1])
-            
-            last_height = self.browser.execute_script("return document.body.scrollHeight")
-            time.sleep(1)
+        finally:
+            if full:
+                logger.info('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('flickr_full', keyword, len(seen)))
+            else:
+                logger.info('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('flickr', keyword, len(seen)))
+            self.close()
 
-            for i in range(2):
-                elem.send_keys(Keys.PAGE_DOWN)
-                time.sleep(0.2)
+    @staticmethod
+    def scrape_flickr(imgs):
+        links = []
 
-            new_height = self.browser.execute_script("return document.body.scrollHeight")
-            
-            if not last_height == new_height:
-                continue
-            #     reached_page_end = True
-            # else:
-            #     last_height = new_height
-            
+        for img in imgs:
             try:
-                button = self.browser.find_element_by_xpath('//div[@class="infinite-scroll-load-more"]//button')
-                # self.browser.execute_script("arguments[0].click();", button)
-                button.send_keys(Keys.ENTER)
-                time.sleep(0.5)
-            except Exception as e:
-                # print(e)
-                try:
-                    self.browser.find_element_by_xpath('//div[@class="flickr-dots"]')
-                except:
-                    print('No buttons and loading..')
-                    print(e)
-                    break
-                else:
-                    while True:
-                        self.browser.find_element_by_xpath('//div[@class="flickr-dots"]')
-                    time.sleep(3)
+                src = BACKGROUND_URL_RE.search(img['style']).group(1)
+                if str(src).startswith('//'):
+                    src = "https:" + str(src)
+                links.append(src)
 
-        imgs = self.browser.find_elements(By.XPATH,
-                                          '//div[@class="view photo-list-photo-view awake"]')
+            except Exception as e:
+                logger.warning('[Exception occurred while collecting links from flickr] {}'.format(e))
 
-        print('Scraping links')
+        return links
 
-        links = []
+    def flickr_full_links(self, elem, max_count=10000):
+        logger.info('[Full Resolution Mode]')
+        self.browser.maximize_window()
 
-        if full:
-            print('[Full Resolution Mode]')
-            self.browser.maximize_window()
+        # self.wait_and_click('//div[@class="view photo-list-photo-view awake"]//a')
+        # time.sleep(1)
+        first_img = self.browser.find_element_by_xpath('//div[@class="view photo-list-photo-view awake"]//a')
+        self.highlight(first_img)
+        time.sleep(2)
+        self.browser.execute_script("arguments[0].click();", first_img)
 
-            # self.wait_and_click('//div[@class="view photo-list-photo-view awake"]//a')
-            # time.sleep(1)
-            first_img = self.browser.find_element_by_xpath('//div[@class="view photo-list-photo-view awake"]//a')
-            self.highlight(first_img)
-            time.sleep(2)
-            self.browser.execute_script("arguments[0].click();", first_img)
+        count = 0
 
-            while True:
-                try:
-                    w = WebDriverWait(self.browser, 5)
+        while True:
+            try:
+                w = WebDriverWait(self.browser, 5)
 
-                    xpath = '//div[@class="view photo-well-scrappy-view"]//img[@class="main-photo"]'
-                    img_low = w.until(EC.presence_of_element_located((By.XPATH, xpath)))
-                    src_low = img_low.get_attribute('src')
-                    src_low = src_low.split('.')
-                    src_low[-2] = '_'.join(src_low[-2].split('_')[:-1])
-                    src_low = '.'.join(src_low)
+                xpath = '//div[@class="view photo-well-scrappy-view"]//img[@class="main-photo"]'
+                img_low = w.until(EC.presence_of_element_located((By.XPATH, xpath)))
+                src_low = img_low.get_attribute('src')
+                src_low = src_low.split('.')
+                src_low[-2] = '_'.join(src_low[-2].split('_')[:-1])
+                src_low = '.'.join(src_low)
 
-                    w = WebDriverWait(self.browser, 3)
-                    xpath = '//div[@class="engagement-item download "]//i[@class="ui-icon-download"]'
-                    down_icon = w.until(EC.presence_of_element_located((By.XPATH, xpath)))
-                    self.highlight(down_icon)
-                    down_icon.click()
+                w = WebDriverWait(self.browser, 3)
+                xpath = '//div[@class="engagement-item download "]//i[@class="ui-icon-download"]'
+                down_icon = w.until(EC.presence_of_element_located((By.XPATH, xpath)))
+                self.highlight(down_icon)
+                down_icon.click()
 
-                except StaleElementReferenceException:
-                    # print('[Expected Exception - StaleElementReferenceException]')
-                    pass
-                except Exception as e:
-                    print('[Exception occurred while collecting links from flickr_full] {}'.format(e))
-                    time.sleep(1)
-                else:
-                    try:
-                        xpath = '//div[@class="content html-only auto-size"]'
-                        link_list = w.until(EC.presence_of_element_located((By.XPATH, xpath)))
-                        self.highlight(link_list)
-                        a_link = link_list.find_element((By.XPATH, '//li[@class="원본"]/a'))
-                        self.highlight(a_link)
-                        
-                        src = a_link.get_attribute('href')
-                    except:
-                        src = src_low
-                        escape = self.browser.find_element_by_xpath('//div[@class="fluid-modal-overlay transparent"]')
-                        escape.click()
-
-                    if src is not None:
-                        if not str(src).startswith('https:'):
-                            src = "https:" + str(src)
-                        links.append(src)
-                        print('%d: %s' % (len(links), src))
-
-                if len(links) > max_count:
-                    break
+            except StaleElementReferenceException:
+                # print('[Expected Exception - StaleElementReferenceException]')
+                pass
+            except Exception as e:
+                logger.warning('[Exception occurred while collecting links from flickr_full] {}'.format(e))
+                time.sleep(1)
+            else:
                 try:
-                    self.browser.find_element_by_xpath('//a[@class="navigate-target navigate-next"]')
+                    xpath = '//div[@class="content html-only auto-size"]'
+                    link_list = w.until(EC.presence_of_element_located((By.XPATH, xpath)))
+                    self.highlight(link_list)
+                    a_link = link_list.find_element((By.XPATH, '//li[@class="원본"]/a'))
+                    self.highlight(a_link)
+
+                    src = a_link.get_attribute('href')
                 except:
-                    print('!!!!!!!!!!!!!')
-                    time.sleep(10)
-                    break
+                    src = src_low
+                    escape = self.browser.find_element_by_xpath('//div[@class="fluid-modal-overlay transparent"]')
+                    escape.click()
 
-                elem.send_keys(Keys.RIGHT)
-                while True:
-                    loader_bar = self.browser.find_element_by_xpath('//div[@class="loader-bar"]')
-                    if loader_bar.get_attribute('display') == None:
-                        time.sleep(0.1)
-                        break
-                # time.sleep(0.5)
-        else:
-            for img in imgs:
-                try:
-                    src = img.get_attribute('style').split('background-image: url("')[-1]
-                    src = ''.join(src[:-3]) # get_attribute("style")["background-image"]
+                if src is not None:
                     if not str(src).startswith('https:'):
                         src = "https:" + str(src)
-                        links.append(src)
-
-                except Exception as e:
-                    print('[Exception occurred while collecting links from flickr] {}'.format(e))
-
-        links = self.remove_duplicates(links)
+                    count += 1
+                    logger.debug('%d: %s' % (count, src))
+                    yield src
 
-        if full:
-            print('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('flickr_full', keyword, len(links)))
-        else:
-            print('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('flickr', keyword, len(links)))
-        self.browser.close()
-        print('# links', len(links))
+            if not self.want_more(count, max_count):
+                break
+            try:
+                self.browser.find_element_by_xpath('//a[@class="navigate-target navigate-next"]')
+            except:
+                logger.debug('!!!!!!!!!!!!!')
+                time.sleep(10)
+                break
 
-        return links
+            elem.send_keys(Keys.RIGHT)
+            while True:
+                loader_bar = self.browser.find_element_by_xpath('//div[@class="loader-bar"]')
+                if loader_bar.get_attribute('display') == None:
+                    time.sleep(0.1)
+                    break
+            # time.sleep(0.5)
 
     def google_full(self, keyword, add_url="", max_count=10000):
-        print('[Full Resolution Mode]')
+        return list(self.google_full_iter(keyword, add_url, max_count))
 
-        self.browser.get("https://www.google.com/search?q={}&tbm=isch{}".format(keyword, add_url))
-        time.sleep(1)
+    def google_full_iter(self, keyword, add_url="", max_count=10000):
+        logger.info('[Full Resolution Mode]')
 
-        elem = self.browser.find_element_by_tag_name("body")
+        self.labels = {'site': 'google', 'keyword': keyword}
 
-        print('Scraping links')
+        if self.detail_workers > 1:
+            return self.detail_links(
+                'google_full', keyword, self.site_url('google', "/search?q={}&tbm=isch{}".format(keyword, add_url)),
+                box_xpath='//div[@data-ri]', more_xpath='//input[@type="button"]',
+                img_xpath='//div[@id="islsp"]//div[@class="v4dQwb"]//img[@class="n3VNCb"]',
+                loading_xpath='//div[@id="islsp"]//div[@class="v4dQwb"]//div[@class="k7O2sd"]', max_count=max_count)
+        return self.google_full_serial(keyword, add_url, max_count)
 
-        self.wait_and_click('//div[@data-ri="0"]')
-        time.sleep(1)
+    def google_full_serial(self, keyword, add_url="", max_count=10000):
+        seen = set()
 
-        links = []
-        count = 1
+        try:
+            self.load(self.site_url('google', "/search?q={}&tbm=isch{}".format(keyword, add_url)))
+            time.sleep(1)
 
-        last_scroll = 0
-        scroll_patience = 0
+            elem = self.browser.find_element_by_tag_name("body")
 
-        while True:
-            try:
-                xpath = '//div[@id="islsp"]//div[@class="v4dQwb"]'
-                div_box = self.browser.find_element(By.XPATH, xpath)
-                self.highlight(div_box)
+            logger.debug('Scraping links')
 
-                xpath = '//img[@class="n3VNCb"]'
-                img = div_box.find_element(By.XPATH, xpath)
-                self.highlight(img)
+            self.wait_and_click('//div[@data-ri="0"]')
+            time.sleep(1)
 
-                xpath = '//div[@class="k7O2sd"]'
-                loading_bar = div_box.find_element(By.XPATH, xpath)
+            last_scroll = 0
+            scroll_patience = 0
 
-                # Wait for image to load. If not it will display base64 code.
-                while str(loading_bar.get_attribute('style')) != 'display: none;':
-                    time.sleep(0.1)
+            while True:
+                try:
+                    xpath = '//div[@id="islsp"]//div[@class="v4dQwb"]'
+                    div_box = self.browser.find_element(By.XPATH, xpath)
+                    self.highlight(div_box)
 
-                src = img.get_attribute('src')
+                    xpath = '//img[@class="n3VNCb"]'
+                    img = div_box.find_element(By.XPATH, xpath)
+                    self.highlight(img)
 
-                if src is not None:
-                    links.append(src)
-                    # print('%d: %s' % (count, src))
-                    count += 1
+                    xpath = '//div[@class="k7O2sd"]'
+                    loading_bar = div_box.find_element(By.XPATH, xpath)
 
-            except StaleElementReferenceException:
-                # print('[Expected Exception - StaleElementReferenceException]')
-                pass
-            except Exception as e:
-                print('[Exception occurred while collecting links from google_full] {}'.format(e))
+                    # Wait for image to load. If not it will display base64 code.
+                    while str(loading_bar.get_attribute('style')) != 'display: none;':
+                        time.sleep(0.1)
 
-            scroll = self.get_scroll()
-            if scroll == last_scroll:
-                scroll_patience += 1
-            else:
-                scroll_patience = 0
-                last_scroll = scroll
+                    src = img.get_attribute('src')
 
-            if scroll_patience >= 50 or len(links) > max_count:
-                break
+                    yield from self.new_links(seen, [src])
 
-            elem.send_keys(Keys.RIGHT)
+                except StaleElementReferenceException:
+                    # print('[Expected Exception - StaleElementReferenceException]')
+                    pass
+                except Exception as e:
+                    logger.warning('[Exception occurred while collecting links from google_full] {}'.format(e))
+
+                scroll = self.get_scroll()
+                if scroll == last_scroll:
+                    scroll_patience += 1
+                else:
+                    scroll_patience = 0
+                    last_scroll = scroll
 
-        links = self.remove_duplicates(links)
+                if scroll_patience >= 50 or not self.want_more(len(seen), max_count):
+                    break
 
-        print('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('google_full', keyword, len(links)))
-        self.browser.close()
+                elem.send_keys(Keys.RIGHT)
 
-        return links
+        finally:
+            logger.info('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('google_full', keyword, len(seen)))
+            self.close()
 
     def naver_full(self, keyword, add_url="", max_count=10000):
-        print('[Full Resolution Mode]')
+        return list(self.naver_full_iter(keyword, add_url, max_count))
 
-        self.browser.get(
-            "https://search.naver.com/search.naver?where=image&sm=tab_jum&query={}{}".format(keyword, add_url))
-        time.sleep(1)
+    def naver_full_iter(self, keyword, add_url="", max_count=10000):
+        logger.info('[Full Resolution Mode]')
 
-        elem = self.browser.find_element_by_tag_name("body")
+        self.labels = {'site': 'naver', 'keyword': keyword}
 
-        print('Scraping links')
+        if self.detail_workers > 1:
+            return self.detail_links(
+                'naver_full', keyword,
+                self.site_url('naver', "/search.naver?where=image&sm=tab_jum&query={}{}".format(keyword, add_url)),
+                box_xpath='//div[@class="photo_bx api_ani_send _photoBox"]',
+                img_xpath='//div[@class="image _imageBox"]/img[@class="_image"]', max_count=max_count)
+        return self.naver_full_serial(keyword, add_url, max_count)
 
-        self.wait_and_click('//div[@class="photo_bx api_ani_send _photoBox"]')
-        time.sleep(1)
+    def naver_full_serial(self, keyword, add_url="", max_count=10000):
+        seen = set()
 
-        links = []
-        count = 1
+        try:
+            self.load(self.site_url(
+                'naver', "/search.naver?where=image&sm=tab_jum&query={}{}".format(keyword, add_url)))
+            time.sleep(1)
 
-        last_scroll = 0
-        scroll_patience = 0
+            elem = self.browser.find_element_by_tag_name("body")
 
-        while True:
-            try:
-                xpath = '//div[@class="image _imageBox"]/img[@class="_image"]'
-                imgs = self.browser.find_elements(By.XPATH, xpath)
+            logger.debug('Scraping links')
 
-                for img in imgs:
-                    self.highlight(img)
-                    src = img.get_attribute('src')
+            self.wait_and_click('//div[@class="photo_bx api_ani_send _photoBox"]')
+            time.sleep(1)
 
-                    if src not in links and src is not None:
-                        links.append(src)
-                        # print('%d: %s' % (count, src))
-                        count += 1
+            last_scroll = 0
+            scroll_patience = 0
 
-            except StaleElementReferenceException:
-                # print('[Expected Exception - StaleElementReferenceException]')
-                pass
-            except Exception as e:
-                print('[Exception occurred while collecting links from naver_full] {}'.format(e))
+            while True:
+                try:
+                    xpath = '//div[@class="image _imageBox"]/img[@class="_image"]'
+                    _, imgs = self.scrape_attributes(xpath, ['src'])
 
-            scroll = self.get_scroll()
-            if scroll == last_scroll:
-                scroll_patience += 1
-            else:
-                scroll_patience = 0
-                last_scroll = scroll
+                    yield from self.new_links(seen, [img['src'] for img in imgs])
 
-            if scroll_patience >= 100 or len(links) > max_count:
-                break
+                except StaleElementReferenceException:
+                    # print('[Expected Exception - StaleElementReferenceException]')
+                    pass
+                except Exception as e:
+                    logger.warning('[Exception occurred while collecting links from naver_full] {}'.format(e))
 
-            elem.send_keys(Keys.RIGHT)
-            elem.send_keys(Keys.PAGE_DOWN)
+                scroll = self.get_scroll()
+                if scroll == last_scroll:
+                    scroll_patience += 1
+                else:
+                    scroll_patience = 0
+                    last_scroll = scroll
+
+                if scroll_patience >= 100 or not self.want_more(len(seen), max_count):
+                    break
+
+                elem.send_keys(Keys.RIGHT)
+                elem.send_keys(Keys.PAGE_DOWN)
 
-        links = self.remove_duplicates(links)
+        finally:
+            logger.info('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('naver_full', keyword, len(seen)))
+            self.close()
+
+    def detail_links(self, site_name, keyword, url, box_xpath, img_xpath, loading_xpath=None, more_xpath=None,
+                     max_count=10000):
+        """
+        Yields full resolution links of the results of url in result order, resolving detail views with
+        detail_workers browsers at once. The result index range is split in chunks of DETAIL_CHUNK.
+        Each browser opens the detail view of the first result of the next free chunk and steps through
+        the chunk with the right arrow key. Chunks are merged back in order as they finish.
+        :param box_xpath: Result boxes in result order. Clicking one opens its detail view.
+        :param img_xpath: Full resolution image of the open detail view.
+        :param loading_xpath: Loading bar of the detail view, hidden once the image is loaded.
+        :param more_xpath: "Show more results" button.
+        """
+        max_chunks = max_count // DETAIL_CHUNK + 1 if max_count else None
+        chunks = {}  # chunk number -> links, None past the end of results
+        state = {'next': 0, 'end': max_chunks, 'workers': self.detail_workers}
+        cond = threading.Condition()
+        stop = threading.Event()
+
+        def claim():
+            with cond:
+                chunk = state['next']
+                if stop.is_set() or (state['end'] is not None and chunk >= state['end']) or \
+                        not self.want_more(chunk * DETAIL_CHUNK, max_count):
+                    return None
+                state['next'] += 1
+                return chunk
+
+        def finish(chunk, links):
+            with cond:
+                chunks[chunk] = links
+                if links is None:
+                    state['end'] = chunk if state['end'] is None else min(state['end'], chunk)
+                cond.notify_all()
+
+        def work(n):
+            collect = None
+            failures = 0
+            try:
+                collect = self if n == 0 else self.spawn()
+                collect.load(url)
+                time.sleep(1)
+                while failures < 3:
+                    chunk = claim()
+                    if chunk is None:
+                        break
+                    try:
+                        links = collect.detail_chunk(chunk * DETAIL_CHUNK, box_xpath, img_xpath, loading_xpath,
+                                                     more_xpath, stop)
+                        failures = 0
+                    except Exception as e:
+                        logger.warning('[Exception occurred while collecting links from {}] {}'.format(site_name, e))
+                        links = []
+                        failures += 1
+                    finish(chunk, links)
+            except Exception as e:
+                logger.warning('[Exception occurred while starting a browser for {}] {}'.format(site_name, e))
+            finally:
+                if collect is not None and collect is not self:
+                    collect.close()
+                with cond:
+                    state['workers'] -= 1
+                    cond.notify_all()
+
+        workers = [threading.Thread(target=work, args=(n,), daemon=True) for n in range(self.detail_workers)]
+        for worker in workers:
+            worker.start()
+
+        seen = set()
+        try:
+            chunk = 0
+            while self.want_more(len(seen), max_count):
+                with cond:
+                    # Chunks claimed by a worker that gave up never finish.
+                    while chunk not in chunks and state['workers'] > 0 and \
+                            (state['end'] is None or chunk < state['end']):
+                        cond.wait()
+                    links = chunks.pop(chunk, None)
+                if links is None:
+                    break
+                yield from self.new_links(seen, links)
+                chunk += 1
+
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join()
+            logger.info('Collect links done. Site: {}, Keyword: {}, Total: {}'.format(site_name, keyword, len(seen)))
+            self.close()
+
+    def detail_chunk(self, start, box_xpath, img_xpath, loading_xpath=None, more_xpath=None, stop=None):
+        """
+        Opens the detail view of result start and reads DETAIL_CHUNK images, pressing the right arrow key between them.
+        :return: Links, None if there is no result start
+        """
+        # Scrolls until result start is loaded.
+        for count in self.scroll_batches(box_xpath, more_xpath=more_xpath):
+            if count > start:
+                break
+        boxes = self.browser.find_elements(By.XPATH, box_xpath)
+        if len(boxes) <= start:
+            return None
+
+        self.browser.execute_script("arguments[0].scrollIntoView(); arguments[0].click();", boxes[start])
+        if self.network_capture:
+            self.browser.get_log('performance')  # not read in detail views, don't let it pile up
+        body = self.browser.find_element(By.TAG_NAME, 'body')
 
-        print('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('naver_full', keyword, len(links)))
-        self.browser.close()
+        links = []
+        src = None
+        for i in range(DETAIL_CHUNK):
+            if stop is not None and stop.is_set():
+                break
+            if i > 0:
+                body.send_keys(Keys.RIGHT)
+            src = self.wait_detail_src(img_xpath, loading_xpath, previous=src)
+            if src is None:
+                break  # the last result, or stuck
+            links.append(src)
 
         return links
 
+    def wait_detail_src(self, img_xpath, loading_xpath=None, previous=None, timeout=5):
+        """
+        :return: Src of the detail view image once loaded and different from previous, None on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                src = self.browser.execute_script(DETAIL_SRC_JS, img_xpath, loading_xpath)
+            except StaleElementReferenceException:
+                src = None
+            if src and src != previous:
+                return src
+            time.sleep(0.1)
+        return None
+
     def unsplash_full(self, keyword, add_url="", max_count=10000):
         return self.unsplash(keyword, add_url, srcset_idx=-1, max_count=max_count)
-    
+
+    def unsplash_full_iter(self, keyword, add_url="", max_count=10000):
+        return self.unsplash_iter(keyword, add_url, srcset_idx=-1, max_count=max_count)
+
     def flickr_full(self, keyword, add_url="", max_count=10000):
         return self.flickr(keyword, add_url, max_count, full=True)
-        
+
+    def flickr_full_iter(self, keyword, add_url="", max_count=10000):
+        return self.flickr_iter(keyword, add_url, max_count, full=True)
+
+
+class LinkStream:
+    _END = object()
+
+    def __init__(self, link_iter, queue_size=0):
+        """
+        Runs a link generator (ex. CollectLinks.google_iter) in a background thread,
+        so links can be downloaded while the browser is still scrolling.
+        Iterate this object to consume links. Call stop() once enough images are saved.
+        """
+        self.link_iter = link_iter
+        self.queue = queue.Queue(queue_size)
+        self.stop_event = threading.Event()
+        self.count = 0
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    def _produce(self):
+        try:
+            for link in self.link_iter:
+                if self.stop_event.is_set():
+                    break
+                self.queue.put(link)
+        except Exception as e:
+            logger.error('[Exception occurred while streaming links] {}'.format(e))
+        finally:
+            # Runs the collector's cleanup (close) when stopped early.
+            close = getattr(self.link_iter, 'close', None)
+            if close is not None:
+                close()
+            self.queue.put(self._END)
+
+    def __iter__(self):
+        while True:
+            link = self.queue.get()
+            if link is self._END:
+                self.queue.put(self._END)
+                return
+            self.count += 1
+            yield link
+
+    def stop(self):
+        self.stop_event.set()
+
+    def join(self, timeout=None):
+        self.thread.join(timeout)
+
 
 if __name__ == '__main__':
     collect = CollectLinks()
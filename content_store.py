@@ -0,0 +1,223 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import uuid
+from image_stream import ImageSniffer, check_complete, MAX_HEADER_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+class DuplicateImageError(Exception):
+    pass
+
+
+class SpoolFile:
+    def __init__(self, tmp_path, max_memory):
+        """
+        Keeps small bodies in memory and spills to tmp_path once max_memory is exceeded,
+        so duplicates found after hashing are usually never written to disk.
+        """
+        self.tmp_path = tmp_path
+        self.max_memory = max_memory
+        self.buffer = io.BytesIO()
+        self.file = None
+
+    def write(self, data):
+        if self.file is None and self.buffer.tell() + len(data) > self.max_memory:
+            self.file = open(self.tmp_path, 'wb')
+            self.file.write(self.buffer.getvalue())
+            self.buffer = None
+
+        if self.file is not None:
+            self.file.write(data)
+        else:
+            self.buffer.write(data)
+
+    def commit(self, path):
+        if self.file is None:
+            with open(self.tmp_path, 'wb') as file:
+                file.write(self.buffer.getvalue())
+            self.buffer = None
+        else:
+            self.file.close()
+        os.replace(self.tmp_path, path)
+
+    def discard(self):
+        self.buffer = None
+        if self.file is not None:
+            self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class ContentStore:
+    def __init__(self, root, link_mode='hardlink', spool_size=8 * 1024 * 1024):
+        """
+        Content-addressed image store. Each distinct image is stored once at
+        <root>/_objects/<digest[:2]>/<digest>.<ext>, and every keyword/site that found it
+        gets a hardlink at the usual <keyword>/<site>/NNNN.<ext> path, or a line in <keyword>/<site>_members.jsonl.
+        :param root: Download folder path
+        :param link_mode: 'hardlink' or 'manifest'. Hardlinks fall back to the manifest across devices.
+        :param spool_size: Bodies up to this size are hashed in memory before touching disk.
+        """
+        if link_mode not in ('hardlink', 'manifest'):
+            raise ValueError('Unknown link mode {}'.format(link_mode))
+
+        self.root = root
+        self.objects_dir = os.path.join(root, '_objects')
+        self.tmp_dir = os.path.join(self.objects_dir, 'tmp')
+        self.link_mode = link_mode
+        self.spool_size = spool_size
+
+        self.digests = set()  # in-memory index of objects known to exist on disk
+        self.members = {}  # member dir -> digests linked there in this run
+        self.lock = threading.Lock()
+
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def object_path(self, digest, ext):
+        return os.path.join(self.objects_dir, digest[:2], '{}.{}'.format(digest, ext))
+
+    def has_object(self, digest, ext):
+        with self.lock:
+            if digest in self.digests:
+                return True
+
+        if os.path.exists(self.object_path(digest, ext)):
+            with self.lock:
+                self.digests.add(digest)
+            return True
+
+        return False
+
+    def open(self, no_ext_path, expected_size=None, max_header_bytes=MAX_HEADER_BYTES, link=None):
+        """
+        Stores the bytes once per digest. commit() of the writer raises DuplicateImageError
+        if the same image was already saved for this keyword/site.
+        :param link: Source url, recorded in manifest mode.
+        :return: Incremental writer with the same interface as image_stream.ImageFileWriter
+        """
+        return ContentStoreWriter(self, no_ext_path, expected_size, max_header_bytes, link)
+
+    def commit(self, spool, no_ext_path, digest, sniffer, link=None):
+        member_dir = os.path.dirname(no_ext_path)
+        with self.lock:
+            member_digests = self.members.setdefault(member_dir, set())
+            if digest in member_digests:
+                raise DuplicateImageError('Duplicate image {}'.format(digest))
+            member_digests.add(digest)  # claimed now, so a concurrent duplicate is not stored twice
+
+        try:
+            object_path = self.object_path(digest, sniffer.ext)
+            if self.has_object(digest, sniffer.ext):
+                spool.discard()
+            else:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                spool.commit(object_path)
+                with self.lock:
+                    self.digests.add(digest)
+
+            path = no_ext_path + '.' + sniffer.ext
+            if not (self.link_mode == 'hardlink' and self.hardlink(object_path, path)):
+                self.add_member(member_dir, no_ext_path, digest, sniffer, link)
+                path = object_path
+        except OSError:
+            # Not saved for this keyword/site, so a retry must not count as a duplicate.
+            with self.lock:
+                member_digests.discard(digest)
+            raise
+
+        return path
+
+    @staticmethod
+    def hardlink(object_path, path):
+        tmp_path = path + '.part'
+        try:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            os.link(object_path, tmp_path)
+            os.replace(tmp_path, path)
+            return True
+        except OSError as e:
+            logger.warning('Hardlink failed, recording in manifest instead - {}'.format(e))
+            return False
+
+    def add_member(self, member_dir, no_ext_path, digest, sniffer, link=None):
+        manifest_path = member_dir + '_members.jsonl'
+        line = json.dumps({'name': os.path.basename(no_ext_path) + '.' + sniffer.ext, 'digest': digest,
+                           'format': sniffer.ext, 'size': list(sniffer.size), 'url': link}, ensure_ascii=False)
+        with self.lock:
+            with open(manifest_path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+class ContentStoreWriter:
+    def __init__(self, store, no_ext_path, expected_size=None, max_header_bytes=MAX_HEADER_BYTES, link=None):
+        self.store = store
+        self.no_ext_path = no_ext_path
+        self.expected_size = expected_size
+        self.link = link
+        self.sniffer = ImageSniffer(max_header_bytes)
+        self.hasher = hashlib.sha256()
+        self.spool = SpoolFile(os.path.join(store.tmp_dir, '{}.part'.format(uuid.uuid4().hex)), store.spool_size)
+        self.digest = None
+
+    def write(self, chunk):
+        self.sniffer.feed(chunk)
+        self.hasher.update(chunk)
+        self.spool.write(chunk)
+
+    def commit(self):
+        """
+        :return: (path, sniffer)
+        :raises DuplicateImageError: Same image was already saved for this keyword/site.
+        """
+        check_complete(self.sniffer, self.expected_size)
+        self.digest = self.hasher.hexdigest()
+        path = self.store.commit(self.spool, self.no_ext_path, self.digest, self.sniffer, self.link)
+        return path, self.sniffer
+
+    def abort(self):
+        self.spool.discard()
+
+
+_content_stores = {}
+_content_stores_pid = None
+_content_stores_lock = threading.Lock()
+
+
+def get_content_store(root, link_mode='hardlink'):
+    """
+    Returns the ContentStore shared by every download in this process for root.
+    """
+    global _content_stores, _content_stores_pid
+
+    with _content_stores_lock:
+        if _content_stores_pid != os.getpid():
+            _content_stores = {}
+            _content_stores_pid = os.getpid()
+
+        key = (root, link_mode)
+        if key not in _content_stores:
+            _content_stores[key] = ContentStore(root, link_mode)
+
+        return _content_stores[key]
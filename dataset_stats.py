@@ -0,0 +1,241 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import argparse
+import json
+import logging
+import os
+from multiprocessing import Pool
+from shard_sink import read_indexes
+from task_manifest import TaskManifest
+
+logger = logging.getLogger(__name__)
+
+
+def write_json_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class TaskStats:
+    def __init__(self, path, load=True):
+        """
+        Saved images of one (keyword, site) task, updated as each image is saved.
+        Keyed by file name, so an image saved again under the same name is counted once.
+        :param path: ex) download/<keyword>/<site>_stats.json
+        """
+        self.path = path
+        self.files = {}  # name -> [bytes, format]
+
+        if load and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.files = json.load(f)['files']
+            except (ValueError, KeyError) as e:
+                logger.warning('Ignoring broken stats file {} - {}'.format(path, e))
+
+    def add(self, name, length, fmt):
+        self.files[name] = [length, fmt]
+
+    def summary(self):
+        """
+        :return: {'count': images, 'bytes': total size, 'formats': {'jpg': count, ...}}
+        """
+        formats = {}
+        n_bytes = 0
+        for length, fmt in self.files.values():
+            formats[fmt] = formats.get(fmt, 0) + 1
+            n_bytes += length
+        return {'count': len(self.files), 'bytes': n_bytes, 'formats': formats}
+
+    def save(self):
+        write_json_atomic(self.path, {'files': self.files})
+
+
+class StatsIndex:
+    def __init__(self, path):
+        """
+        Per keyword/site image counts of the whole download folder.
+        The main process updates it from each task result, so reports never rescan the download tree.
+        :param path: ex) download/_stats.json
+        """
+        self.path = path
+        self.entries = {}  # keyword -> site -> TaskStats.summary()
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def update(self, keyword, site, summary):
+        self.entries.setdefault(keyword, {})[site] = summary
+
+    def remove(self, keyword):
+        self.entries.pop(keyword, None)
+
+    def save(self):
+        write_json_atomic(self.path, self.entries)
+
+    def keyword_counts(self):
+        return {keyword: sum(site['count'] for site in sites.values()) for keyword, sites in self.entries.items()}
+
+    def balance_report(self, threshold=0.5):
+        """
+        :param threshold: Keywords with fewer images than this fraction of the average are under-filled.
+        :return: (average images per keyword, {keyword: count} of under-filled keywords)
+        """
+        counts = self.keyword_counts()
+        if not counts:
+            return 0, {}
+
+        avg = sum(counts.values()) / len(counts)
+        return avg, {keyword: count for keyword, count in counts.items() if count < avg * threshold}
+
+
+def record_renames(renames, index=None):
+    """
+    Updates the task stats files and manifests of images rewritten under a new name. ex) by the normalizer
+    :param renames: [(path, new path, new size), ...]
+                    ex) [('download/cat/google/0001.png', 'download/cat/google/0001.jpg', 4096)]
+    :param index: StatsIndex to update with the new summaries
+    """
+    tasks = {}  # (keyword folder, site) -> [(name, new path, new size)]
+    for path, new_path, length in renames:
+        site_dir, name = os.path.split(path)
+        keyword_dir, site = os.path.split(site_dir)
+        tasks.setdefault((keyword_dir, site), []).append((name, new_path, length))
+
+    for (keyword_dir, site), files in tasks.items():
+        stats = TaskStats(os.path.join(keyword_dir, '{}_stats.json'.format(site)))
+        manifest_path = os.path.join(keyword_dir, '{}_manifest.jsonl'.format(site))
+        manifest = TaskManifest(manifest_path) if os.path.exists(manifest_path) else None
+
+        for name, new_path, length in files:
+            new_name = os.path.basename(new_path)
+            stats.files.pop(name, None)
+            stats.add(new_name, length, os.path.splitext(new_name)[1][1:].lower())
+            file_index = os.path.splitext(name)[0]
+            if manifest and file_index.isdigit() and manifest.is_done(int(file_index)):
+                manifest.set_done(int(file_index), length, new_path)
+
+        stats.save()
+        if manifest:
+            manifest.close()
+        if index is not None:
+            index.update(os.path.basename(keyword_dir), site, stats.summary())
+
+    if index is not None:
+        index.save()
+
+
+def scan_keyword(args):
+    """
+    Counts images of every site of a keyword folder on disk and rewrites their task stats files.
+    :param args: (download_path, keyword, {site: {name: [bytes, format]}} of the keyword's images in tar shards)
+    :return: (keyword, {site: TaskStats.summary()})
+    """
+    download_path, keyword, shard_files = args
+    keyword_dir = os.path.join(download_path, keyword)
+    sites = {}
+
+    site_names = set(shard_files)
+    if os.path.isdir(keyword_dir):
+        # <site>_original: originals kept by the normalizer, already counted under <site>
+        site_names.update(entry.name for entry in os.scandir(keyword_dir)
+                          if entry.is_dir() and not entry.name.endswith('_original'))
+
+    for site in sorted(site_names):
+        site_dir = os.path.join(keyword_dir, site)
+        stats = TaskStats(os.path.join(keyword_dir, '{}_stats.json'.format(site)), load=False)
+        stats.files.update(shard_files.get(site, {}))
+
+        for file in (os.scandir(site_dir) if os.path.isdir(site_dir) else []):
+            if file.is_file() and not file.name.endswith('.part'):
+                stats.add(file.name, file.stat().st_size, os.path.splitext(file.name)[1][1:].lower())
+
+        # Content store 'manifest' mode records images here instead of linking them into the site folder.
+        members_path = site_dir + '_members.jsonl'
+        if os.path.exists(members_path):
+            with open(members_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        member = json.loads(line)
+                    except ValueError:
+                        continue
+                    digest, fmt = member['digest'], member['format']
+                    object_path = os.path.join(download_path, '_objects', digest[:2], '{}.{}'.format(digest, fmt))
+                    length = os.path.getsize(object_path) if os.path.exists(object_path) else 0
+                    stats.add(member['name'], length, fmt)
+
+        os.makedirs(keyword_dir, exist_ok=True)
+        stats.save()
+        sites[site] = stats.summary()
+
+    return keyword, sites
+
+
+def rebuild_index(download_path, n_workers=None):
+    """
+    Rebuilds download_path/_stats.json from the files on disk, one keyword folder per worker process.
+    :return: StatsIndex
+    """
+    index = StatsIndex(os.path.join(download_path, '_stats.json'))
+    index.entries = {}
+
+    # keyword -> site -> {name: [bytes, format]}, from the indexes of the tar shards
+    shard_files = {}
+    for _, entry in read_indexes(os.path.join(download_path, '_shards')).values():
+        keyword, site, name = entry['name'].rsplit('/', 2)
+        shard_files.setdefault(keyword, {}).setdefault(site, {})[name] = [entry['size'], entry['format']]
+
+    keywords = {entry.name for entry in os.scandir(download_path)
+                if entry.is_dir() and not entry.name.startswith('_')}  # ex) _objects of the content store
+    keywords.update(shard_files)
+
+    with Pool(n_workers) as pool:
+        tasks = [(download_path, keyword, shard_files.get(keyword, {})) for keyword in sorted(keywords)]
+        for keyword, sites in pool.imap_unordered(scan_keyword, tasks):
+            for site, summary in sites.items():
+                index.update(keyword, site, summary)
+
+    index.save()
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuilds the dataset statistics index from the download folder.')
+    parser.add_argument('--download-path', type=str, default='download', help='Download folder.')
+    parser.add_argument('--workers', type=int, default=0, help='Worker processes. (0: number of CPUs)')
+    parser.add_argument('--threshold', type=float, default=0.5,
+                        help='Report keywords with fewer images than this fraction of the average.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    index = rebuild_index(args.download_path, args.workers if args.workers > 0 else None)
+    for keyword, sites in sorted(index.entries.items()):
+        for site, summary in sorted(sites.items()):
+            logger.info('{} / {}: {} images, {:.1f}MB, {}'.format(keyword, site, summary['count'],
+                                                                 summary['bytes'] / 1024 / 1024, summary['formats']))
+
+    avg, too_small = index.balance_report(args.threshold)
+    logger.info('{} keywords, {:.1f} images per keyword on average'.format(len(index.entries), avg))
+    for keyword, count in sorted(too_small.items()):
+        logger.info('Under-filled: {} ({} images)'.format(keyword, count))
@@ -0,0 +1,179 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import logging
+import os
+import threading
+from multiprocessing import util
+from collect_links import CollectLinks
+
+logger = logging.getLogger(__name__)
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+class DriverPool:
+    def __init__(self, no_gui=False, max_tasks=50, max_rss_mb=2048, max_idle=2, network_capture=False):
+        """
+        Long-lived Chrome drivers reused across (keyword, site) tasks of one worker process.
+        :param no_gui: Headless mode for new drivers.
+        :param max_tasks: Recycle a driver after this many tasks. (0: never)
+        :param max_rss_mb: Recycle a driver when its chromedriver + chrome processes use more memory. (0: never, needs psutil)
+        :param max_idle: Idle drivers kept per proxy.
+        :param network_capture: Create drivers for CollectLinks(network_capture=True).
+        """
+        self.no_gui = no_gui
+        self.max_tasks = max_tasks
+        self.max_rss_mb = max_rss_mb
+        self.max_idle = max_idle
+        self.network_capture = network_capture
+
+        self.idle = {}  # proxy -> [browser]
+        self.proxies = {}  # id(browser) -> proxy
+        self.tasks = {}  # id(browser) -> tasks done
+        self.lock = threading.Lock()
+
+        if max_rss_mb and psutil is None:
+            logger.warning('psutil is not installed - driver memory recycling disabled.')
+
+    def acquire(self, proxy=None):
+        while True:
+            with self.lock:
+                idle = self.idle.get(proxy, [])
+                browser = idle.pop() if idle else None
+
+            if browser is None:
+                browser = CollectLinks.create_browser(self.no_gui, proxy, self.network_capture)
+                with self.lock:
+                    self.proxies[id(browser)] = proxy
+                    self.tasks[id(browser)] = 0
+                return browser
+
+            if self.is_healthy(browser):
+                return browser
+
+            logger.info('Discarding unhealthy chrome driver')
+            self.quit(browser)
+
+    def release(self, browser):
+        with self.lock:
+            self.tasks[id(browser)] = self.tasks.get(id(browser), 0) + 1
+            n_tasks = self.tasks[id(browser)]
+            proxy = self.proxies.get(id(browser))
+
+        if self.max_tasks and n_tasks >= self.max_tasks:
+            logger.info('Recycling chrome driver after {} tasks'.format(n_tasks))
+            self.quit(browser)
+            return
+
+        rss_mb = self.get_rss_mb(browser)
+        if self.max_rss_mb and rss_mb is not None and rss_mb >= self.max_rss_mb:
+            logger.info('Recycling chrome driver using {:.0f}MB'.format(rss_mb))
+            self.quit(browser)
+            return
+
+        if not self.reset(browser):
+            self.quit(browser)
+            return
+
+        with self.lock:
+            idle = self.idle.setdefault(proxy, [])
+            if len(idle) < self.max_idle:
+                idle.append(browser)
+                return
+
+        self.quit(browser)
+
+    @staticmethod
+    def is_healthy(browser):
+        try:
+            return browser.execute_script('return 1;') == 1
+        except Exception:
+            return False
+
+    @staticmethod
+    def reset(browser):
+        # Leaves one blank tab without cookies, like a new browser.
+        try:
+            handles = browser.window_handles
+            for handle in handles[1:]:
+                browser.switch_to.window(handle)
+                browser.close()
+            browser.switch_to.window(handles[0])
+            browser.get('about:blank')
+            try:
+                browser.execute_cdp_cmd('Network.clearBrowserCookies', {})
+            except Exception:
+                browser.delete_all_cookies()
+            return True
+        except Exception as e:
+            logger.warning('Failed to reset chrome driver - {}'.format(e))
+            return False
+
+    @staticmethod
+    def get_rss_mb(browser):
+        if psutil is None:
+            return None
+
+        try:
+            process = psutil.Process(browser.service.process.pid)
+            processes = [process] + process.children(recursive=True)
+            return sum(p.memory_info().rss for p in processes) / 1024 / 1024
+        except Exception:
+            return None
+
+    def quit(self, browser):
+        with self.lock:
+            self.proxies.pop(id(browser), None)
+            self.tasks.pop(id(browser), None)
+
+        try:
+            browser.quit()
+        except Exception as e:
+            logger.warning('Failed to quit chrome driver - {}'.format(e))
+
+    def close(self):
+        with self.lock:
+            browsers = [browser for idle in self.idle.values() for browser in idle]
+            self.idle = {}
+
+        for browser in browsers:
+            self.quit(browser)
+
+
+_driver_pool = None
+_driver_pool_pid = None
+_driver_pool_lock = threading.Lock()
+
+
+def get_driver_pool(**kwargs):
+    """
+    Returns the DriverPool of this process. Idle drivers are quit when the process exits,
+    including multiprocessing pool workers, which skip atexit handlers.
+    :param kwargs: DriverPool arguments, used only when the pool is created.
+    """
+    global _driver_pool, _driver_pool_pid
+
+    with _driver_pool_lock:
+        if _driver_pool is None or _driver_pool_pid != os.getpid():
+            _driver_pool = DriverPool(**kwargs)
+            _driver_pool_pid = os.getpid()
+            util.Finalize(None, _driver_pool.close, exitpriority=10)
+
+    return _driver_pool
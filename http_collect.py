@@ -0,0 +1,196 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import html
+import json
+import logging
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, quote_plus
+import requests
+from collect_links import CollectLinks
+from http_pool import get_session_pool
+from retry import RetryError, RetryableError
+
+logger = logging.getLogger(__name__)
+
+# Sites HttpCollectLinks can collect.
+HTTP_SITES = ('unsplash', 'flickr')
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+
+UNSPLASH_PER_PAGE = 30
+
+# Style attribute of a result of the flickr result grid. Other background images of the page are not results.
+FLICKR_PHOTO_VIEW_RE = re.compile(r'<div\b[^>]*\bphoto-list-photo-view\b[^>]*?\bstyle="([^"]*)"')
+
+# https://live.staticflickr.com/65535/123_abc_m.jpg -> 123_abc_b.jpg (1024px, the largest size with the same secret)
+FLICKR_SIZE_RE = re.compile(r'^(.*staticflickr\.com/.*/\d+_[0-9a-f]+)(?:_[a-z0-9]{1,2})?(\.\w+)$')
+
+
+class HttpCollectLinks(CollectLinks):
+    def __init__(self, session_pool=None, proxy=None, retry_policy=None, base_urls=None, proxy_manager=None,
+                 proxy_site=None, page_concurrency=4, budget=None):
+        """
+        Collects unsplash and flickr links from their search results over pooled HTTP instead of a browser.
+        Result pages are fetched page_concurrency at a time and their links yielded in page order.
+        Same iterators as CollectLinks for these sites. Other sites need CollectLinks.
+        :param session_pool: SessionPool for result pages. (None: the one of this process)
+        :param page_concurrency: Result pages fetched at once.
+        :param budget: CrawlBudget of the task. No more pages are fetched once it wants no more links.
+        """
+        self.session_pool = session_pool if session_pool is not None else get_session_pool()
+        self.page_concurrency = max(1, int(page_concurrency))
+        super().__init__(proxy=proxy, retry_policy=retry_policy, base_urls=base_urls, proxy_manager=proxy_manager,
+                         proxy_site=proxy_site, budget=budget)
+
+    def open_browser(self):
+        pass  # result pages come over HTTP
+
+    def close(self):
+        pass
+
+    def fetch(self, url):
+        """
+        :return: Response text of url, retried on connection errors and 429/5xx
+        """
+        def get():
+            response = self.session_pool.get(url, proxy=self.proxy, headers=HEADERS)
+            if response.status_code == 429 or response.status_code >= 500:
+                raise RetryableError('HTTP {}'.format(response.status_code))
+            response.raise_for_status()
+            return response.text
+
+        start = time.monotonic()
+        with self.metrics.timer('page_load_seconds', **self.labels):
+            try:
+                text = self.retry_policy.call(get, url=url, retry_on=(RetryableError, requests.ConnectionError,
+                                                                      requests.Timeout))
+            except (RetryError, requests.RequestException, ValueError):
+                if self.proxy_manager is not None:
+                    self.proxy_manager.report(self.proxy, self.proxy_site, False)
+                raise
+        if self.proxy_manager is not None:
+            self.proxy_manager.report(self.proxy, self.proxy_site, True, time.monotonic() - start)
+        return text
+
+    def pages(self, page_url, parse, max_count=None):
+        """
+        Yields the links of result pages 1, 2, ... until a page has no links or the last page.
+        :param page_url: page number -> url
+        :param parse: page text -> (links, number of pages or None if unknown)
+        :param max_count: Stops once more than max_count links are yielded or the budget is met. (0 or None: no limit)
+        """
+        executor = ThreadPoolExecutor(max_workers=self.page_concurrency)
+        fetching = deque()
+        next_page = 1
+        n_pages = None
+        count = 0
+
+        try:
+            while True:
+                while len(fetching) < self.page_concurrency and (n_pages is None or next_page <= n_pages) and \
+                        self.want_more(count, max_count):
+                    fetching.append(executor.submit(lambda url: parse(self.fetch(url)), page_url(next_page)))
+                    next_page += 1
+                if not fetching:
+                    break
+
+                links, pages = fetching.popleft().result()
+                n_pages = pages if pages is not None else n_pages
+                if not links:
+                    break
+
+                count += len(links)
+                yield links
+                if not self.want_more(count, max_count):
+                    break
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def unsplash_iter(self, keyword, add_url="", srcset_idx=0, max_count=10000):
+        """
+        :param srcset_idx: 0 - small (400px wide), -1 - full size. Same meaning as for CollectLinks.
+        """
+        self.labels = {'site': 'unsplash', 'keyword': keyword}
+        seen = set()
+        size = 'full' if srcset_idx == -1 else 'small'
+
+        def page_url(page):
+            return self.site_url('unsplash', '/napi/search/photos?query={}&per_page={}&page={}'.format(
+                quote_plus(keyword), UNSPLASH_PER_PAGE, page))
+
+        try:
+            for links in self.pages(page_url, lambda text: self.parse_unsplash(text, size), max_count):
+                n_seen = len(seen)
+                yield from self.new_links(seen, links)
+                if len(seen) == n_seen:
+                    break  # a page past the end repeating the last one
+        finally:
+            logger.info('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('unsplash', keyword, len(seen)))
+
+    @staticmethod
+    def parse_unsplash(text, size='small'):
+        """
+        :param text: /napi/search/photos response
+        :param size: 'small' (400px wide), 'regular' (1080px wide) or 'full'
+        :return: (links, number of pages)
+        """
+        data = json.loads(text)
+        # Unsplash+ results are watermarked previews of paid photos.
+        links = [result['urls'][size] for result in data.get('results', [])
+                 if result.get('urls', {}).get(size) and not result.get('premium')]
+        return links, data.get('total_pages')
+
+    def flickr_iter(self, keyword, add_url="", max_count=10000, full=False):
+        """
+        :param full: Links to the 1024px size instead of the thumbnails of the result grid.
+        """
+        self.labels = {'site': 'flickr', 'keyword': keyword}
+        seen = set()
+
+        def page_url(page):
+            return self.site_url('flickr', '/search/?text={}&media=photos{}&page={}'.format(quote(keyword), add_url,
+                                                                                           page))
+
+        try:
+            for links in self.pages(page_url, lambda text: self.parse_flickr(text, full), max_count):
+                n_seen = len(seen)
+                yield from self.new_links(seen, links)
+                if len(seen) == n_seen:
+                    break  # a page past the end repeating the last one
+        finally:
+            logger.info('Collect links done. Site: {}, Keyword: {}, Total: {}'.format(
+                'flickr_full' if full else 'flickr', keyword, len(seen)))
+
+    @staticmethod
+    def parse_flickr(text, full=False):
+        """
+        :param text: Search result page. The server renders the result grid with the same background-image styles
+                     the browser collector reads.
+        :param full: Links to the 1024px size instead of the thumbnails.
+        :return: (links, None - the number of pages is unknown)
+        """
+        styles = [{'style': html.unescape(match.group(1))} for match in FLICKR_PHOTO_VIEW_RE.finditer(text)]
+        links = CollectLinks.scrape_flickr(styles)
+        if full:
+            links = [FLICKR_SIZE_RE.sub(r'\1_b\2', link) for link in links]
+        return links, None
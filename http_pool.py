@@ -0,0 +1,103 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from proxy_manager import requests_proxy
+
+
+class SessionPool:
+    def __init__(self, pool_size=16, max_retries=3, backoff_factor=0.5, keep_alive=True, timeout=(10, 30)):
+        """
+        Keep-alive requests sessions keyed by (host, proxy).
+        :param pool_size: Maximum number of kept-alive connections per session.
+        :param max_retries: Immediate retries of failed connection attempts. 429/5xx responses and read errors
+                            are not retried here, they go through RetryPolicy and its rate limiter.
+        :param backoff_factor: Retry backoff factor. (sleep = backoff_factor * 2 ** (retry - 1))
+        :param keep_alive: False sends "Connection: close" and disables connection reuse.
+        :param timeout: (connect, read) timeout in seconds.
+        """
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def new_session(self, proxy=None):
+        # Connect retries only. A second retry layer for 429/5xx would multiply the requests of RetryPolicy
+        # and bypass its per-host token buckets and retries_total.
+        retry = Retry(total=self.max_retries, connect=self.max_retries, read=False, status=0, other=0,
+                      backoff_factor=self.backoff_factor, allowed_methods=frozenset(['GET', 'HEAD']),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry, pool_block=False)
+
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        if proxy:
+            session.proxies = {'http': requests_proxy(proxy), 'https': requests_proxy(proxy)}
+        return session
+
+    def get_session(self, link, proxy=None):
+        key = (urlsplit(str(link)).netloc, proxy)
+
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = self.new_session(proxy)
+                self.sessions[key] = session
+
+        return session
+
+    def get(self, link, proxy=None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.get_session(link, proxy).get(link, **kwargs)
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+
+
+_session_pool = None
+_session_pool_pid = None
+_session_pool_lock = threading.Lock()
+
+
+def get_session_pool(**kwargs):
+    """
+    Returns the SessionPool shared by every download in this process.
+    Sessions are never shared across processes, so forked pool workers get their own.
+    :param kwargs: SessionPool arguments, used only when the pool is created.
+    """
+    global _session_pool, _session_pool_pid
+
+    with _session_pool_lock:
+        if _session_pool is None or _session_pool_pid != os.getpid():
+            _session_pool = SessionPool(**kwargs)
+            _session_pool_pid = os.getpid()
+
+    return _session_pool
@@ -0,0 +1,326 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import io
+import os
+from PIL import Image
+
+CHUNK_SIZE = 64 * 1024
+HEADER_CHUNK_SIZE = 8 * 1024  # first read of a filtered download, enough for the header of most images
+MAX_HEADER_BYTES = 256 * 1024
+
+JPEG_SOF_MARKERS = {0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf}
+JPEG_STANDALONE_MARKERS = {0x01, 0xd0, 0xd1, 0xd2, 0xd3, 0xd4, 0xd5, 0xd6, 0xd7}
+
+
+class InvalidImageError(Exception):
+    pass
+
+
+class TruncatedImageError(InvalidImageError):
+    pass
+
+
+class RejectedImageError(InvalidImageError):
+    def __init__(self, reason, message):
+        """
+        A valid image outside the limits of an ImageFilter.
+        :param reason: 'bytes', 'format', 'width', 'height' or 'aspect'
+        """
+        super().__init__(message)
+        self.reason = reason
+
+
+class ImageSniffer:
+    def __init__(self, max_header_bytes=MAX_HEADER_BYTES):
+        """
+        Detects image format and dimensions from the first bytes of a stream.
+        JPEG segments are walked as they arrive, skipping metadata (EXIF, XMP, ...) by its length without keeping it.
+        Other formats are parsed by PIL.
+        :param max_header_bytes: Gives up if the header is not recognized within this many buffered bytes.
+        """
+        self.max_header_bytes = max_header_bytes
+        self.head = bytearray()  # bytes not parsed yet
+        self.format = None
+        self.size = None
+        self.length = 0  # bytes fed so far
+        self.jpeg = None  # True if the stream starts with a JPEG SOI marker
+        self.skip = 0  # bytes of the current JPEG segment not fed yet
+        self.next_parse = 0  # head length of the next PIL attempt, doubled after each failure
+
+    @property
+    def done(self):
+        return self.format is not None
+
+    @property
+    def ext(self):
+        if self.format == 'jpeg':
+            return 'jpg'
+        return self.format
+
+    def feed(self, chunk):
+        """
+        :return: True once format and size are known
+        :raises InvalidImageError: if the header is not recognized within max_header_bytes
+        """
+        self.length += len(chunk)
+
+        if self.done:
+            return True
+
+        if self.skip >= len(chunk):
+            self.skip -= len(chunk)
+            return False
+        self.head += chunk[self.skip:]
+        self.skip = 0
+
+        if self.jpeg is None:
+            if len(self.head) < 2:
+                return False
+            self.jpeg = self.head[:2] == b'\xff\xd8'
+            if self.jpeg:
+                del self.head[:2]
+
+        if self.jpeg:
+            return self.feed_jpeg()
+        return self.feed_pil()
+
+    def feed_jpeg(self):
+        head = self.head
+        while len(head) >= 2:
+            if head[0] != 0xff:
+                raise InvalidImageError('Broken JPEG header')
+            marker = head[1]
+            if marker == 0xff:  # fill byte
+                del head[:1]
+                continue
+            if marker in JPEG_STANDALONE_MARKERS:
+                del head[:2]
+                continue
+            if marker in (0xd8, 0xd9, 0xda):
+                raise InvalidImageError('JPEG without a frame header')
+            if len(head) < 4:
+                break
+
+            segment_length = head[2] << 8 | head[3]
+            if segment_length < 2:
+                raise InvalidImageError('Broken JPEG header')
+
+            if marker in JPEG_SOF_MARKERS:
+                if len(head) < 9:
+                    break
+                self.format = 'jpeg'
+                self.size = (head[7] << 8 | head[8], head[5] << 8 | head[6])
+                self.head = bytearray()
+                return True
+
+            # Any other segment: skip it, possibly in later chunks.
+            skip = 2 + segment_length
+            self.skip = max(0, skip - len(head))
+            del head[:skip]
+
+        return False
+
+    def feed_pil(self):
+        # PIL parses from the start each time, so retry only once the head doubled. Total work stays linear.
+        if len(self.head) < min(self.next_parse, self.max_header_bytes):
+            return False
+
+        try:
+            # Image.open only parses the header. Pixel data is never decoded here.
+            img = Image.open(io.BytesIO(bytes(self.head)))
+            self.format = str(img.format).lower()
+            self.size = img.size
+            self.head = bytearray()
+            return True
+        except Exception:
+            if len(self.head) >= self.max_header_bytes:
+                raise InvalidImageError('Unknown image format')
+            self.next_parse = len(self.head) * 2
+            return False
+
+    def close(self):
+        """
+        Parses the rest of the head at the end of the stream. Some formats need the whole file. ex) small webp
+        :return: True if format and size are known
+        """
+        if not self.done and not self.jpeg and self.head:
+            self.next_parse = 0
+            try:
+                return self.feed_pil()
+            except InvalidImageError:
+                return False
+        return self.done
+
+
+class ImageFilter:
+    def __init__(self, min_width=0, min_height=0, max_width=0, max_height=0, min_aspect=0.0, max_aspect=0.0,
+                 max_bytes=0, formats=None):
+        """
+        Rejects images by Content-Length and by the header while they stream, before the body is downloaded.
+        Every limit is 0 or None for no limit.
+        :param min_aspect: Minimum width / height. ex) 0.5
+        :param max_aspect: Maximum width / height. ex) 2.0
+        :param max_bytes: Maximum file size
+        :param formats: Allowed formats. ex) ['jpg', 'png', 'webp']
+        """
+        self.min_width = min_width
+        self.min_height = min_height
+        self.max_width = max_width
+        self.max_height = max_height
+        self.min_aspect = min_aspect
+        self.max_aspect = max_aspect
+        self.max_bytes = max_bytes
+        self.formats = {'jpg' if fmt == 'jpeg' else fmt for fmt in formats} if formats else None
+
+    @property
+    def enabled(self):
+        return any([self.min_width, self.min_height, self.max_width, self.max_height, self.min_aspect,
+                    self.max_aspect, self.max_bytes, self.formats])
+
+    def check_length(self, length):
+        """
+        :param length: Content-Length, or bytes read so far. None if unknown.
+        :raises RejectedImageError:
+        """
+        if self.max_bytes and length is not None and length > self.max_bytes:
+            raise RejectedImageError('bytes', 'Too large ({} > {} bytes)'.format(length, self.max_bytes))
+
+    def check(self, sniffer):
+        """
+        Checks the bytes read so far, and format and dimensions once the header is known.
+        :raises RejectedImageError:
+        """
+        self.check_length(sniffer.length)
+        if not sniffer.done:
+            return
+
+        if self.formats is not None and sniffer.ext not in self.formats:
+            raise RejectedImageError('format', 'Format {} not allowed'.format(sniffer.ext))
+
+        width, height = sniffer.size
+        if (self.min_width and width < self.min_width) or (self.max_width and width > self.max_width):
+            raise RejectedImageError('width', 'Width {}px out of range'.format(width))
+        if (self.min_height and height < self.min_height) or (self.max_height and height > self.max_height):
+            raise RejectedImageError('height', 'Height {}px out of range'.format(height))
+
+        aspect = width / height if height else 0
+        if (self.min_aspect and aspect < self.min_aspect) or (self.max_aspect and aspect > self.max_aspect):
+            raise RejectedImageError('aspect', 'Aspect ratio {:.2f} out of range'.format(aspect))
+
+
+class FilteredImageWriter:
+    def __init__(self, writer, image_filter):
+        """
+        Checks every chunk written to an image writer (ImageFileWriter, ContentStore.open, ...) with an ImageFilter.
+        Raises RejectedImageError from write() as soon as the header fails, so the caller stops reading the body.
+        """
+        self.writer = writer
+        self.image_filter = image_filter
+
+    @property
+    def sniffer(self):
+        return self.writer.sniffer
+
+    def write(self, chunk):
+        """
+        :raises InvalidImageError: Not an image, or rejected by the filter. Stop reading the body.
+        """
+        self.writer.write(chunk)
+        self.image_filter.check(self.writer.sniffer)
+
+    def commit(self):
+        self.writer.sniffer.close()  # the header may be known only at the end
+        self.image_filter.check(self.writer.sniffer)
+        return self.writer.commit()
+
+    def abort(self):
+        self.writer.abort()
+
+
+def response_chunks(response, chunk_size=CHUNK_SIZE, head_size=None):
+    """
+    :param head_size: Size of the first read, smaller than chunk_size so a rejected header costs only that much.
+    """
+    # Raw bytes, same as what is stored on disk. Content-Length counts these bytes.
+    if head_size:
+        yield response.raw.read(head_size, decode_content=False)
+    yield from response.raw.stream(chunk_size, decode_content=False)
+
+
+def check_complete(sniffer, expected_size=None):
+    """
+    :raises InvalidImageError: The stream ended before the header was recognized, or before expected_size.
+    """
+    if not sniffer.close():
+        raise InvalidImageError('Unknown image format')
+
+    if expected_size is not None and sniffer.length != expected_size:
+        raise TruncatedImageError('Truncated file ({} / {} bytes)'.format(sniffer.length, expected_size))
+
+
+class ImageFileWriter:
+    def __init__(self, no_ext_path, expected_size=None, max_header_bytes=MAX_HEADER_BYTES):
+        """
+        Incrementally writes an image to a temporary file while sniffing its header.
+        commit() moves it to no_ext_path + real extension with one atomic rename.
+        :param no_ext_path: Destination path without extension
+        :param expected_size: Content-Length if known. Detects truncated bodies.
+        """
+        self.no_ext_path = no_ext_path
+        self.expected_size = expected_size
+        self.sniffer = ImageSniffer(max_header_bytes)
+        self.tmp_path = no_ext_path + '.part'
+        self.file = open(self.tmp_path, 'wb')
+
+    def write(self, chunk):
+        """
+        :raises InvalidImageError: Not an image. Stop reading the body.
+        """
+        self.sniffer.feed(chunk)
+        self.file.write(chunk)
+
+    def commit(self):
+        """
+        :return: (path, sniffer)
+        """
+        check_complete(self.sniffer, self.expected_size)
+        self.file.close()
+
+        path = self.no_ext_path + '.' + self.sniffer.ext
+        os.replace(self.tmp_path, path)
+        return path, self.sniffer
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def write_image(writer, chunks):
+    """
+    Feeds chunks to an image writer (ImageFileWriter, ContentStore.open, ...) and commits it.
+    Nothing is left on disk if it fails.
+    :return: writer.commit()
+    """
+    try:
+        for chunk in chunks:
+            if chunk:
+                writer.write(chunk)
+        return writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
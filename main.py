@@ -14,17 +14,39 @@ Copyright 2018 YoongiKim
    limitations under the License.
 """
 
+import logging
 import os
 import requests
+import urllib3
 import shutil
-from multiprocessing import Pool
 import argparse
-from collect_links import CollectLinks
+from collect_links import CollectLinks, LinkStream
+from http_collect import HttpCollectLinks, HTTP_SITES
+from http_pool import get_session_pool
+from image_stream import ImageFileWriter, write_image, response_chunks, InvalidImageError, TruncatedImageError, \
+    RejectedImageError, ImageFilter, FilteredImageWriter, HEADER_CHUNK_SIZE
+from content_store import get_content_store, DuplicateImageError
+from task_manifest import TaskManifest
+from driver_pool import get_driver_pool
+from retry import RetryPolicy, RetryableError, get_rate_limiter
+from scheduler import SiteScheduler, QueueScheduler, ScheduledTask
+from task_queue import SqliteTaskQueue
+from async_download import AsyncDownloader
+from metrics import get_metrics, MetricsExporter, BYTES_PER_SECOND_BUCKETS
+from dataset_stats import TaskStats, StatsIndex, rebuild_index, record_renames
+from normalize import Normalizer, NormalizeStage
+from shard_sink import get_shard_sink, repair_shards
+from url_index import get_url_index
+from proxy_manager import ProxyManager, get_proxy_manager, proxy_label, PROXY_BLOCKED_STATUS, PROXY_ERRORS
+from budget import CrawlBudget
 # import imghdr
-from PIL import Image
 import base64
 from pathlib import Path
-import random
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
+
+logger = logging.getLogger(__name__)
 
 
 class Sites:
@@ -60,10 +82,10 @@ class Sites:
             return "&face=1"
         if code == Sites.UNSPLASH or code == Sites.UNSPLASH_FULL:
             # raise RuntimeError("Face Detection not supported in unsplash.")
-            print("Face Detection not supported in unsplash - option ignored.")
+            logger.warning("Face Detection not supported in unsplash - option ignored.")
             return ""
         if code == Sites.FLICKR or code == Sites.FLICKR_FULL:
-            print("Face Detection not supported in flickr - option ignored.")
+            logger.warning("Face Detection not supported in flickr - option ignored.")
             return ""
 
     @staticmethod
@@ -80,7 +102,17 @@ class Sites:
 
 class AutoCrawler:
     def __init__(self, skip_already_exist=True, n_threads=4, do_google=True, do_naver=True, do_unsplash=True, do_flickr=True,
-                 download_path='download', full_resolution=False, face=False, ccl=False, no_gui=False, limit=0, proxy_list=None):
+                 download_path='download', full_resolution=False, face=False, ccl=False, no_gui=False, limit=0, proxy_list=None,
+                 download_threads=8, site_download_threads=None, http_pool_size=None, http_retries=3, http_keep_alive=True,
+                 stream_links=True, content_store=False, content_store_link='hardlink', resume=True,
+                 manifest_max_age=24 * 60 * 60, reuse_drivers=True, driver_max_tasks=50, driver_max_rss=2048,
+                 max_attempts=4, rate_limit=0, rate_burst=4, site_concurrency=None, task_priority='order',
+                 download_engine='thread', async_concurrency=256, async_per_host=32, log_level='info',
+                 metrics_interval=10, base_urls=None, imbalance_policy='report', imbalance_threshold=0.5,
+                 normalizer=None, normalize_processes=None, output_format='files', shard_size=1024 * 1024 * 1024,
+                 url_index=False, proxy_probe_url=None, proxy_cooldown=60, task_queue=None, queue_lease=300,
+                 http_collectors=None, detail_workers=1, network_capture=False, block_resources=('font', 'media'),
+                 task_time_limit=0, task_size_limit=0, overcollect=1.25, image_filter=None):
         """
         :param skip_already_exist: Skips keyword already downloaded before. This is needed when re-downloading.
         :param n_threads: Number of threads to download.
@@ -91,7 +123,57 @@ class AutoCrawler:
         :param face: Face search mode
         :param no_gui: No GUI mode. Acceleration for full_resolution mode.
         :param limit: Maximum count of images to download. (0: infinite)
-        :param proxy_list: The proxy list. Every thread will randomly choose one from the list.
+        :param proxy_list: The proxy list. Collectors and downloads choose one per task and per image, favouring
+                           proxies with high success rates and low latency on the site. Failing ones cool down.
+        :param download_threads: Number of concurrent image downloads per task.
+        :param site_download_threads: Per-site override of download_threads. ex) {'google': 16, 'flickr': 2}
+        :param http_pool_size: Kept-alive connections per (host, proxy). Default: the largest download thread count.
+        :param http_retries: Immediate retries of failed connection attempts. 429/5xx are retried by max_attempts.
+        :param http_keep_alive: Reuse connections between image downloads.
+        :param stream_links: Start downloading while links are still being collected.
+        :param content_store: Store each distinct image once under download_path/_objects (deduplicated by sha256).
+        :param content_store_link: How keyword/site folders refer to stored images. 'hardlink' or 'manifest'
+        :param resume: Keep a per-task manifest of links and download results, and resume unfinished tasks from it.
+        :param manifest_max_age: Seconds a finished link collection stays valid for resuming. (None: forever)
+        :param reuse_drivers: Keep chrome drivers alive across tasks of a worker instead of launching one per task.
+        :param driver_max_tasks: Recycle a reused driver after this many tasks. (0: never)
+        :param driver_max_rss: Recycle a reused driver above this memory usage in MB. (0: never, needs psutil)
+        :param max_attempts: Attempts per page load, click and image download, with jittered exponential backoff.
+        :param rate_limit: Requests per second per host, shared by all workers. (0: unlimited)
+        :param rate_burst: Requests per host allowed at once after being idle, per worker.
+        :param site_concurrency: Maximum tasks running at once per site. ex) {'google': 2} (missing: n_threads)
+        :param task_priority: 'order' - keyword order, 'deficit' - tasks furthest from limit first.
+        :param download_engine: 'thread' - a thread per download, 'async' - one asyncio event loop per task (needs aiohttp)
+        :param async_concurrency: Maximum downloads in flight per task with the async engine.
+        :param async_per_host: Maximum connections per host with the async engine.
+        :param log_level: 'debug', 'info', 'warning' or 'error'. Per-download messages are logged at debug.
+        :param base_urls: Overrides the site urls collectors load. ex) {'google': 'http://127.0.0.1:8000/google'}
+        :param metrics_interval: Seconds between writes of download_path/_metrics.json and _metrics.prom. (0: at the end only)
+        :param imbalance_policy: For keywords with few images after crawling.
+                                 'report' - log them, 'prune' - remove their folders, 'requeue' - crawl them once more
+        :param imbalance_threshold: Keywords with fewer images than this fraction of the average are under-filled.
+        :param normalizer: Normalizer to resize and re-encode every saved image while crawling. (None: keep originals)
+        :param normalize_processes: Processes running the normalizer. (None: number of CPUs)
+        :param output_format: 'files' - download_path/<keyword>/<site>/NNNN.ext,
+                              'shards' - rolling tar shards with an index under download_path/_shards
+        :param shard_size: Maximum bytes per tar shard.
+        :param url_index: Skip image urls downloaded before, by any keyword, site or run. (download_path/_url_index.bin)
+        :param proxy_probe_url: Requested through every proxy before crawling. Proxies failing it are dropped.
+        :param proxy_cooldown: Seconds a proxy failing 3 times in a row is not used for a site, doubled every time.
+        :param task_queue: SQLite file of a task queue shared by crawler nodes, ex) on a shared volume.
+                           Every node puts the keyword tasks and works on them until none is left. (None: local only)
+        :param queue_lease: Seconds after which a task of a node that stopped is crawled by another node.
+        :param http_collectors: Sites collected from their search results over HTTP instead of chrome.
+                                ex) ['unsplash', 'flickr'] (the only ones supported)
+        :param detail_workers: Browsers per task opening detail views at once in google and naver full resolution mode.
+        :param network_capture: Lightweight chrome profile blocking block_resources, which also collects thumbnail urls
+                                from the image requests of result pages. (needs chrome devtools protocol)
+        :param block_resources: Resource types blocked with network_capture. ('font', 'media', 'stylesheet')
+        :param task_time_limit: Seconds a keyword/site task collects and downloads before it stops. (0: no limit)
+        :param task_size_limit: Bytes of images a keyword/site task saves before it stops. (0: no limit)
+        :param overcollect: Links collected per image of limit before any download failed.
+                            Follows the observed failure rate of the task as downloads finish.
+        :param image_filter: ImageFilter. Images failing it are dropped after their header instead of downloaded.
         """
 
         self.skip = skip_already_exist
@@ -106,7 +188,54 @@ class AutoCrawler:
         self.ccl = ccl
         self.no_gui = no_gui
         self.limit = limit
-        self.proxy_list = proxy_list if proxy_list and len(proxy_list) > 0 else None
+        self.proxy_list = [p.strip() for p in proxy_list if p.strip()] if proxy_list else []
+        self.proxy_list = self.proxy_list if len(self.proxy_list) > 0 else None
+        self.download_threads = download_threads
+        self.site_download_threads = site_download_threads if site_download_threads else {}
+        self.http_pool_size = http_pool_size if http_pool_size else max([download_threads] + list(self.site_download_threads.values()))
+        self.http_retries = http_retries
+        self.http_keep_alive = http_keep_alive
+        self.stream_links = stream_links
+        self.content_store = content_store
+        self.content_store_link = content_store_link
+        self.resume = resume
+        self.manifest_max_age = manifest_max_age
+        self.reuse_drivers = reuse_drivers
+        self.driver_max_tasks = driver_max_tasks
+        self.driver_max_rss = driver_max_rss
+        self.max_attempts = max_attempts
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        self.site_concurrency = site_concurrency if site_concurrency else {}
+        self.task_priority = task_priority
+        self.download_engine = download_engine
+        self.async_concurrency = async_concurrency
+        self.async_per_host = async_per_host
+        self.log_level = log_level
+        self.metrics_interval = metrics_interval
+        self.base_urls = base_urls if base_urls else {}
+        self.imbalance_policy = imbalance_policy
+        self.imbalance_threshold = imbalance_threshold
+        self.normalizer = normalizer
+        self.normalize_processes = normalize_processes
+        self.normalize_queue = None  # set in workers by init_worker
+        self.output_format = output_format
+        self.shard_size = shard_size
+        self.url_index = url_index
+        self.proxy_probe_url = proxy_probe_url
+        self.proxy_cooldown = proxy_cooldown
+        self.task_queue = task_queue
+        self.queue_lease = queue_lease
+        self.http_collectors = [site for site in (http_collectors or []) if site in HTTP_SITES]
+        for site in set(http_collectors or []) - set(HTTP_SITES):
+            logger.warning('No HTTP collector for {} - collected with chrome.'.format(site))
+        self.detail_workers = detail_workers
+        self.network_capture = network_capture
+        self.block_resources = block_resources
+        self.task_time_limit = task_time_limit
+        self.task_size_limit = task_size_limit
+        self.overcollect = overcollect
+        self.image_filter = image_filter if image_filter is not None and image_filter.enabled else None
 
         os.makedirs('./{}'.format(self.download_path), exist_ok=True)
 
@@ -129,36 +258,12 @@ class AutoCrawler:
 
         return paths
 
-    @staticmethod
-    def get_extension_from_link(link, default='jpg'):
-        splits = str(link).split('.')
-        if len(splits) == 0:
-            return default
-        ext = splits[-1].lower()
-        if ext == 'jpg' or ext == 'jpeg':
-            return 'jpg'
-        elif ext == 'gif':
-            return 'gif'
-        elif ext == 'png':
-            return 'png'
-        else:
-            return default
-
-    @staticmethod
-    def validate_image(path):
-        # ext = imghdr.what(path)
-        img = Image.open(path)
-        ext = img.format.lower()
-        if ext == 'jpeg':
-            ext = 'jpg'
-        return ext  # returns None if not valid
-
     @staticmethod
     def make_dir(dirname):
         current_path = os.getcwd()
         path = os.path.join(current_path, dirname)
         if not os.path.exists(path):
-            os.makedirs(path)
+            os.makedirs(path, exist_ok=True)
 
     @staticmethod
     def get_keywords(keywords_file='keywords.txt'):
@@ -169,7 +274,7 @@ class AutoCrawler:
             lines = filter(lambda x: x != '' and x is not None, lines)
             keywords = sorted(set(lines))
 
-        print('{} keywords found: {}'.format(len(keywords), keywords))
+        logger.info('{} keywords found: {}'.format(len(keywords), keywords))
 
         # re-save sorted keywords
         with open(keywords_file, 'w+', encoding='utf-8') as f:
@@ -178,144 +283,522 @@ class AutoCrawler:
 
         return keywords
 
-    @staticmethod
-    def save_object_to_file(object, file_path, is_base64=False):
-        try:
-            with open('{}'.format(file_path), 'wb') as file:
-                if is_base64:
-                    file.write(object)
-                else:
-                    shutil.copyfileobj(object.raw, file)
-        except Exception as e:
-            print('Save failed - {}'.format(e))
-
     @staticmethod
     def base64_to_object(src):
         header, encoded = str(src).split(',', 1)
         data = base64.decodebytes(bytes(encoded, encoding='utf-8'))
         return data
 
-    def download_images(self, keyword, links, site_name, max_count=0):
-        self.make_dir('{}/{}/{}'.format(self.download_path, keyword.replace('"', ''), site_name))
-        total = len(links)
-        success_count = 0
+    def get_session_pool(self):
+        # Created lazily in each worker process. Sessions can't be pickled to Pool workers.
+        return get_session_pool(pool_size=self.http_pool_size, max_retries=self.http_retries,
+                                keep_alive=self.http_keep_alive)
 
-        if max_count == 0:
-            max_count = total
+    def get_proxy_manager(self):
+        # Each worker process learns which proxies work on its own.
+        if not self.proxy_list:
+            return None
+        return get_proxy_manager(self.proxy_list, cooldown=self.proxy_cooldown)
 
-        for index, link in enumerate(links):
-            if success_count >= max_count:
-                break
+    def use_proxy(self, site_name, fail_on, schemes=None):
+        """
+        with self.use_proxy(...) as proxy: - proxy is None without a proxy list.
+        :param fail_on: Exceptions counted as a failure of the proxy.
+        """
+        proxy_manager = self.get_proxy_manager()
+        if proxy_manager is None:
+            return nullcontext()
+        return proxy_manager.use(site_name, fail_on=fail_on, schemes=schemes)
 
-            try:
-                print('Downloading {} from {}: {} / {}'.format(keyword, site_name, success_count + 1, total if total <= max_count else max_count))
-
-                if str(link).startswith('data:image/jpeg;base64'):
-                    response = self.base64_to_object(link)
-                    ext = 'jpg'
-                    is_base64 = True
-                elif str(link).startswith('data:image/png;base64'):
-                    response = self.base64_to_object(link)
-                    ext = 'png'
-                    is_base64 = True
-                else:
-                    response = requests.get(link, stream=True)
-                    ext = self.get_extension_from_link(link)
-                    is_base64 = False
-
-                no_ext_path = '{}/{}/{}/{}'.format(self.download_path.replace('"', ''), keyword, site_name,
-                                                   str(index).zfill(4))
-                path = no_ext_path + '.' + ext
-                self.save_object_to_file(response, path, is_base64=is_base64)
-
-                success_count += 1
-                del response
-
-                ext2 = self.validate_image(path)
-                if ext2 is None:
-                    print('Unreadable file - {}'.format(link))
-                    os.remove(path)
-                    success_count -= 1
-                else:
-                    if ext != ext2:
-                        path2 = no_ext_path + '.' + ext2
-                        os.rename(path, path2)
-                        print('Renamed extension {} -> {}'.format(ext, ext2))
+    def get_retry_policy(self):
+        # Every worker process has its own token buckets, so each gets an equal share of the rate.
+        rate = self.rate_limit / self.n_threads if self.rate_limit else 0
+        return RetryPolicy(max_attempts=self.max_attempts, rate_limiter=get_rate_limiter(rate, self.rate_burst))
 
-            except Exception as e:
-                print('Download failed - ', e)
-                continue
+    def get_download_threads(self, site_name):
+        return max(1, int(self.site_download_threads.get(site_name, self.download_threads)))
 
-    def download_from_site(self, keyword, site_code):
-        site_name = Sites.get_text(site_code)
-        add_url = Sites.get_face_url(site_code) if self.face else ""
-        add_url += Sites.get_ccl_url(site_code) if self.ccl else ""
+    def download_image(self, keyword, link, index, site_name):
+        """
+        Downloads a single link, validating the image while it streams.
+        Connection errors, 429/5xx responses and truncated bodies are retried with backoff.
+        :return: (path, sniffer) if a valid image was saved, otherwise None
+        """
+        no_ext_path = '{}/{}/{}/{}'.format(self.download_path.replace('"', ''), keyword, site_name,
+                                           str(index).zfill(4))
+
+        start = time.monotonic()
 
         try:
-            proxy = None
-            if self.proxy_list:
-                proxy = random.choice(self.proxy_list)
-            collect = CollectLinks(no_gui=self.no_gui, proxy=proxy)  # initialize chrome driver
+            if str(link).startswith('data:image/jpeg;base64') or str(link).startswith('data:image/png;base64'):
+                data = self.base64_to_object(link)
+                result = self.save_image([data], no_ext_path, len(data), link)
+            else:
+                result = self.get_retry_policy().call(
+                    lambda: self.fetch_image(link, no_ext_path, site_name), url=link,
+                    retry_on=(RetryableError, TruncatedImageError, requests.RequestException,
+                              urllib3.exceptions.HTTPError))
+
+            self.record_download(keyword, site_name, 'ok', time.monotonic() - start, result[1])
+            return result
+
+        except RejectedImageError as e:
+            logger.debug('Rejected image - {} ({})'.format(link, e))
+            self.record_download(keyword, site_name, 'rejected', time.monotonic() - start)
+            get_metrics().inc('images_rejected_total', site=site_name, reason=e.reason)
+            return None
+
+        except InvalidImageError as e:
+            logger.debug('Unreadable file - {} ({})'.format(link, e))
+            self.record_download(keyword, site_name, 'invalid', time.monotonic() - start)
+            return None
+
+        except DuplicateImageError:
+            logger.debug('Duplicate image - {}'.format(link))
+            self.record_download(keyword, site_name, 'duplicate', time.monotonic() - start)
+            return None
+
         except Exception as e:
-            print('Error occurred while initializing chromedriver - {}'.format(e))
+            logger.warning('Download failed - {}'.format(e))
+            self.record_download(keyword, site_name, 'failed', time.monotonic() - start)
+            return None
+
+    @staticmethod
+    def record_download(keyword, site_name, status, elapsed, sniffer=None):
+        """
+        :param status: 'ok', 'invalid' (failed validation), 'rejected' (by image_filter), 'duplicate' or 'failed'
+        :param sniffer: ImageSniffer of a saved image, for latency and throughput
+        """
+        metrics = get_metrics()
+        metrics.inc('downloads_total', site=site_name, keyword=keyword, result=status)
+        if sniffer is None:
             return
 
+        metrics.observe('download_seconds', elapsed, site=site_name, keyword=keyword)
+        metrics.inc('download_bytes_total', sniffer.length, site=site_name, keyword=keyword)
+        if elapsed > 0:
+            metrics.observe('download_bytes_per_second', sniffer.length / elapsed, buckets=BYTES_PER_SECOND_BUCKETS,
+                            site=site_name, keyword=keyword)
+
+    def fetch_image(self, link, no_ext_path, site_name=None):
+        with self.use_proxy(site_name, PROXY_ERRORS + (RetryableError,)) as proxy:
+            response = self.get_session_pool().get(link, proxy=proxy, stream=True)
+            if proxy and response.status_code in PROXY_BLOCKED_STATUS:
+                response.close()
+                raise RetryableError('HTTP {} through {}'.format(response.status_code, proxy_label(proxy)))
+
+        try:
+            if response.status_code == 429 or response.status_code >= 500:
+                raise RetryableError('HTTP {}'.format(response.status_code))
+            if response.status_code != 200:
+                raise InvalidImageError('HTTP {}'.format(response.status_code))
+
+            content_length = response.headers.get('Content-Length')
+            expected_size = int(content_length) if content_length and content_length.isdigit() else None
+
+            head_size = HEADER_CHUNK_SIZE if self.image_filter is not None else None
+            return self.save_image(response_chunks(response, head_size=head_size), no_ext_path, expected_size, link)
+
+        finally:
+            response.close()  # release the connection back to the pool
+
+    def open_image_writer(self, no_ext_path, expected_size, link):
+        """
+        :return: Incremental image writer. write(chunk), commit() -> (path, sniffer), abort()
+        :raises RejectedImageError: expected_size is over the limit of image_filter. Nothing is opened.
+        """
+        if self.image_filter is None:
+            return self.open_output_writer(no_ext_path, expected_size, link)
+
+        self.image_filter.check_length(expected_size)
+        return FilteredImageWriter(self.open_output_writer(no_ext_path, expected_size, link), self.image_filter)
+
+    def open_output_writer(self, no_ext_path, expected_size, link):
+        if self.output_format == 'shards':
+            root = self.download_path.replace('"', '')
+            key = os.path.relpath(no_ext_path, root).replace(os.sep, '/')  # <keyword>/<site>/NNNN
+            keyword, site_name = key.split('/')[:2]
+            sink = get_shard_sink(os.path.join(root, '_shards'), self.shard_size)
+            return sink.open(key, expected_size, meta={'url': link, 'keyword': keyword, 'site': site_name})
+
+        if self.content_store:
+            store = get_content_store(self.download_path.replace('"', ''), self.content_store_link)
+            return store.open(no_ext_path, expected_size, link=link)
+
+        return ImageFileWriter(no_ext_path, expected_size)
+
+    def get_url_index(self):
+        if not self.url_index:
+            return None
+        return get_url_index('{}/_url_index.bin'.format(self.download_path.replace('"', '')))
+
+    def is_known_link(self, keyword, site_name, link, budget=None):
+        """
+        :param budget: CrawlBudget of the task. A known link is recorded as skipped, so collectors look further.
+        """
+        url_index = self.get_url_index()
+        if url_index is None or not url_index.contains(link):
+            return False
+        logger.debug('Skipping url downloaded before: {}'.format(link))
+        get_metrics().inc('links_skipped_total', site=site_name, keyword=keyword)
+        if budget is not None:
+            budget.skip()
+        return True
+
+    def skip_known_links(self, keyword, site_name, link_iter, budget=None):
+        """
+        Wraps a link generator. Drops links of the url index as they are collected, so the budget has counted them
+        as skipped by the time the collector asks it for more links.
+        """
         try:
-            print('Collecting links... {} from {}'.format(keyword, site_name))
+            for link in link_iter:
+                if not self.is_known_link(keyword, site_name, link, budget):
+                    yield link
+        finally:
+            close = getattr(link_iter, 'close', None)
+            if close is not None:
+                close()
+
+    def save_image(self, chunks, no_ext_path, expected_size, link):
+        return write_image(self.open_image_writer(no_ext_path, expected_size, link), chunks)
+
+    def download_images(self, keyword, links, site_name, max_count=0, manifest=None, stats=None, budget=None):
+        """
+        :param links: List of links, or an iterable such as LinkStream which yields links while collecting.
+        :param manifest: TaskManifest. Links already downloaded are skipped and every result is recorded.
+        :param stats: TaskStats. Every saved image is added.
+        :param budget: CrawlBudget. Every result is recorded and no download starts once it is met.
+        :return: Number of images saved (including ones saved by a previous run of the task)
+        """
+        if self.output_format != 'shards':  # shards need no folder per site
+            self.make_dir('{}/{}/{}'.format(self.download_path, keyword.replace('"', ''), site_name))
 
-            if site_code == Sites.GOOGLE:
-                links = collect.google(keyword, add_url, self.limit)
+        if self.download_engine == 'async':
+            downloader = AsyncDownloader(self, concurrency=self.async_concurrency, per_host=self.async_per_host)
+            return downloader.download_images(keyword, links, site_name, max_count, manifest, stats, budget)
 
-            elif site_code == Sites.NAVER:
-                links = collect.naver(keyword, add_url, self.limit)
+        total = len(links) if hasattr(links, '__len__') else None
+        success_count = manifest.done_count() if manifest else 0
 
-            elif site_code == Sites.GOOGLE_FULL:
-                links = collect.google_full(keyword, add_url, self.limit)
+        if max_count == 0:
+            max_count = total if total is not None else float('inf')
 
-            elif site_code == Sites.NAVER_FULL:
-                links = collect.naver_full(keyword, add_url, self.limit)
+        if total is not None and total <= max_count:
+            target = total
+        else:
+            target = max_count if max_count != float('inf') else '?'
 
-            elif site_code == Sites.UNSPLASH:
-                links = collect.unsplash(keyword, add_url, self.limit)
+        n_threads = self.get_download_threads(site_name)
+        if manifest:
+            remaining = ((manifest.add_link(link), link) for link in links)
+        else:
+            remaining = iter(enumerate(links))
+        pending = {}
+
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            while True:
+                # Never keep more downloads in flight than needed to reach max_count.
+                while len(pending) < n_threads and success_count + len(pending) < max_count and \
+                        (budget is None or budget.wants_downloads(len(pending))):
+                    try:
+                        index, link = next(remaining)
+                    except StopIteration:
+                        break
+                    if manifest and manifest.is_done(index):
+                        continue
+                    if self.is_known_link(keyword, site_name, link):
+                        continue
+                    logger.debug('Downloading {} from {}: {} / {}'.format(keyword, site_name, success_count + len(pending) + 1,
+                                                                   target))
+                    pending[executor.submit(self.download_image, keyword, link, index, site_name)] = (index, link)
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, link = pending.pop(future)
+                    if self.finish_image(index, future.result(), manifest, stats, link, budget):
+                        success_count += 1
+
+        return success_count
+
+    def finish_image(self, index, result, manifest=None, stats=None, link=None, budget=None):
+        """
+        Records the result of one link in the manifest, stats, budget and url index, and queues a saved image
+        for normalizing.
+        :param result: download_image() result
+        :param link: Url of the image, added to the url index when saved
+        :return: True if an image was saved
+        """
+        if not result:
+            if manifest:
+                manifest.set_failed(index)
+            if budget:
+                budget.record(False)
+            return False
+
+        path, sniffer = result
+        if budget:
+            budget.record(True, sniffer.length)
+        if stats:
+            stats.add('{}.{}'.format(str(index).zfill(4), sniffer.ext), sniffer.length, sniffer.ext)
+        if manifest:
+            manifest.set_done(index, sniffer.length, path)
+        url_index = self.get_url_index()
+        if url_index is not None and link is not None:
+            url_index.add(link)
+        if self.normalize_queue is not None:
+            self.normalize_queue.put(path)
+        return True
+
+    def get_link_iter(self, collect, site_code, keyword, add_url):
+        # A budget collects more links than limit when downloads fail, and stops once enough images are saved.
+        max_count = 0 if getattr(collect, 'budget', None) is not None else self.limit
+
+        if site_code == Sites.GOOGLE:
+            return collect.google_iter(keyword, add_url, max_count)
+
+        elif site_code == Sites.NAVER:
+            return collect.naver_iter(keyword, add_url, max_count)
+
+        elif site_code == Sites.GOOGLE_FULL:
+            return collect.google_full_iter(keyword, add_url, max_count)
+
+        elif site_code == Sites.NAVER_FULL:
+            return collect.naver_full_iter(keyword, add_url, max_count)
+
+        elif site_code == Sites.UNSPLASH:
+            return collect.unsplash_iter(keyword, add_url, max_count=max_count)
+
+        elif site_code == Sites.UNSPLASH_FULL:
+            return collect.unsplash_full_iter(keyword, add_url, max_count)
+
+        elif site_code == Sites.FLICKR:
+            return collect.flickr_iter(keyword, add_url, max_count)
+
+        elif site_code == Sites.FLICKR_FULL:
+            return collect.flickr_full_iter(keyword, add_url, max_count)
 
-            elif site_code == Sites.UNSPLASH_FULL:
-                links = collect.unsplash_full(keyword, add_url, self.limit)
+        else:
+            logger.error('Invalid Site Code')
+            return iter([])
 
-            elif site_code == Sites.FLICKR:
-                links = collect.flickr(keyword, add_url, self.limit)
+    def download_from_site(self, keyword, site_code):
+        """
+        :return: Task result. {'keyword', 'site', 'status': 'done' or 'failed', 'count': images saved, 'error',
+                 'stats': TaskStats.summary() of the keyword/site folder}
+        """
+        site_name = Sites.get_text(site_code)
+        result = {'keyword': keyword, 'site': site_name, 'status': 'failed', 'count': 0, 'error': None}
+        add_url = Sites.get_face_url(site_code) if self.face else ""
+        add_url += Sites.get_ccl_url(site_code) if self.ccl else ""
 
-            elif site_code == Sites.FLICKR_FULL:
-                links = collect.flickr_full(keyword, add_url, self.limit)
+        self.make_dir('{}/{}'.format(self.download_path, keyword.replace('"', '')))
+        manifest = None
+        if self.resume:
+            manifest = TaskManifest('{}/{}/{}_manifest.jsonl'.format(self.download_path, keyword.replace('"', ''), site_name))
+        stats = TaskStats('{}/{}/{}_stats.json'.format(self.download_path, keyword.replace('"', ''), site_name))
+        if manifest:
+            # Images saved before a crash are skipped on resume. Count them even if the stats file was never saved.
+            for record in manifest.done_records():
+                ext = os.path.splitext(record['path'])[1][1:].lower()
+                stats.add('{}.{}'.format(str(record['index']).zfill(4), ext), record['bytes'], ext)
+        budget = self.make_budget(manifest)
 
+        try:
+            if manifest and manifest.is_fresh(self.manifest_max_age):
+                logger.info('Resuming from manifest... {} from {}: {} / {} links done'.format(
+                    keyword, site_name, manifest.done_count(), len(manifest.links)))
+                result['count'] = self.download_images(keyword, list(manifest.links), site_name,
+                                                       max_count=self.limit, manifest=manifest, stats=stats,
+                                                       budget=budget)
             else:
-                print('Invalid Site Code')
-                links = []
+                result['count'] = self.collect_and_download(keyword, site_code, site_name, add_url, manifest, stats,
+                                                            budget)
+
+            reason = budget.exhausted()
+            if reason in ('time', 'bytes'):
+                logger.info('Stopped {} from {} at the task {} limit: {} images, {:.1f}MB'.format(
+                    keyword, site_name, reason, result['count'], budget.bytes / 1024 / 1024))
+                get_metrics().inc('budget_stops_total', site=site_name, reason=reason)
 
-            print('Downloading images from collected links... {} from {}'.format(keyword, site_name))
-            self.download_images(keyword, links, site_name, max_count=self.limit)
             Path('{}/{}/{}_done'.format(self.download_path, keyword.replace('"', ''), site_name)).touch()
 
-            print('Done {} : {}'.format(site_name, keyword))
+            logger.info('Done {} : {}'.format(site_name, keyword))
+            result['status'] = 'done'
 
         except Exception as e:
-            print('Exception {}:{} - {}'.format(site_name, keyword, e))
+            logger.error('Exception {}:{} - {}'.format(site_name, keyword, e))
+            result['error'] = str(e)
+
+        finally:
+            if manifest:
+                manifest.close()
+            stats.save()
+            result['stats'] = stats.summary()
+
+        return result
+
+    def make_budget(self, manifest=None):
+        """
+        :param manifest: TaskManifest of the task. Images it saved count towards limit.
+        """
+        return CrawlBudget(max_images=self.limit, max_seconds=self.task_time_limit, max_bytes=self.task_size_limit,
+                           overcollect=self.overcollect, done=manifest.done_count() if manifest else 0)
+
+    def collect_and_download(self, keyword, site_code, site_name, add_url, manifest=None, stats=None, budget=None):
+        proxy_manager = self.get_proxy_manager()
+        proxy = proxy_manager.choose(site_name) if proxy_manager is not None else None
+        driver_pool = None
+        if self.reuse_drivers and site_name not in self.http_collectors:
+            driver_pool = get_driver_pool(no_gui=self.no_gui, max_tasks=self.driver_max_tasks,
+                                          max_rss_mb=self.driver_max_rss, network_capture=self.network_capture)
+
+        if site_name in self.http_collectors:
+            collect = HttpCollectLinks(session_pool=self.get_session_pool(), proxy=proxy,
+                                       retry_policy=self.get_retry_policy(), base_urls=self.base_urls,
+                                       proxy_manager=proxy_manager, proxy_site=site_name, budget=budget)
+        else:
+            try:
+                collect = CollectLinks(no_gui=self.no_gui, proxy=proxy, driver_pool=driver_pool,
+                                       retry_policy=self.get_retry_policy(), base_urls=self.base_urls,
+                                       proxy_manager=proxy_manager, proxy_site=site_name,
+                                       detail_workers=self.detail_workers, network_capture=self.network_capture,
+                                       block_resources=self.block_resources, budget=budget)  # initialize chrome driver
+            except Exception as e:
+                logger.error('Error occurred while initializing chromedriver - {}'.format(e))
+                raise
+
+        logger.info('Collecting links... {} from {}'.format(keyword, site_name))
+
+        link_iter = self.get_link_iter(collect, site_code, keyword, add_url)
+        if self.url_index:
+            link_iter = self.skip_known_links(keyword, site_name, link_iter, budget)
+        if manifest:
+            link_iter = manifest.record(link_iter)
+
+        if self.stream_links:
+            logger.info('Downloading images while collecting links... {} from {}'.format(keyword, site_name))
+            links = LinkStream(link_iter)
+            try:
+                return self.download_images(keyword, links, site_name, max_count=self.limit, manifest=manifest,
+                                            stats=stats, budget=budget)
+            finally:
+                # Enough images saved (or failed). Stop scrolling and wait for the browser to close.
+                links.stop()
+                links.join()
+        else:
+            links = list(link_iter)
+            logger.info('Downloading images from collected links... {} from {}'.format(keyword, site_name))
+            return self.download_images(keyword, links, site_name, max_count=self.limit, manifest=manifest,
+                                        stats=stats, budget=budget)
 
     def download(self, args):
-        self.download_from_site(keyword=args[0], site_code=args[1])
+        return self.download_from_site(keyword=args[0], site_code=args[1])
+
+    def get_saved_count(self, keyword, site_name):
+        stats_path = '{}/{}/{}_stats.json'.format(self.download_path, keyword.replace('"', ''), site_name)
+        if os.path.exists(stats_path):
+            return len(TaskStats(stats_path).files)  # also counts images in shards
+
+        site_dir = '{}/{}/{}'.format(self.download_path, keyword.replace('"', ''), site_name)
+        if not os.path.isdir(site_dir):
+            return 0
+        return len([name for name in os.listdir(site_dir) if not name.endswith('.part')])
+
+    def get_task_priority(self, keyword, site_code):
+        if self.task_priority == 'deficit':
+            saved = self.get_saved_count(keyword, Sites.get_text(site_code))
+            return saved - self.limit if self.limit else saved
+        return 0  # keyword order
 
     def do_crawling(self):
+        setup_logging(self.log_level)
         keywords = self.get_keywords()
+        stats_index = StatsIndex('{}/_stats.json'.format(self.download_path))
+        metrics = get_metrics()
+        exporter = MetricsExporter(metrics, '{}/_metrics'.format(self.download_path), self.metrics_interval).start()
+        normalize_stage = None
+        if self.output_format == 'shards':
+            if self.task_queue:
+                # Other nodes may be appending to their shards right now. The index never points at partial data.
+                logger.info('Shards left open by crashed runs are repaired by a run without a task queue.')
+            else:
+                repair_shards('{}/_shards'.format(self.download_path))  # left open by a crashed run
+            if self.normalizer is not None:
+                logger.warning('Normalizing works on image files only - ignored with shard output.')
+        elif self.normalizer is not None:
+            normalize_stage = NormalizeStage(self.normalizer, self.normalize_processes).start()
+        if not stats_index.exists():
+            # ex) a download folder of an older version. The imbalance check must count every keyword on disk.
+            logger.info('Building the stats index {} from the files on disk...'.format(stats_index.path))
+            stats_index = rebuild_index(self.download_path)
+        if self.proxy_list and self.proxy_probe_url:
+            self.probe_proxies()
+        if self.proxy_list and self.download_engine == 'async' and \
+                not any(proxy.startswith(('http://', 'https://')) for proxy in self.proxy_list):
+            logger.warning('The async download engine supports http proxies only - images are downloaded directly.')
+        url_index = self.get_url_index()
+        if url_index is not None:
+            if not self.task_queue:
+                # Merge what earlier runs appended, before workers start appending.
+                # Nodes sharing a task queue may be appending already, so they leave it to a run on its own.
+                url_index.compact()
+            logger.info('Url index: {} urls downloaded before'.format(len(url_index)))
 
+        try:
+            self.run_tasks(self.get_tasks(keywords), stats_index, normalize_stage)
+
+            requeue = self.imbalance_check(stats_index)
+            if requeue:
+                logger.info('Crawling {} under-filled keywords once more: {}'.format(len(requeue), requeue))
+                self.run_tasks(self.get_tasks(requeue, ignore_done=True), stats_index, normalize_stage,
+                               round_name='requeue')
+        finally:
+            if normalize_stage is not None:
+                logger.info('Waiting for image normalization to finish...')
+                for snapshot in normalize_stage.stop():
+                    metrics.merge(snapshot)
+                record_renames(normalize_stage.normalized, stats_index)
+            exporter.stop()
+
+        logger.info('End Program')
+
+    def probe_proxies(self):
+        """
+        Drops proxies that fail proxy_probe_url before workers start. Keeps all of them if every one fails.
+        """
+        results = ProxyManager(self.proxy_list).probe(self.proxy_probe_url)
+        alive = [proxy for proxy in self.proxy_list if results.get(proxy) is not None]
+        for proxy in self.proxy_list:
+            latency = results.get(proxy)
+            logger.info('Proxy {}: {}'.format(proxy_label(proxy),
+                                              'failed' if latency is None else '{:.0f}ms'.format(latency * 1000)))
+
+        if not alive:
+            logger.warning('Every proxy failed {} - using all of them anyway.'.format(self.proxy_probe_url))
+            return
+        if len(alive) < len(self.proxy_list):
+            logger.warning('Dropped {} of {} proxies failing {}'.format(len(self.proxy_list) - len(alive),
+                                                                       len(self.proxy_list), self.proxy_probe_url))
+        self.proxy_list = alive
+
+    def get_tasks(self, keywords, ignore_done=False):
+        """
+        :param ignore_done: Also crawl sites already done for a keyword. ex) requeueing under-filled keywords
+        :return: [[keyword, site_code], ...]
+        """
         tasks = []
 
         for keyword in keywords:
             dir_name = '{}/{}'.format(self.download_path, keyword)
-            google_done = os.path.exists(os.path.join(os.getcwd(), dir_name, 'google_done'))
-            naver_done = os.path.exists(os.path.join(os.getcwd(), dir_name, 'naver_done'))
-            unsplash_done = os.path.exists(os.path.join(os.getcwd(), dir_name, 'unsplash_done'))
-            flickr_done = os.path.exists(os.path.join(os.getcwd(), dir_name, 'flickr_done'))
+            google_done = not ignore_done and os.path.exists(os.path.join(os.getcwd(), dir_name, 'google_done'))
+            naver_done = not ignore_done and os.path.exists(os.path.join(os.getcwd(), dir_name, 'naver_done'))
+            unsplash_done = not ignore_done and os.path.exists(os.path.join(os.getcwd(), dir_name, 'unsplash_done'))
+            flickr_done = not ignore_done and os.path.exists(os.path.join(os.getcwd(), dir_name, 'flickr_done'))
             if google_done and naver_done and unsplash_done and flickr_done and self.skip:
-                print('Skipping done task {}'.format(dir_name))
+                logger.info('Skipping done task {}'.format(dir_name))
                 continue
 
             if self.do_google and not google_done:
@@ -342,60 +825,130 @@ class AutoCrawler:
                 else:
                     tasks.append([keyword, Sites.FLICKR])
 
-        pool = Pool(self.n_threads)
-        pool.map_async(self.download, tasks)
-        pool.close()
-        pool.join()
-        print('Task ended. Pool join.')
+        return tasks
 
-        self.imbalance_check()
-
-        print('End Program')
+    def run_tasks(self, tasks, stats_index, normalize_stage=None, round_name='crawl'):
+        """
+        Runs tasks on the worker pool, updating the stats index and metrics from each result.
+        With a task queue, tasks are put in it and this node runs whichever tasks it leases.
+        :param normalize_stage: NormalizeStage the workers queue saved images to.
+        :param round_name: Task queue round. Tasks of a round run once over all nodes, until the round is over.
+        :return: Task results
+        """
+        scheduled = [ScheduledTask(task, Sites.get_text(task[1]), self.get_task_priority(*task)) for task in tasks]
+        task_queue = None
+        if self.task_queue:
+            task_queue = SqliteTaskQueue(self.task_queue)
+            scheduler = QueueScheduler(task_queue, self.n_threads, self.site_concurrency,
+                                       lease_seconds=self.queue_lease, round_name=round_name)
+        else:
+            scheduler = SiteScheduler(self.n_threads, self.site_concurrency)
+        metrics = get_metrics()
+
+        results = []
+        normalize_queue = normalize_stage.queue if normalize_stage is not None else None
+        for task, result, error in scheduler.run(scheduled, run_task, initializer=init_worker,
+                                                 initargs=(self, normalize_queue)):
+            if error is not None:
+                result = {'keyword': task.args[0], 'site': task.site, 'status': 'failed', 'count': 0,
+                          'error': str(error)}
+            # Worker metrics arrive with each task result and are summed here.
+            if 'metrics' in result:
+                metrics.merge(result.pop('metrics'))
+            if 'stats' in result:
+                stats_index.update(result['keyword'].replace('"', ''), result['site'], result.pop('stats'))
+                stats_index.save()
+            metrics.inc('tasks_total', site=result['site'], status=result['status'])
+            metrics.observe('task_seconds', task.elapsed, site=result['site'])
+            results.append(result)
+            if task_queue is not None:
+                counts = task_queue.counts()
+                progress = '{} / {} in queue'.format(counts.get('done', 0) + counts.get('failed', 0), sum(counts.values()))
+            else:
+                progress = '{} / {}'.format(len(results), len(scheduled))
+            logger.info('Task {} ({}) - {} : {}, {} images, {:.1f}s'.format(
+                result['status'], progress, result['site'], result['keyword'], result['count'], task.elapsed))
+        logger.info('Task ended. Pool join.')
+        if task_queue is not None:
+            logger.info('Task queue: {}'.format(task_queue.counts()))
+            task_queue.close()
+
+        failed = [result for result in results if result['status'] != 'done']
+        logger.info('{} tasks done, {} failed'.format(len(results) - len(failed), len(failed)))
+        for result in failed:
+            logger.warning('Failed {} : {} - {}'.format(result['site'], result['keyword'], result['error']))
+
+        return results
+
+    def imbalance_check(self, stats_index=None):
+        """
+        Finds keywords with fewer images than imbalance_threshold of the average, from the stats index.
+        'prune' removes their folders. 'requeue' returns them to be crawled again.
+        :return: Keywords to requeue
+        """
+        logger.info('Data imbalance checking...')
+
+        if stats_index is None:
+            stats_index = StatsIndex('{}/_stats.json'.format(self.download_path))
+        if not stats_index.exists():
+            logger.warning('No stats index at {}. Build it with: python dataset_stats.py --download-path {}'.format(
+                stats_index.path, self.download_path))
+            return []
+
+        avg, too_small = stats_index.balance_report(self.imbalance_threshold)
+        for keyword, n_files in sorted(stats_index.keyword_counts().items()):
+            logger.info('keyword: {}, file_count: {}'.format(keyword, n_files))
+
+        if not too_small:
+            logger.info('Data imbalance not detected.')
+            return []
+
+        logger.warning('Data imbalance detected.')
+        logger.info('Below keywords have smaller than {:.0%} of average file count ({:.1f}).'.format(
+            self.imbalance_threshold, avg))
+        logger.info('_________________________________')
+        logger.info('Too small file count keywords:')
+        for keyword, n_files in sorted(too_small.items()):
+            logger.info('keyword: {}, file_count: {}'.format(keyword, n_files))
+
+        if self.imbalance_policy == 'prune':
+            logger.info("Removing too small file count directories...")
+            for keyword in too_small:
+                shutil.rmtree('{}/{}'.format(self.download_path, keyword), ignore_errors=True)
+                stats_index.remove(keyword)
+                logger.info('Removed {}/{}'.format(self.download_path, keyword))
+            stats_index.save()
+            logger.info('Now re-run this program to re-download removed files. (with skip_already_exist=True)')
+
+        elif self.imbalance_policy == 'requeue':
+            return sorted(too_small)
 
-    def imbalance_check(self):
-        print('Data imbalance checking...')
+        else:
+            logger.info('Remove them with --imbalance prune, or crawl them once more with --imbalance requeue.')
 
-        dict_num_files = {}
+        return []
 
-        for keyword_dir in self.all_dirs(self.download_path):
-            n_files = 0
-            for site_dir in self.all_dirs(keyword_dir):
-                n_files += len(self.all_files(site_dir))
-            dict_num_files[keyword_dir] = n_files
 
-        avg = 0
-        for dir, n_files in dict_num_files.items():
-            avg += n_files / len(dict_num_files)
-            print('dir: {}, file_count: {}'.format(dir, n_files))
+_worker_crawler = None
 
-        dict_too_small = {}
 
-        for dir, n_files in dict_num_files.items():
-            if n_files < avg * 0.5:
-                dict_too_small[dir] = n_files
+def setup_logging(level='info'):
+    logging.basicConfig(level=getattr(logging, str(level).upper(), logging.INFO),
+                        format='%(asctime)s %(levelname)s [%(processName)s] %(message)s')
 
-        if len(dict_too_small) >= 1:
-            print('Data imbalance detected.')
-            print('Below keywords have smaller than 50% of average file count.')
-            print('I recommend you to remove these directories and re-download for that keyword.')
-            print('_________________________________')
-            print('Too small file count directories:')
-            for dir, n_files in dict_too_small.items():
-                print('dir: {}, file_count: {}'.format(dir, n_files))
 
-            print("Remove directories above? (y/n)")
-            answer = input()
+def init_worker(crawler, normalize_queue=None):
+    # The crawler is pickled once per worker process instead of once per task.
+    global _worker_crawler
+    _worker_crawler = crawler
+    _worker_crawler.normalize_queue = normalize_queue
+    setup_logging(crawler.log_level)  # no-op in forked workers, which inherit the handler
 
-            if answer == 'y':
-                # removing directories too small files
-                print("Removing too small file count directories...")
-                for dir, n_files in dict_too_small.items():
-                    shutil.rmtree(dir)
-                    print('Removed {}'.format(dir))
 
-                print('Now re-run this program to re-download removed files. (with skip_already_exist=True)')
-        else:
-            print('Data imbalance not detected.')
+def run_task(args):
+    result = _worker_crawler.download(args)
+    result['metrics'] = get_metrics().drain()
+    return result
 
 
 if __name__ == '__main__':
@@ -419,7 +972,123 @@ if __name__ == '__main__':
                         help='Maximum count of images to download per site. (0: infinite)')
     parser.add_argument('--proxy-list', type=str, default='',
                         help='The comma separated proxy list like: "socks://127.0.0.1:1080,http://127.0.0.1:1081". '
-                             'Every thread will randomly choose one from the list.')
+                             'Pages and images use the proxies with the best success rate and latency per site.')
+    parser.add_argument('--download-threads', type=int, default=8,
+                        help='Number of concurrent image downloads per task.')
+    parser.add_argument('--site-download-threads', type=str, default='',
+                        help='Per-site override of --download-threads like: "google:16,flickr:2"')
+    parser.add_argument('--http-pool-size', type=int, default=0,
+                        help='Kept-alive connections per host and proxy. (0: largest download thread count)')
+    parser.add_argument('--http-retries', type=int, default=3,
+                        help='Immediate retries of failed connection attempts. 429/5xx are retried by --max-attempts.')
+    parser.add_argument('--http-keep-alive', type=str, default='true',
+                        help='Reuse connections between image downloads (boolean)')
+    parser.add_argument('--stream', type=str, default='true',
+                        help='Start downloading while links are still being collected (boolean)')
+    parser.add_argument('--content-store', type=str, default='false',
+                        help='Store each distinct image once under download/_objects, deduplicated across keywords and sites (boolean)')
+    parser.add_argument('--content-store-link', type=str, default='hardlink',
+                        help='How keyword/site folders refer to stored images: "hardlink" or "manifest"')
+    parser.add_argument('--resume', type=str, default='true',
+                        help='Resume unfinished tasks from their link manifest (boolean)')
+    parser.add_argument('--manifest-max-age', type=float, default=24,
+                        help='Hours a collected link list stays valid for resuming. (0: forever)')
+    parser.add_argument('--reuse-drivers', type=str, default='true',
+                        help='Keep chrome drivers alive across tasks instead of launching one per task (boolean)')
+    parser.add_argument('--driver-max-tasks', type=int, default=50,
+                        help='Recycle a reused chrome driver after this many tasks. (0: never)')
+    parser.add_argument('--driver-max-rss', type=int, default=2048,
+                        help='Recycle a reused chrome driver above this memory usage in MB. (0: never, needs psutil)')
+    parser.add_argument('--max-attempts', type=int, default=4,
+                        help='Attempts per page load, click and image download, with jittered exponential backoff.')
+    parser.add_argument('--rate-limit', type=float, default=0,
+                        help='Requests per second per host, shared by all threads. (0: unlimited)')
+    parser.add_argument('--rate-burst', type=int, default=4,
+                        help='Requests per host allowed at once after being idle, per thread.')
+    parser.add_argument('--site-concurrency', type=str, default='',
+                        help='Maximum tasks running at once per site like: "google:2,naver:2"')
+    parser.add_argument('--priority', type=str, default='order',
+                        help='Task order: "order" - keyword order, "deficit" - tasks furthest from --limit first')
+    parser.add_argument('--download-engine', type=str, default='thread',
+                        help='Image download engine: "thread" - a thread per download, '
+                             '"async" - one asyncio event loop per task (needs aiohttp)')
+    parser.add_argument('--async-concurrency', type=int, default=256,
+                        help='Maximum downloads in flight per task with --download-engine async.')
+    parser.add_argument('--async-per-host', type=int, default=32,
+                        help='Maximum connections per host with --download-engine async.')
+    parser.add_argument('--log-level', type=str, default='info',
+                        help='"debug", "info", "warning" or "error". Per-download messages are logged at debug.')
+    parser.add_argument('--base-urls', type=str, default='',
+                        help='Per-site override of the site urls like: "google:http://127.0.0.1:8000/google" '
+                             '(ex. for bench_server.py)')
+    parser.add_argument('--imbalance', type=str, default='report',
+                        help='For keywords with few images after crawling: "report" - log them, '
+                             '"prune" - remove their folders, "requeue" - crawl them once more')
+    parser.add_argument('--imbalance-threshold', type=float, default=0.5,
+                        help='Keywords with fewer images than this fraction of the average are under-filled.')
+    parser.add_argument('--normalize', type=str, default='false',
+                        help='Resize and re-encode saved images without metadata while crawling (boolean)')
+    parser.add_argument('--normalize-max-side', type=int, default=0,
+                        help='Longest side of normalized images in pixels. (0: keep size)')
+    parser.add_argument('--normalize-format', type=str, default='jpg', help='"jpg", "png" or "webp"')
+    parser.add_argument('--normalize-quality', type=int, default=90, help='jpg and webp quality of normalized images.')
+    parser.add_argument('--normalize-keep-original', type=str, default='false',
+                        help='Keep originals in <site>_original folders (boolean)')
+    parser.add_argument('--normalize-processes', type=int, default=0,
+                        help='Processes normalizing images. (0: number of CPUs)')
+    parser.add_argument('--output', type=str, default='files',
+                        help='"files" - one file per image, "shards" - rolling tar shards with an index in download/_shards')
+    parser.add_argument('--shard-size', type=int, default=1024,
+                        help='Maximum size of a tar shard in MB.')
+    parser.add_argument('--url-index', type=str, default='false',
+                        help='Skip image urls downloaded before by any keyword, site or run, '
+                             'kept in download/_url_index.bin (boolean)')
+    parser.add_argument('--proxy-probe-url', type=str, default='',
+                        help='Requested through every proxy before crawling. Proxies failing it are dropped. '
+                             'ex) http://www.gstatic.com/generate_204')
+    parser.add_argument('--proxy-cooldown', type=float, default=60,
+                        help='Seconds a proxy failing 3 times in a row is not used for a site, doubled every time.')
+    parser.add_argument('--task-queue', type=str, default='',
+                        help='SQLite file of a task queue shared by crawler nodes, ex) on a shared volume. '
+                             'Every node runs the same command and crawls tasks no other node is crawling.')
+    parser.add_argument('--queue-lease', type=float, default=300,
+                        help='Seconds after which a task of a node that stopped is crawled by another node.')
+    parser.add_argument('--http-collectors', type=str, default='',
+                        help='Sites collected from their search results over HTTP instead of chrome, '
+                             'like: "unsplash,flickr" (the only ones supported)')
+    parser.add_argument('--detail-workers', type=int, default=1,
+                        help='Chrome browsers per task opening detail views at once in google and naver --full mode.')
+    parser.add_argument('--network-capture', type=str, default='false',
+                        help='Lightweight chrome profile blocking --block-resources, which also collects thumbnail urls '
+                             'from the image requests of result pages (boolean)')
+    parser.add_argument('--block-resources', type=str, default='font,media',
+                        help='Resource types blocked with --network-capture: "font", "media", "stylesheet"')
+    parser.add_argument('--task-time-limit', type=float, default=0,
+                        help='Seconds a keyword/site task collects and downloads before it stops. (0: no limit)')
+    parser.add_argument('--task-size-limit', type=int, default=0,
+                        help='MB of images a keyword/site task saves before it stops. (0: no limit)')
+    parser.add_argument('--overcollect', type=float, default=1.25,
+                        help='Links collected per image of --limit before any download failed. '
+                             'Follows the failure rate of the task afterwards.')
+    parser.add_argument('--min-width', type=int, default=0,
+                        help='Images narrower than this are dropped after their header. (0: no limit)')
+    parser.add_argument('--min-height', type=int, default=0,
+                        help='Images lower than this are dropped after their header. (0: no limit)')
+    parser.add_argument('--max-width', type=int, default=0,
+                        help='Images wider than this are dropped after their header. (0: no limit)')
+    parser.add_argument('--max-height', type=int, default=0,
+                        help='Images higher than this are dropped after their header. (0: no limit)')
+    parser.add_argument('--min-aspect', type=float, default=0,
+                        help='Images with a lower width / height are dropped after their header. (0: no limit)')
+    parser.add_argument('--max-aspect', type=float, default=0,
+                        help='Images with a higher width / height are dropped after their header. (0: no limit)')
+    parser.add_argument('--max-image-size', type=int, default=0,
+                        help='Images larger than this many KB are dropped, by Content-Length if known. (0: no limit)')
+    parser.add_argument('--formats', type=str, default='',
+                        help='Allowed image formats like: "jpg,png,webp". Others are dropped after their header. '
+                             '(empty: all)')
+    parser.add_argument('--metrics-interval', type=float, default=10,
+                        help='Seconds between writes of download/_metrics.json and _metrics.prom. (0: at the end only)')
     args = parser.parse_args()
 
     _skip = False if str(args.skip).lower() == 'false' else True
@@ -433,6 +1102,67 @@ if __name__ == '__main__':
     _ccl = False if str(args.ccl).lower() == 'false' else True
     _limit = int(args.limit)
     _proxy_list = args.proxy_list.split(',')
+    _download_threads = int(args.download_threads)
+    _site_download_threads = {}
+    for item in filter(None, args.site_download_threads.split(',')):
+        site, n = item.split(':')
+        _site_download_threads[site.strip()] = int(n)
+    _http_pool_size = int(args.http_pool_size)
+    _http_retries = int(args.http_retries)
+    _http_keep_alive = False if str(args.http_keep_alive).lower() == 'false' else True
+    _stream = False if str(args.stream).lower() == 'false' else True
+    _content_store = False if str(args.content_store).lower() == 'false' else True
+    _content_store_link = str(args.content_store_link).lower()
+    _resume = False if str(args.resume).lower() == 'false' else True
+    _manifest_max_age = args.manifest_max_age * 60 * 60 if args.manifest_max_age > 0 else None
+    _reuse_drivers = False if str(args.reuse_drivers).lower() == 'false' else True
+    _driver_max_tasks = int(args.driver_max_tasks)
+    _driver_max_rss = int(args.driver_max_rss)
+    _max_attempts = int(args.max_attempts)
+    _rate_limit = float(args.rate_limit)
+    _rate_burst = int(args.rate_burst)
+    _site_concurrency = {}
+    for item in filter(None, args.site_concurrency.split(',')):
+        site, n = item.split(':')
+        _site_concurrency[site.strip()] = int(n)
+    _priority = str(args.priority).lower()
+    _download_engine = str(args.download_engine).lower()
+    _async_concurrency = int(args.async_concurrency)
+    _async_per_host = int(args.async_per_host)
+    _log_level = str(args.log_level).lower()
+    _metrics_interval = float(args.metrics_interval)
+    _imbalance = str(args.imbalance).lower()
+    _imbalance_threshold = float(args.imbalance_threshold)
+    _normalizer = None
+    if str(args.normalize).lower() != 'false':
+        _normalizer = Normalizer(max_side=int(args.normalize_max_side), fmt=str(args.normalize_format).lower(),
+                                 quality=int(args.normalize_quality),
+                                 keep_original=False if str(args.normalize_keep_original).lower() == 'false' else True)
+    _normalize_processes = int(args.normalize_processes) if args.normalize_processes > 0 else None
+    _output = str(args.output).lower()
+    _shard_size = int(args.shard_size) * 1024 * 1024
+    _url_index = False if str(args.url_index).lower() == 'false' else True
+    _proxy_probe_url = args.proxy_probe_url if args.proxy_probe_url else None
+    _proxy_cooldown = float(args.proxy_cooldown)
+    _task_queue = args.task_queue if args.task_queue else None
+    _queue_lease = float(args.queue_lease)
+    _detail_workers = int(args.detail_workers)
+    _network_capture = False if str(args.network_capture).lower() == 'false' else True
+    _block_resources = [resource.strip() for resource in filter(None, args.block_resources.split(','))]
+    _task_time_limit = float(args.task_time_limit)
+    _task_size_limit = int(args.task_size_limit) * 1024 * 1024
+    _overcollect = float(args.overcollect)
+    _image_filter = ImageFilter(min_width=int(args.min_width), min_height=int(args.min_height),
+                                max_width=int(args.max_width), max_height=int(args.max_height),
+                                min_aspect=float(args.min_aspect), max_aspect=float(args.max_aspect),
+                                max_bytes=int(args.max_image_size) * 1024,
+                                formats=[fmt.strip().lower() for fmt in filter(None, args.formats.split(','))])
+    _http_collectors = [site.strip() for site in filter(None, args.http_collectors.split(','))]
+    _base_urls = {}
+    for item in filter(None, args.base_urls.split(',')):
+        site, url = item.split(':', 1)
+        _base_urls[site.strip()] = url.strip()
+    setup_logging(_log_level)
 
     no_gui_input = str(args.no_gui).lower()
     if no_gui_input == 'auto':
@@ -442,11 +1172,29 @@ if __name__ == '__main__':
     else:
         _no_gui = False
 
-    print(
-        'Options - skip:{}, threads:{}, google:{}, naver:{}, unsplash:{}, flickr:{}, full_resolution:{}, face:{}, ccl:{}, no_gui:{}, limit:{}, _proxy_list:{}'
-            .format(_skip, _threads, _google, _naver, _unsplash, _flickr, _full, _face, _ccl, _no_gui, _limit, _proxy_list))
+    logger.info(
+        'Options - skip:{}, threads:{}, google:{}, naver:{}, unsplash:{}, flickr:{}, full_resolution:{}, face:{}, ccl:{}, no_gui:{}, limit:{}, _proxy_list:{}, download_threads:{}, site_download_threads:{}'
+            .format(_skip, _threads, _google, _naver, _unsplash, _flickr, _full, _face, _ccl, _no_gui, _limit, _proxy_list,
+                    _download_threads, _site_download_threads))
 
     crawler = AutoCrawler(skip_already_exist=_skip, n_threads=_threads,
                           do_google=_google, do_naver=_naver, do_unsplash=_unsplash, do_flickr=_flickr,
-                          full_resolution=_full, face=_face, no_gui=_no_gui, limit=_limit, proxy_list=_proxy_list)
+                          full_resolution=_full, face=_face, no_gui=_no_gui, limit=_limit, proxy_list=_proxy_list,
+                          download_threads=_download_threads, site_download_threads=_site_download_threads,
+                          http_pool_size=_http_pool_size, http_retries=_http_retries, http_keep_alive=_http_keep_alive,
+                          stream_links=_stream, content_store=_content_store, content_store_link=_content_store_link,
+                          resume=_resume, manifest_max_age=_manifest_max_age, reuse_drivers=_reuse_drivers,
+                          driver_max_tasks=_driver_max_tasks, driver_max_rss=_driver_max_rss,
+                          max_attempts=_max_attempts, rate_limit=_rate_limit, rate_burst=_rate_burst,
+                          site_concurrency=_site_concurrency, task_priority=_priority,
+                          download_engine=_download_engine, async_concurrency=_async_concurrency,
+                          async_per_host=_async_per_host, log_level=_log_level,
+                          metrics_interval=_metrics_interval, base_urls=_base_urls, imbalance_policy=_imbalance,
+                          imbalance_threshold=_imbalance_threshold, normalizer=_normalizer,
+                          normalize_processes=_normalize_processes, output_format=_output, shard_size=_shard_size,
+                          url_index=_url_index, proxy_probe_url=_proxy_probe_url, proxy_cooldown=_proxy_cooldown,
+                          task_queue=_task_queue, queue_lease=_queue_lease, http_collectors=_http_collectors,
+                          detail_workers=_detail_workers, network_capture=_network_capture,
+                          block_resources=_block_resources, task_time_limit=_task_time_limit,
+                          task_size_limit=_task_size_limit, overcollect=_overcollect, image_filter=_image_filter)
     crawler.do_crawling()
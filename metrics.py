@@ -0,0 +1,231 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Seconds. Covers a fast scrape pass up to a slow chrome start or full-resolution page.
+TIME_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_PER_SECOND_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024,
+                            64 * 1024 * 1024)
+
+
+class Metrics:
+    def __init__(self):
+        """
+        Counters and histograms labelled by site, keyword, ...
+        Each worker process records its own and drain()s them into its task results,
+        and the main process merge()s them into one view that MetricsExporter writes out.
+        """
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted((str(k), str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=TIME_BUCKETS, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # Bucket counts are not cumulative here. The last one counts values above every bucket.
+                histogram = {'buckets': list(buckets), 'counts': [0] * (len(buckets) + 1), 'sum': 0, 'count': 0}
+                self.histograms[key] = histogram
+            histogram['counts'][bisect_left(histogram['buckets'], value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def timer(self, name, **labels):
+        """
+        with metrics.timer('page_load_seconds', site='google'):
+        """
+        return Timer(self, name, labels)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in self.counters.items()],
+                'histograms': [dict(histogram, name=name, labels=dict(labels), counts=list(histogram['counts']))
+                               for (name, labels), histogram in self.histograms.items()],
+            }
+
+    def drain(self):
+        """
+        :return: snapshot() of everything recorded since the last drain
+        """
+        with self.lock:
+            snapshot = {
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in self.counters.items()],
+                'histograms': [dict(histogram, name=name, labels=dict(labels))
+                               for (name, labels), histogram in self.histograms.items()],
+            }
+            self.counters = {}
+            self.histograms = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        with self.lock:
+            for counter in snapshot['counters']:
+                key = self.key(counter['name'], counter['labels'])
+                self.counters[key] = self.counters.get(key, 0) + counter['value']
+
+            for other in snapshot['histograms']:
+                key = self.key(other['name'], other['labels'])
+                histogram = self.histograms.get(key)
+                if histogram is None or histogram['buckets'] != other['buckets']:
+                    histogram = {'buckets': list(other['buckets']), 'counts': [0] * len(other['counts']),
+                                 'sum': 0, 'count': 0}
+                    self.histograms[key] = histogram
+                histogram['counts'] = [a + b for a, b in zip(histogram['counts'], other['counts'])]
+                histogram['sum'] += other['sum']
+                histogram['count'] += other['count']
+
+    def to_json(self):
+        return json.dumps(dict(self.snapshot(), time=time.time()), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self):
+        """
+        :return: Prometheus text exposition format. Metric names are prefixed with autocrawler_.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+
+        for counter in sorted(snapshot['counters'], key=lambda c: c['name']):
+            name = 'autocrawler_' + counter['name']
+            if name not in typed:
+                lines.append('# TYPE {} counter'.format(name))
+                typed.add(name)
+            lines.append('{}{} {}'.format(name, format_labels(counter['labels']), counter['value']))
+
+        for histogram in sorted(snapshot['histograms'], key=lambda h: h['name']):
+            name = 'autocrawler_' + histogram['name']
+            if name not in typed:
+                lines.append('# TYPE {} histogram'.format(name))
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(list(histogram['buckets']) + ['+Inf'], histogram['counts']):
+                cumulative += count
+                labels = dict(histogram['labels'], le=bound)
+                lines.append('{}_bucket{} {}'.format(name, format_labels(labels), cumulative))
+            lines.append('{}_sum{} {}'.format(name, format_labels(histogram['labels']), histogram['sum']))
+            lines.append('{}_count{} {}'.format(name, format_labels(histogram['labels']), histogram['count']))
+
+        return '\n'.join(lines) + '\n'
+
+
+class Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.start = None
+        self.elapsed = None
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed = time.monotonic() - self.start
+        self.metrics.observe(self.name, self.elapsed, **self.labels)
+        return False
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = ('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for k, v in sorted(labels.items()))
+    return '{' + ','.join(escaped) + '}'
+
+
+def write_atomic(path, text):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class MetricsExporter:
+    def __init__(self, metrics, path, interval=10):
+        """
+        Periodically writes metrics to path.json (snapshot) and path.prom (Prometheus textfile collector).
+        :param path: Output path without extension. ex) download/_metrics
+        :param interval: Seconds between writes. (0: only when stopped)
+        """
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.interval:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.write()
+
+    def write(self):
+        try:
+            write_atomic(self.path + '.json', self.metrics.to_json())
+            write_atomic(self.path + '.prom', self.metrics.to_prometheus())
+        except OSError as e:
+            logger.warning('Failed to write metrics - {}'.format(e))
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.write()
+
+
+_metrics = None
+_metrics_pid = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """
+    Returns the Metrics recorded by every thread of this process.
+    """
+    global _metrics, _metrics_pid
+
+    with _metrics_lock:
+        if _metrics_pid != os.getpid():
+            _metrics = Metrics()
+            _metrics_pid = os.getpid()
+
+        return _metrics
@@ -0,0 +1,168 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import logging
+import os
+import multiprocessing
+import queue
+from PIL import Image, ImageOps
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# PIL format names
+FORMATS = {
+    'jpg': 'JPEG',
+    'png': 'PNG',
+    'webp': 'WEBP',
+}
+
+
+class Normalizer:
+    def __init__(self, max_side=0, fmt='jpg', quality=90, keep_original=False):
+        """
+        Rewrites a saved image as a compact, uniform file: oriented by its EXIF tag, resized, re-encoded,
+        without metadata. The new file replaces the original with one rename, so a hardlinked
+        content store object is never modified.
+        :param max_side: Resize so that the longer side is at most this many pixels. (0: keep size)
+        :param fmt: 'jpg', 'png' or 'webp'
+        :param quality: jpg and webp quality
+        :param keep_original: Move the original to <site>_original/ next to the site folder.
+        """
+        if fmt not in FORMATS:
+            raise ValueError('Unsupported normalize format: {} (choose from {})'.format(fmt, ', '.join(FORMATS)))
+
+        self.max_side = max_side
+        self.fmt = fmt
+        self.quality = quality
+        self.keep_original = keep_original
+
+    def normalize(self, path):
+        """
+        :return: Path of the normalized image
+        """
+        no_ext_path = os.path.splitext(path)[0]
+        new_path = '{}.{}'.format(no_ext_path, self.fmt)
+        tmp_path = no_ext_path + '.norm.part'
+
+        with Image.open(path) as img:
+            img = ImageOps.exif_transpose(img)  # EXIF is dropped, so apply its orientation first.
+
+            if self.max_side and max(img.size) > self.max_side:
+                img.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+
+            if self.fmt == 'jpg' and img.mode != 'RGB':
+                img = self.to_rgb(img)
+            elif img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                img = img.convert('RGBA')
+
+            # Saving without exif/icc_profile/pnginfo arguments writes no metadata.
+            img.save(tmp_path, FORMATS[self.fmt], quality=self.quality, optimize=True)
+
+        if self.keep_original:
+            site_dir, name = os.path.split(path)
+            original_dir = site_dir + '_original'
+            os.makedirs(original_dir, exist_ok=True)
+            os.replace(path, os.path.join(original_dir, name))
+        elif path != new_path:
+            os.remove(path)
+
+        os.replace(tmp_path, new_path)
+        return new_path
+
+    @staticmethod
+    def to_rgb(img):
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            return background
+        return img.convert('RGB')
+
+
+def normalize_worker(normalizer, path_queue, result_queue):
+    """
+    Puts ('normalized', path, new path, new size) on result_queue for every image rewritten,
+    and ('metrics', snapshot) once path_queue is closed.
+    """
+    while True:
+        path = path_queue.get()
+        if path is None:
+            break
+
+        if '{}_objects{}'.format(os.sep, os.sep) in os.path.abspath(path):
+            continue  # content store object of 'manifest' mode. Shared, so never rewritten.
+
+        metrics = get_metrics()
+        try:
+            with metrics.timer('normalize_seconds'):
+                new_path = normalizer.normalize(path)
+            metrics.inc('normalized_total', result='ok')
+            result_queue.put(('normalized', path, new_path, os.path.getsize(new_path)))
+        except Exception as e:
+            logger.warning('Normalize failed - {} ({})'.format(path, e))
+            metrics.inc('normalized_total', result='failed')
+
+    result_queue.put(('metrics', get_metrics().drain()))
+
+
+class NormalizeStage:
+    def __init__(self, normalizer, n_processes=None):
+        """
+        Normalizes images in separate processes while the crawl is running.
+        Download workers only put paths on the queue, so they never wait for it.
+        :param n_processes: Number of normalize processes. (None: number of CPUs)
+        """
+        self.normalizer = normalizer
+        self.n_processes = n_processes if n_processes else os.cpu_count() or 1
+        self.queue = multiprocessing.Queue()
+        self.result_queue = multiprocessing.Queue()
+        self.processes = []
+        self.normalized = []  # (path, new path, new size) of every rewritten image, filled by stop()
+
+    def start(self):
+        for _ in range(self.n_processes):
+            process = multiprocessing.Process(target=normalize_worker,
+                                              args=(self.normalizer, self.queue, self.result_queue), daemon=True)
+            process.start()
+            self.processes.append(process)
+        return self
+
+    def stop(self):
+        """
+        Waits until every queued image is normalized. Rewritten images are listed in self.normalized.
+        :return: Metrics snapshots of the normalize processes
+        """
+        for _ in self.processes:
+            self.queue.put(None)
+
+        snapshots = []
+        while len(snapshots) < len(self.processes):
+            try:
+                result = self.result_queue.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in self.processes):
+                    break  # crashed
+                continue
+            if result[0] == 'metrics':
+                snapshots.append(result[1])
+            else:
+                self.normalized.append(result[1:])
+
+        for process in self.processes:
+            process.join()
+        self.processes = []
+        return snapshots
@@ -0,0 +1,246 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import requests
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Responses meaning the proxy, not the image, is the problem: proxy authentication, rate limited proxy address.
+PROXY_BLOCKED_STATUS = (407, 429)
+
+# requests errors of a bad or unreachable proxy. ProxyError is a ConnectionError. An unusable proxy url
+# (InvalidSchema, unknown socks version, PySocks missing) is a ValueError.
+PROXY_ERRORS = (requests.ConnectionError, requests.Timeout, ValueError)
+
+
+class ProxyStats:
+    def __init__(self):
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency = None  # exponentially weighted moving average, seconds
+        self.cooldown_until = 0.0
+        self.cooldowns = 0
+
+    def success_rate(self):
+        # Laplace smoothing: an unused proxy starts at 0.5 instead of 0 or 1.
+        return (self.successes + 1) / (self.successes + self.failures + 2)
+
+
+class ProxyManager:
+    def __init__(self, proxies, max_failures=3, cooldown=60.0, max_cooldown=900.0, evict_after=4, alpha=0.3):
+        """
+        Picks a proxy per request, weighted by its success rate and latency for the site, and cools down
+        proxies that keep failing.
+        :param proxies: ex) ['socks5://127.0.0.1:1080', 'http://127.0.0.1:1081']
+        :param max_failures: Consecutive failures on a site before the proxy cools down for that site.
+        :param cooldown: Seconds of the first cooldown, doubled for every following one up to max_cooldown.
+        :param evict_after: Cooldowns after which the proxy is never picked again for the site.
+        :param alpha: Weight of the newest sample in the latency average.
+        """
+        self.proxies = list(dict.fromkeys(p.strip() for p in proxies if p and p.strip()))
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.evict_after = evict_after
+        self.alpha = alpha
+
+        self.stats = {}  # (proxy, site) -> ProxyStats. site None: probes, shared by every site
+        self.lock = threading.Lock()
+
+    def get_stats(self, proxy, site):
+        key = (proxy, site)
+        if key not in self.stats:
+            self.stats[key] = ProxyStats()
+        return self.stats[key]
+
+    def is_evicted(self, proxy, site):
+        return any(self.get_stats(proxy, s).cooldowns >= self.evict_after for s in {site, None})
+
+    def available_at(self, proxy, site):
+        return max(self.get_stats(proxy, s).cooldown_until for s in {site, None})
+
+    def weight(self, proxy, site):
+        stats = self.get_stats(proxy, site)
+        latency = stats.latency if stats.latency is not None else self.get_stats(proxy, None).latency
+        if latency is None:
+            latencies = [s.latency for s in self.stats.values() if s.latency is not None]
+            latency = sorted(latencies)[len(latencies) // 2] if latencies else 1.0
+        return stats.success_rate() / max(latency, 0.01)
+
+    def choose(self, site=None, schemes=None):
+        """
+        :param site: ex) 'google'. Success rates and latencies are kept per site.
+        :param schemes: Only proxies with these schemes. ex) ('http', 'https') for clients without socks support
+        :return: A proxy url, or None without usable proxies
+        """
+        with self.lock:
+            proxies = [p for p in self.proxies if schemes is None or urlsplit(p).scheme in schemes]
+            proxies = [p for p in proxies if not self.is_evicted(p, site)]
+            if not proxies:
+                return None
+
+            now = time.monotonic()
+            ready = [p for p in proxies if self.available_at(p, site) <= now]
+            if not ready:
+                # All cooling down. The one ready soonest is better than stalling the task.
+                return min(proxies, key=lambda p: self.available_at(p, site))
+
+            weights = [self.weight(p, site) for p in ready]
+            return random.choices(ready, weights=weights)[0]
+
+    def report(self, proxy, site, ok, latency=None):
+        """
+        Records the result of one request through proxy.
+        :param ok: False for connection errors, timeouts and responses that look like a blocked proxy
+        """
+        if proxy is None:
+            return
+
+        with self.lock:
+            stats = self.get_stats(proxy, site)
+            if ok:
+                stats.successes += 1
+                stats.consecutive_failures = 0
+                if latency is not None:
+                    stats.latency = latency if stats.latency is None else \
+                        self.alpha * latency + (1 - self.alpha) * stats.latency
+            else:
+                stats.failures += 1
+                stats.consecutive_failures += 1
+                if stats.consecutive_failures >= self.max_failures:
+                    stats.consecutive_failures = 0
+                    stats.cooldowns += 1
+                    delay = min(self.max_cooldown, self.cooldown * 2 ** (stats.cooldowns - 1))
+                    stats.cooldown_until = time.monotonic() + delay
+                    if stats.cooldowns >= self.evict_after:
+                        logger.warning('Evicted proxy {} for {}'.format(proxy_label(proxy), site or 'every site'))
+                    else:
+                        logger.info('Proxy {} cools down for {:.0f}s on {}'.format(proxy_label(proxy), delay,
+                                                                                    site or 'every site'))
+
+        metrics = get_metrics()
+        labels = {'proxy': proxy_label(proxy), 'site': site or 'probe'}
+        metrics.inc('proxy_requests_total', result='ok' if ok else 'failed', **labels)
+        if ok and latency is not None:
+            metrics.observe('proxy_latency_seconds', latency, **labels)
+
+    @contextmanager
+    def use(self, site=None, fail_on=(Exception,), schemes=None):
+        """
+        Chooses a proxy and reports how the request made with it went.
+        Exceptions in fail_on count as a failure of the proxy, others as a success. ex) 404 of the image host
+        """
+        proxy = self.choose(site, schemes)
+        start = time.monotonic()
+        try:
+            yield proxy
+        except fail_on:
+            self.report(proxy, site, False)
+            raise
+        except BaseException:
+            self.report(proxy, site, True, time.monotonic() - start)
+            raise
+        else:
+            self.report(proxy, site, True, time.monotonic() - start)
+
+    def probe(self, url, timeout=10, n_threads=16):
+        """
+        Requests url through every proxy at once. Failing proxies are cooled down for every site.
+        :param url: Small page reachable through a healthy proxy. ex) http://www.gstatic.com/generate_204
+        :return: {proxy: latency in seconds or None if it failed}
+        """
+        def check(proxy):
+            start = time.monotonic()
+            try:
+                response = requests.get(url, proxies={'http': requests_proxy(proxy), 'https': requests_proxy(proxy)},
+                                        timeout=timeout, stream=True)
+                response.close()
+                ok = response.status_code < 400
+            except (requests.RequestException, ValueError) as e:
+                logger.debug('Proxy probe failed {} - {}'.format(proxy_label(proxy), e))
+                ok = False
+            return time.monotonic() - start if ok else None
+
+        if not self.proxies:
+            return {}
+
+        with ThreadPoolExecutor(max_workers=min(n_threads, len(self.proxies))) as executor:
+            results = dict(zip(self.proxies, executor.map(check, self.proxies)))
+
+        for proxy, latency in results.items():
+            if latency is None:
+                # Straight to a cooldown, a dead proxy doesn't need max_failures tries.
+                for _ in range(self.max_failures):
+                    self.report(proxy, None, False)
+            else:
+                self.report(proxy, None, True, latency)
+
+        return results
+
+
+def requests_proxy(proxy):
+    """
+    :return: proxy as requests (PySocks) understands it. socks:// and socks5:// become socks5h://,
+             which resolves host names through the proxy like chrome does. ex) socks://127.0.0.1:1080
+    """
+    if proxy is None:
+        return None
+    scheme, sep, rest = str(proxy).partition('://')
+    if sep and scheme.lower() in ('socks', 'socks5'):
+        return 'socks5h://' + rest
+    return proxy
+
+
+def proxy_label(proxy):
+    # Without credentials, for logs and metrics. ex) http://user:pw@10.0.0.1:3128 -> http://10.0.0.1:3128
+    parts = urlsplit(str(proxy))
+    if not parts.hostname:
+        return str(proxy)
+    return '{}://{}{}'.format(parts.scheme, parts.hostname, ':{}'.format(parts.port) if parts.port else '')
+
+
+_proxy_managers = {}
+_proxy_managers_pid = None
+_proxy_managers_lock = threading.Lock()
+
+
+def get_proxy_manager(proxies, **kwargs):
+    """
+    Returns the ProxyManager shared by the collectors and downloads of this process for these proxies.
+    :param kwargs: ProxyManager arguments, used only when the manager is created.
+    """
+    global _proxy_managers, _proxy_managers_pid
+
+    key = tuple(proxies)
+    with _proxy_managers_lock:
+        if _proxy_managers_pid != os.getpid():
+            _proxy_managers = {}
+            _proxy_managers_pid = os.getpid()
+
+        if key not in _proxy_managers:
+            _proxy_managers[key] = ProxyManager(proxies, **kwargs)
+
+        return _proxy_managers[key]
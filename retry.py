@@ -0,0 +1,168 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RetryableError(Exception):
+    pass
+
+
+class RetryError(Exception):
+    pass
+
+
+class RateLimiter:
+    def __init__(self, rate=0, burst=1):
+        """
+        Token bucket per host.
+        :param rate: Requests per second per host. (0: unlimited)
+        :param burst: Requests allowed at once after being idle.
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.buckets = {}  # host -> [tokens, last refill time]
+        self.lock = threading.Lock()
+
+    def try_acquire(self, host):
+        """
+        Takes a token for host if one is available.
+        :return: 0 if the request is allowed, otherwise seconds to wait before trying again
+        """
+        if not self.rate:
+            return 0
+
+        with self.lock:
+            now = time.monotonic()
+            tokens, last = self.buckets.get(host, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+
+            if tokens >= 1:
+                self.buckets[host] = (tokens - 1, now)
+                return 0
+
+            self.buckets[host] = (tokens, now)
+            return (1 - tokens) / self.rate
+
+    def acquire(self, host):
+        """
+        Blocks until a request to host is allowed.
+        """
+        wait = self.try_acquire(host)
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.try_acquire(host)
+
+    async def acquire_async(self, host):
+        wait = self.try_acquire(host)
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self.try_acquire(host)
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=4, base_delay=1.0, max_delay=30.0, rate_limiter=None):
+        """
+        Bounded retries with jittered exponential backoff.
+        :param max_attempts: Total attempts including the first one.
+        :param base_delay: Seconds before the first retry, doubled for every following one.
+        :param max_delay: Upper bound of a single delay.
+        :param rate_limiter: RateLimiter applied before every attempt.
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limiter = rate_limiter
+
+    def get_delay(self, attempt):
+        # "Full jitter": spreads retries of many workers instead of synchronizing them.
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def wait(self, url):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(urlsplit(str(url)).netloc)
+
+    def call(self, func, url=None, retry_on=(Exception,), on_retry=None):
+        """
+        Calls func() until it succeeds or max_attempts is reached.
+        :param url: Rate limited by the host of this url.
+        :param retry_on: Exception types worth retrying. Others are raised immediately.
+        :param on_retry: Called with the exception before sleeping. ex) refresh the page
+        :raises RetryError: All attempts failed.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            self.wait(url)
+            try:
+                return func()
+            except retry_on as e:
+                if attempt == self.max_attempts:
+                    raise RetryError('Gave up after {} attempts - {}'.format(attempt, e)) from e
+
+                delay = self.get_delay(attempt)
+                logger.info('Retrying in {:.1f}s ({} / {}) - {}'.format(delay, attempt, self.max_attempts, e))
+                get_metrics().inc('retries_total', host=urlsplit(str(url)).netloc)
+                if on_retry is not None:
+                    on_retry(e)
+                time.sleep(delay)
+
+    async def call_async(self, func, url=None, retry_on=(Exception,)):
+        """
+        Same as call, for a coroutine function. Waits without blocking the event loop.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_async(urlsplit(str(url)).netloc)
+            try:
+                return await func()
+            except retry_on as e:
+                if attempt == self.max_attempts:
+                    raise RetryError('Gave up after {} attempts - {}'.format(attempt, e)) from e
+
+                delay = self.get_delay(attempt)
+                logger.info('Retrying in {:.1f}s ({} / {}) - {}'.format(delay, attempt, self.max_attempts, e))
+                get_metrics().inc('retries_total', host=urlsplit(str(url)).netloc)
+                await asyncio.sleep(delay)
+
+
+_rate_limiters = {}
+_rate_limiters_pid = None
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(rate=0, burst=1):
+    """
+    Returns the RateLimiter shared by the collectors and downloads of this process for these settings.
+    """
+    global _rate_limiters, _rate_limiters_pid
+
+    with _rate_limiters_lock:
+        if _rate_limiters_pid != os.getpid():
+            _rate_limiters = {}
+            _rate_limiters_pid = os.getpid()
+
+        if (rate, burst) not in _rate_limiters:
+            _rate_limiters[(rate, burst)] = RateLimiter(rate, burst)
+
+        return _rate_limiters[(rate, burst)]
@@ -0,0 +1,295 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+from itertools import count
+from multiprocessing import Pool, SimpleQueue, active_children
+
+logger = logging.getLogger(__name__)
+
+_started = None  # worker side of SiteScheduler.run's started queue
+
+
+class WorkerLostError(Exception):
+    pass
+
+
+def init_scheduled_worker(started, initializer, initargs):
+    global _started
+    _started = started
+    _started.put((None, os.getpid()))  # tells the scheduler the pids of the pool
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def start_task(func, key, args):
+    # Tells the scheduler which worker runs the task, so it notices if that worker dies.
+    _started.put((key, os.getpid()))
+    return func(args)
+
+
+class WorkerTracker:
+    def __init__(self, started):
+        """
+        Finds the tasks of pool workers that died. Pool never finishes them.
+        :param started: Queue of (key, pid) from start_task, and (None, pid) from each starting worker.
+        """
+        self.started = started
+        self.workers = {}  # key -> pid of the worker running it
+        self.pids = set()  # pids of the pool workers
+        self.suspects = []  # keys without a worker when a worker died without a known task
+        self.n_unknown = 0  # workers that died without a known task
+
+    def read(self, in_flight):
+        while not self.started.empty():
+            key, pid = self.started.get()
+            if key is None:
+                self.pids.add(pid)
+            elif key in in_flight:
+                self.workers[key] = pid
+
+    def finish(self, key):
+        self.workers.pop(key, None)
+
+    def fail_lost_tasks(self, in_flight, done):
+        """
+        Fails tasks whose worker exited. A worker may die after taking a task but before start_task tells its pid,
+        so tasks still without a worker one check after an unknown death are failed too, oldest first.
+        :return: Number of tasks failed because their worker is gone
+        """
+        self.read(in_flight)
+
+        def running(key):
+            return key in in_flight and key not in self.workers and not in_flight[key][1].ready()
+
+        lost = {}  # key -> pid
+        for key in [key for key in self.suspects if running(key)][:self.n_unknown]:
+            lost[key] = None
+
+        alive = {process.pid for process in active_children()}
+        gone = self.pids - alive
+        for key, pid in list(self.workers.items()):
+            if pid not in alive and not in_flight[key][1].ready():
+                lost[key] = pid
+                del self.workers[key]
+        self.pids -= gone
+
+        self.n_unknown = len(gone - set(lost.values()))
+        self.suspects = [key for key in sorted(in_flight) if running(key) and key not in lost] if self.n_unknown else []
+
+        for key, pid in lost.items():
+            worker = 'Worker {}'.format(pid) if pid is not None else 'A worker'
+            logger.warning('{} exited while running a task'.format(worker))
+            done.put((key, None, WorkerLostError('{} exited while running the task'.format(worker))))
+        return len(lost)
+
+
+class ScheduledTask:
+    def __init__(self, args, site, priority=0):
+        """
+        :param args: Passed to the worker function. Only these are pickled, not the crawler.
+        :param site: Site name for per-site concurrency limits. ex) 'google'
+        :param priority: Lower runs first.
+        """
+        self.args = args
+        self.site = site
+        self.priority = priority
+
+
+class SiteScheduler:
+    def __init__(self, n_workers, site_limits=None):
+        """
+        Dispatches tasks to a process pool one at a time, whenever a worker is free,
+        so a slow task never holds back others queued behind it.
+        :param n_workers: Number of worker processes.
+        :param site_limits: Maximum concurrent tasks per site. ex) {'google': 2} (missing: n_workers)
+        """
+        self.n_workers = n_workers
+        self.site_limits = site_limits if site_limits else {}
+        self.poll_interval = 5  # seconds between looking for tasks when none can start
+
+    def get_limit(self, site):
+        return max(1, min(self.n_workers, self.site_limits.get(site, self.n_workers)))
+
+    def run(self, tasks, func, initializer=None, initargs=()):
+        """
+        Yields (task, result, error) as tasks finish. error is None if func succeeded.
+        :param func: Top-level function called as func(task.args) in a worker.
+        :param initializer: Called once per worker with initargs. ex) keep the crawler in a global
+        """
+        pending = self.prepare(tasks)
+        running = {}  # site -> count
+        done = queue.Queue()
+        n_running = 0
+        keys = count()
+        in_flight = {}  # key -> (task, AsyncResult)
+        started = SimpleQueue()
+        tracker = WorkerTracker(started)
+        n_lost = 0
+
+        pool = Pool(self.n_workers, initializer=init_scheduled_worker, initargs=(started, initializer, initargs))
+
+        try:
+            while n_running or self.has_pending(pending):
+                # Fill free workers with the highest priority task whose site is under its limit.
+                while n_running < self.n_workers:
+                    task = self.pop_runnable(pending, running)
+                    if task is None:
+                        break
+
+                    running[task.site] = running.get(task.site, 0) + 1
+                    n_running += 1
+                    task.start_time = time.time()
+                    key = next(keys)
+                    in_flight[key] = task, pool.apply_async(
+                        start_task, (func, key, task.args),
+                        callback=lambda result, key=key: done.put((key, result, None)),
+                        error_callback=lambda error, key=key: done.put((key, None, error)))
+
+                if not n_running:
+                    time.sleep(self.poll_interval)  # ex) the rest of the tasks are leased by other nodes
+                    continue
+
+                # Pool never finishes a task whose worker was killed (ex. by the OOM killer), so wait in steps
+                # and fail the tasks of workers that are gone instead of blocking forever.
+                try:
+                    key, result, error = done.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    n_lost += tracker.fail_lost_tasks(in_flight, done)
+                    continue
+                tracker.read(in_flight)
+                if key not in in_flight:
+                    continue  # already failed as lost
+                task = in_flight.pop(key)[0]
+                tracker.finish(key)
+                running[task.site] -= 1
+                n_running -= 1
+                task.elapsed = time.time() - task.start_time
+                self.finish(task, result, error)
+
+                yield task, result, error
+
+        except BaseException:
+            pool.terminate()
+            pool.join()
+            raise
+
+        if n_lost:
+            # join() would wait for the results of the lost tasks forever. Terminate as on errors.
+            pool.terminate()
+            pool.join()
+            return
+
+        # Let workers exit normally, so they quit their chrome drivers.
+        pool.close()
+        pool.join()
+
+    def prepare(self, tasks):
+        # Stable order: equal priorities keep the given order.
+        return sorted(tasks, key=lambda task: task.priority)
+
+    def has_pending(self, pending):
+        return len(pending) > 0
+
+    def pop_runnable(self, pending, running):
+        for i, task in enumerate(pending):
+            if running.get(task.site, 0) < self.get_limit(task.site):
+                return pending.pop(i)
+        return None
+
+    def finish(self, task, result, error):
+        pass
+
+
+class QueueScheduler(SiteScheduler):
+    def __init__(self, task_queue, n_workers, site_limits=None, lease_seconds=300, round_name='crawl'):
+        """
+        SiteScheduler taking its tasks from a TaskQueue shared with other nodes instead of a list.
+        Leases of running tasks are renewed every lease_seconds / 3 until they finish.
+        Runs until no task of the queue is pending or leased by any node.
+        :param task_queue: ex) SqliteTaskQueue('/mnt/shared/tasks.db')
+        :param lease_seconds: A task of a node that stops renewing for this long is leased by another node.
+        :param round_name: Tasks put in the same round run once over all nodes.
+        """
+        super().__init__(n_workers, site_limits)
+        self.task_queue = task_queue
+        self.lease_seconds = lease_seconds
+        self.round_name = round_name
+        self.worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.leased = {}  # task id -> ScheduledTask
+        self.leased_lock = threading.Lock()
+
+    def run(self, tasks, func, initializer=None, initargs=()):
+        stop = threading.Event()
+        renewer = threading.Thread(target=self.renew_leases, args=(stop,), daemon=True)
+        renewer.start()
+        try:
+            yield from super().run(tasks, func, initializer, initargs)
+        finally:
+            stop.set()
+            renewer.join()
+
+    def renew_leases(self, stop):
+        while not stop.wait(self.lease_seconds / 3):
+            with self.leased_lock:
+                task_ids = list(self.leased)
+            if not task_ids:
+                continue
+            try:
+                held = self.task_queue.renew(task_ids, self.worker, self.lease_seconds)
+            except Exception as e:
+                logger.warning('Renewing task leases failed - {}'.format(e))
+                continue
+            for task_id in set(task_ids) - set(held):
+                logger.warning('Lost the lease of task {} to another node'.format(task_id))
+
+    def prepare(self, tasks):
+        self.task_queue.put(tasks, self.round_name)
+        return []
+
+    def has_pending(self, pending):
+        return self.task_queue.unfinished() > 0
+
+    def pop_runnable(self, pending, running):
+        full = [site for site, n in running.items() if n >= self.get_limit(site)]
+        leased = self.task_queue.lease(self.worker, self.lease_seconds, exclude_sites=full)
+        if leased is None:
+            return None
+
+        task_id, args, site, priority = leased
+        task = ScheduledTask(args, site, priority)
+        task.task_id = task_id
+        with self.leased_lock:
+            self.leased[task_id] = task
+        return task
+
+    def finish(self, task, result, error):
+        with self.leased_lock:
+            del self.leased[task.task_id]
+
+        # AutoCrawler results carry their status. Other workers fail by raising.
+        if error is None and isinstance(result, dict) and result.get('status', 'done') != 'done':
+            error = result.get('error', result['status'])
+
+        if error is None:
+            self.task_queue.complete(task.task_id, self.worker, result.get('count') if isinstance(result, dict) else None)
+        else:
+            self.task_queue.fail(task.task_id, self.worker, error)
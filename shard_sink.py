@@ -0,0 +1,279 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import glob
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+from multiprocessing import util
+from image_stream import ImageSniffer, check_complete, MAX_HEADER_BYTES
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+END_OF_ARCHIVE = b'\0' * (2 * BLOCK_SIZE)
+
+
+def tar_header(name, size):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8')
+
+
+def padding(size):
+    return b'\0' * (-size % BLOCK_SIZE)
+
+
+def index_path(shard_path):
+    return shard_path + '.idx'
+
+
+def read_index(shard_path):
+    """
+    :return: Index entries of every complete sample in the shard. ex) {'key', 'name', 'offset', 'size', 'end', ...}
+    """
+    entries = []
+    if not os.path.exists(index_path(shard_path)):
+        return entries
+
+    with open(index_path(shard_path), 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break  # partially written line of a crashed run
+    return entries
+
+
+def read_indexes(shard_dir):
+    """
+    Reads the indexes of every shard in shard_dir. An image downloaded again (ex. a rerun without --resume)
+    is appended again under the same key, and only its last entry counts.
+    :return: {key: (shard path, index entry)}
+    """
+    latest = {}
+    # Shard names start with the time their writer started. Entries of older runs have no time.
+    for shard_path in sorted(glob.glob(os.path.join(shard_dir, '*.tar'))):
+        for entry in read_index(shard_path):
+            key = entry['key']
+            if key not in latest or entry.get('time', 0) >= latest[key][1].get('time', 0):
+                latest[key] = shard_path, entry
+    return latest
+
+
+def read_sample(shard_path, entry):
+    """
+    Reads one image by its index entry, without scanning the shard.
+    :return: (image bytes, metadata dict)
+    """
+    with open(shard_path, 'rb') as f:
+        f.seek(entry['offset'])
+        data = f.read(entry['size'])
+        f.seek(entry['meta_offset'])
+        meta = json.loads(f.read(entry['meta_size']).decode('utf-8'))
+    return data, meta
+
+
+def repair_shard(shard_path):
+    """
+    Cuts a shard back to its last indexed sample and terminates the archive.
+    Anything a crashed writer appended after that is discarded; resume downloads it again.
+    """
+    entries = read_index(shard_path)
+    end = entries[-1]['end'] if entries else 0
+    size = os.path.getsize(shard_path)
+
+    if size == end + len(END_OF_ARCHIVE):
+        return  # closed cleanly
+
+    logger.warning('Repairing shard {} ({} samples)'.format(shard_path, len(entries)))
+    if not entries:
+        os.remove(shard_path)
+        if os.path.exists(index_path(shard_path)):
+            os.remove(index_path(shard_path))
+        return
+
+    with open(shard_path, 'r+b') as f:
+        f.truncate(end)
+        f.seek(end)
+        f.write(END_OF_ARCHIVE)
+
+    # Drop a partially written index line.
+    with open(index_path(shard_path), 'w', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+def repair_shards(shard_dir):
+    """
+    Repairs shards left open by crashed runs. Call before any writer of this run starts.
+    """
+    for shard_path in sorted(glob.glob(os.path.join(shard_dir, '*.tar'))):
+        repair_shard(shard_path)
+
+
+class ShardSink:
+    def __init__(self, shard_dir, shard_size=1024 * 1024 * 1024):
+        """
+        Appends images and their JSON metadata to rolling tar shards, WebDataset style:
+        <key>.<ext> and <key>.json members, ex) cat/google/0000.jpg and cat/google/0000.json
+        Every shard has an index (<shard>.idx, one JSON line per sample) with byte offsets for random access.
+        An index line is written only after its sample is flushed, so the index never points at partial data.
+        Each process writes its own shards, named after the time it started and its pid.
+        :param shard_size: Start a new shard once the current one would exceed this many bytes.
+        """
+        self.shard_dir = shard_dir
+        self.shard_size = shard_size
+        self.prefix = 'shard-{}-{}'.format(time.strftime('%Y%m%d%H%M%S'), os.getpid())
+        self.seq = -1
+        self.file = None
+        self.index_file = None
+        self.shard_path = None
+        self.lock = threading.Lock()
+
+        os.makedirs(shard_dir, exist_ok=True)
+
+    def roll(self):
+        self.close_shard()
+        self.seq += 1
+        self.shard_path = os.path.join(self.shard_dir, '{}-{:06d}.tar'.format(self.prefix, self.seq))
+        self.file = open(self.shard_path, 'wb')
+        self.index_file = open(index_path(self.shard_path), 'w', encoding='utf-8')
+
+    def append(self, key, ext, data_file, size, meta):
+        """
+        :param data_file: File object positioned at the start of the image
+        :param size: Image size in bytes
+        :return: (shard path, index entry)
+        """
+        name = '{}.{}'.format(key, ext)
+        meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+        data_header = tar_header(name, size)
+        meta_header = tar_header(key + '.json', len(meta_bytes))
+        sample_size = len(data_header) + size + len(padding(size)) + len(meta_header) + len(meta_bytes) + \
+            len(padding(len(meta_bytes)))
+
+        with self.lock:
+            if self.file is None or (self.file.tell() and self.file.tell() + sample_size > self.shard_size):
+                self.roll()
+
+            start = self.file.tell()
+            self.file.write(data_header)
+            offset = self.file.tell()
+            shutil.copyfileobj(data_file, self.file)
+            self.file.write(padding(size))
+            self.file.write(meta_header)
+            meta_offset = self.file.tell()
+            self.file.write(meta_bytes)
+            self.file.write(padding(len(meta_bytes)))
+            self.file.flush()
+
+            entry = {'key': key, 'name': name, 'format': ext, 'start': start, 'offset': offset, 'size': size,
+                     'meta_offset': meta_offset, 'meta_size': len(meta_bytes), 'end': self.file.tell(),
+                     'time': time.time()}
+            self.index_file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self.index_file.flush()
+
+            return self.shard_path, entry
+
+    def open(self, key, expected_size=None, meta=None, max_header_bytes=MAX_HEADER_BYTES):
+        """
+        :return: Incremental writer with the same interface as image_stream.ImageFileWriter
+        """
+        return ShardImageWriter(self, key, expected_size, meta, max_header_bytes)
+
+    def close_shard(self):
+        if self.file is not None:
+            self.file.write(END_OF_ARCHIVE)
+            self.file.close()
+            self.index_file.close()
+            self.file = None
+            self.index_file = None
+
+    def close(self):
+        with self.lock:
+            self.close_shard()
+
+
+class ShardImageWriter:
+    def __init__(self, sink, key, expected_size=None, meta=None, max_header_bytes=MAX_HEADER_BYTES):
+        """
+        Buffers one image (in memory, spilling to a temp file when large) while sniffing it,
+        then appends it to the sink in one piece, so concurrent downloads never interleave in a shard.
+        :param meta: Extra metadata stored in <key>.json. ex) {'url', 'keyword', 'site'}
+        """
+        self.sink = sink
+        self.key = key
+        self.expected_size = expected_size
+        self.meta = meta if meta else {}
+        self.sniffer = ImageSniffer(max_header_bytes)
+        self.spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+
+    def write(self, chunk):
+        """
+        :raises InvalidImageError: Not an image. Stop reading the body.
+        """
+        self.sniffer.feed(chunk)
+        self.spool.write(chunk)
+
+    def commit(self):
+        """
+        :return: ('<shard path>#<member name>', sniffer)
+        """
+        check_complete(self.sniffer, self.expected_size)
+        meta = dict(self.meta, format=self.sniffer.ext, size=list(self.sniffer.size), bytes=self.sniffer.length)
+
+        self.spool.seek(0)
+        try:
+            shard_path, entry = self.sink.append(self.key, self.sniffer.ext, self.spool, self.sniffer.length, meta)
+        finally:
+            self.spool.close()
+        return '{}#{}'.format(shard_path, entry['name']), self.sniffer
+
+    def abort(self):
+        self.spool.close()
+
+
+_shard_sinks = {}
+_shard_sinks_pid = None
+_shard_sinks_lock = threading.Lock()
+
+
+def get_shard_sink(shard_dir, shard_size=1024 * 1024 * 1024):
+    """
+    Returns the ShardSink shared by every download in this process for shard_dir.
+    Its last shard is terminated when the process exits.
+    """
+    global _shard_sinks, _shard_sinks_pid
+
+    with _shard_sinks_lock:
+        if _shard_sinks_pid != os.getpid():
+            _shard_sinks = {}
+            _shard_sinks_pid = os.getpid()
+
+        if shard_dir not in _shard_sinks:
+            sink = ShardSink(shard_dir, shard_size)
+            util.Finalize(None, sink.close, exitpriority=10)
+            _shard_sinks[shard_dir] = sink
+
+        return _shard_sinks[shard_dir]
@@ -0,0 +1,131 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import json
+import os
+import threading
+import time
+
+
+class TaskManifest:
+    def __init__(self, path):
+        """
+        Append-only JSON lines checkpoint of one (keyword, site) task.
+        Records every collected link, whether collection finished, and the download result of each link,
+        so an interrupted task can resume without collecting or downloading again.
+        :param path: ex) download/<keyword>/<site>_manifest.jsonl
+        """
+        self.path = path
+        self.links = []  # index -> url
+        self.index = {}  # url -> index
+        self.status = {}  # index -> last status record
+        self.collected_time = None
+
+        self.lock = threading.Lock()
+        self.load()
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # partially written line of a crashed run
+
+                if record['type'] == 'link':
+                    self.index[record['url']] = len(self.links)
+                    self.links.append(record['url'])
+                elif record['type'] == 'collected':
+                    self.collected_time = record['time']
+                elif record['type'] == 'status':
+                    self.status[record['index']] = record
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def add_link(self, link):
+        """
+        :return: Index of the link. Same link always gets the same index (and file number).
+        """
+        with self.lock:
+            index = self.index.get(link)
+            if index is None:
+                index = len(self.links)
+                self.index[link] = index
+                self.links.append(link)
+                self.write({'type': 'link', 'url': link})
+            return index
+
+    def record(self, link_iter):
+        """
+        Wraps a link generator. Records links as they are collected and marks collection finished at the end.
+        """
+        try:
+            for link in link_iter:
+                self.add_link(link)
+                yield link
+            self.mark_collected()
+        finally:
+            close = getattr(link_iter, 'close', None)
+            if close is not None:
+                close()
+
+    def mark_collected(self):
+        with self.lock:
+            self.collected_time = time.time()
+            self.write({'type': 'collected', 'time': self.collected_time, 'count': len(self.links)})
+
+    def is_fresh(self, max_age=None):
+        """
+        :param max_age: Seconds. None: never expires.
+        :return: True if collection finished within max_age. Collection can be skipped.
+        """
+        if self.collected_time is None:
+            return False
+        return max_age is None or time.time() - self.collected_time <= max_age
+
+    def is_done(self, index):
+        record = self.status.get(index)
+        return record is not None and record['status'] == 'done'
+
+    def done_count(self):
+        return sum(1 for record in self.status.values() if record['status'] == 'done')
+
+    def done_records(self):
+        """
+        :return: Status records of the links downloaded. {'index', 'bytes', 'path', ...}
+        """
+        return [record for record in self.status.values() if record['status'] == 'done']
+
+    def set_done(self, index, length, path):
+        self.set_status({'type': 'status', 'index': index, 'status': 'done', 'bytes': length, 'path': path})
+
+    def set_failed(self, index):
+        self.set_status({'type': 'status', 'index': index, 'status': 'failed'})
+
+    def set_status(self, record):
+        with self.lock:
+            self.status[record['index']] = record
+            self.write(record)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
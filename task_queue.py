@@ -0,0 +1,186 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class TaskQueue:
+    """
+    Tasks shared by crawler nodes. A node leases a task, renews the lease while running it
+    and completes or fails it. A lease that is not renewed expires and the task is leased again.
+    Subclass for other backends.
+    """
+
+    def put(self, tasks, round_name='crawl'):
+        """
+        Adds tasks, ignoring ones already added in the same round. Every node can put the same keyword list.
+        A round none of whose tasks is pending or leased is over: putting it again starts it over,
+        so the next run crawls its tasks again.
+        :param tasks: [ScheduledTask, ...]
+        :param round_name: ex) 'requeue' - a task done in an earlier round runs once more
+        """
+        raise NotImplementedError
+
+    def lease(self, worker, lease_seconds, exclude_sites=()):
+        """
+        :param exclude_sites: Sites at their concurrency limit on this node.
+        :return: (task_id, args, site, priority) of the highest priority free task, or None
+        """
+        raise NotImplementedError
+
+    def renew(self, task_ids, worker, lease_seconds):
+        """
+        :return: Ids of the tasks whose lease worker still holds
+        """
+        raise NotImplementedError
+
+    def complete(self, task_id, worker, count=None):
+        raise NotImplementedError
+
+    def fail(self, task_id, worker, error):
+        """
+        Returns the task to the queue, or marks it failed after max_attempts.
+        """
+        raise NotImplementedError
+
+    def counts(self):
+        """
+        :return: {'pending': n, 'leased': n, 'done': n, 'failed': n}
+        """
+        raise NotImplementedError
+
+    def unfinished(self):
+        counts = self.counts()
+        return counts.get('pending', 0) + counts.get('leased', 0)
+
+
+class SqliteTaskQueue(TaskQueue):
+    def __init__(self, path, max_attempts=3):
+        """
+        TaskQueue in a SQLite database. Every node opens the same file, ex) on a shared volume.
+        Leases are wall-clock times, so node clocks should be synchronized (NTP).
+        :param path: ex) /mnt/shared/autocrawler_tasks.db
+        :param max_attempts: Leases per task before it is marked failed. A lease ends with fail() or expiry.
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+
+        # Autocommit mode, transactions are explicit BEGIN IMMEDIATE below.
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        with self.transaction() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY,
+                key TEXT NOT NULL UNIQUE,
+                args TEXT NOT NULL,
+                site TEXT NOT NULL,
+                priority REAL NOT NULL DEFAULT 0,
+                state TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                count INTEGER,
+                error TEXT,
+                updated REAL)""")
+            db.execute('CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, priority, id)')
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two nodes never lease the same task.
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.db
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+
+    @staticmethod
+    def round_prefix(round_name):
+        # Keys are JSON lists starting with the round name. ex) ["crawl", "cat", 0, ...]
+        return json.dumps([round_name])[:-1] + ', '
+
+    def put(self, tasks, round_name='crawl'):
+        now = time.time()
+        rows = [(json.dumps([round_name] + list(task.args)), json.dumps(list(task.args)), task.site, task.priority, now)
+                for task in tasks]
+        prefix = self.round_prefix(round_name)
+        with self.transaction() as db:
+            unfinished = db.execute("SELECT COUNT(*) FROM tasks WHERE substr(key, 1, ?) = ? "
+                                    "AND state IN ('pending', 'leased')", (len(prefix), prefix)).fetchone()[0]
+            if not unfinished:
+                db.execute('DELETE FROM tasks WHERE substr(key, 1, ?) = ?', (len(prefix), prefix))
+            db.executemany('INSERT OR IGNORE INTO tasks (key, args, site, priority, updated) VALUES (?, ?, ?, ?, ?)',
+                           rows)
+
+    def lease(self, worker, lease_seconds, exclude_sites=()):
+        now = time.time()
+        exclude_sites = list(exclude_sites)
+
+        with self.transaction() as db:
+            db.execute("UPDATE tasks SET state = 'failed', error = 'Lease expired', updated = ? "
+                       "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?", (now, now, self.max_attempts))
+
+            row = db.execute("SELECT id, args, site, priority FROM tasks "
+                             "WHERE (state = 'pending' OR (state = 'leased' AND lease_until < ?)) "
+                             "AND site NOT IN ({}) ORDER BY priority, id LIMIT 1"
+                             .format(', '.join('?' * len(exclude_sites))), [now] + exclude_sites).fetchone()
+            if row is None:
+                return None
+
+            task_id, args, site, priority = row
+            db.execute("UPDATE tasks SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                       "updated = ? WHERE id = ?", (worker, now + lease_seconds, now, task_id))
+
+        return task_id, json.loads(args), site, priority
+
+    def renew(self, task_ids, worker, lease_seconds):
+        now = time.time()
+        held = []
+        with self.transaction() as db:
+            for task_id in task_ids:
+                cursor = db.execute("UPDATE tasks SET lease_until = ?, updated = ? "
+                                    "WHERE id = ? AND worker = ? AND state = 'leased'",
+                                    (now + lease_seconds, now, task_id, worker))
+                if cursor.rowcount:
+                    held.append(task_id)
+        return held
+
+    def complete(self, task_id, worker, count=None):
+        # Done even if the lease expired and another node took it, the images are saved.
+        with self.transaction() as db:
+            db.execute("UPDATE tasks SET state = 'done', worker = ?, count = ?, error = NULL, updated = ? WHERE id = ?",
+                       (worker, count, time.time(), task_id))
+
+    def fail(self, task_id, worker, error):
+        with self.transaction() as db:
+            db.execute("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                       "error = ?, updated = ? WHERE id = ? AND state = 'leased' AND worker = ?",
+                       (self.max_attempts, str(error), time.time(), task_id, worker))
+
+    def counts(self):
+        with self.lock:
+            rows = self.db.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,36 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_server import BenchServer  # noqa: E402
+
+
+@pytest.fixture
+def bench():
+    server = BenchServer(page_size=20, max_results=100, image_size=32 * 1024).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # AutoCrawler creates its download folder relative to the working directory.
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
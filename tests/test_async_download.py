@@ -0,0 +1,81 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import asyncio
+import os
+import pytest
+from async_download import AsyncDownloader
+from main import AutoCrawler
+from retry import RetryPolicy
+
+
+def make_crawler(max_attempts=4):
+    return AutoCrawler(n_threads=1, metrics_interval=0, download_engine='async', max_attempts=max_attempts)
+
+
+def download(bench, max_attempts=4, count=5):
+    links = [bench.image_url('flickr', 'kw', i) for i in range(count)]
+    return make_crawler(max_attempts).download_images('kw', links, 'flickr')
+
+
+def saved_files():
+    return sorted(os.listdir('download/kw/flickr'))
+
+
+@pytest.fixture
+def retries(monkeypatch):
+    # Attempts of every retry, without waiting between them.
+    attempts = []
+    monkeypatch.setattr(RetryPolicy, 'get_delay', lambda self, attempt: attempts.append(attempt) or 0)
+    return attempts
+
+
+def test_images_are_saved(bench, workdir):
+    assert download(bench) == 5
+    assert saved_files() == ['0000.jpg', '0001.jpg', '0002.jpg', '0003.jpg', '0004.jpg']
+    with open('download/kw/flickr/0003.jpg', 'rb') as f:
+        assert f.read() == bench.image('flickr', 'kw', '3')
+
+
+def test_server_errors_are_retried(bench, workdir, retries):
+    bench.error_rate = 0.5
+    assert download(bench, max_attempts=20) == 5
+    assert retries
+    assert len(saved_files()) == 5
+
+
+def test_truncated_bodies_are_retried(bench, workdir, retries):
+    bench.truncate_rate = 0.5
+    assert download(bench, max_attempts=20) == 5
+    assert retries
+    assert len(saved_files()) == 5
+
+
+def test_truncated_bodies_leave_nothing_behind(bench, workdir, retries):
+    bench.truncate_rate = 1.0
+    assert download(bench, max_attempts=2) == 0
+    assert saved_files() == []
+
+
+def test_cancelled_downloads_leave_nothing_behind(bench, workdir):
+    bench.throttle = 16 * 1024  # 2 seconds per image
+    crawler = make_crawler()
+    downloader = AsyncDownloader(crawler)
+    links = [bench.image_url('flickr', 'kw', i) for i in range(3)]
+    os.makedirs('download/kw/flickr')
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(downloader.run('kw', links, 'flickr', 0, None, None), 0.5))
+    assert saved_files() == []
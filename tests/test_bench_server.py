@@ -0,0 +1,44 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import time
+import requests
+from bench_server import BenchServer
+
+
+def test_detail_view_of_each_result(bench):
+    response = requests.get(bench.url + '/google/detail', params={'keyword': 'kw', 'index': 3})
+    assert response.status_code == 200
+    assert 'class="n3VNCb" src="{}"'.format(bench.full_image_url('google', 'kw', 3)) in response.text
+    assert 'data-ri="3"' in requests.get(bench.url + '/google/search', params={'q': 'kw'}).text
+
+    response = requests.get(bench.url + '/naver/detail', params={'keyword': 'kw', 'index': 100})
+    assert response.status_code == 404
+
+    response = requests.get(bench.full_image_url('naver', 'kw', 3))
+    assert response.content == bench.image('naver', 'kw', '3')
+
+
+def test_requests_past_the_rate_limit_get_429():
+    bench = BenchServer(rate_limit=5).start()
+    try:
+        statuses = [requests.get(bench.image_url('flickr', 'kw', i)).status_code for i in range(10)]
+        assert statuses[:5] == [200] * 5
+        assert 429 in statuses[5:]
+
+        time.sleep(0.5)
+        assert requests.get(bench.image_url('flickr', 'kw', 0)).status_code == 200
+    finally:
+        bench.stop()
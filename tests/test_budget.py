@@ -0,0 +1,74 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import time
+from budget import CrawlBudget
+from main import AutoCrawler, Sites
+
+
+def test_link_target_follows_failure_rate():
+    budget = CrawlBudget(max_images=100, overcollect=1.25)
+    assert budget.link_target() == 125
+
+    for _ in range(50):
+        budget.record(True, 1000)
+    for _ in range(50):
+        budget.record(False)
+    assert 180 <= budget.link_target() <= 200
+
+    for _ in range(1000):
+        budget.record(False)
+    assert budget.link_target() == 100 * 5  # max_overcollect
+
+
+def test_skipped_links_raise_link_target():
+    budget = CrawlBudget(max_images=10, overcollect=1)
+    for _ in range(30):
+        budget.skip()
+    assert budget.link_target() == 40
+    assert budget.wants_links(39)
+    assert not budget.wants_links(40)
+
+
+def test_exhausted():
+    assert CrawlBudget().exhausted() is None
+    assert CrawlBudget(max_seconds=0.01).exhausted() is None
+    budget = CrawlBudget(max_seconds=0.01)
+    time.sleep(0.02)
+    assert budget.exhausted() == 'time'
+
+    budget = CrawlBudget(max_bytes=1000)
+    budget.record(True, 600)
+    assert budget.exhausted() is None
+    assert budget.image_target() == 2
+    budget.record(True, 600)
+    assert budget.exhausted() == 'bytes'
+
+    budget = CrawlBudget(max_images=2, done=1)
+    assert budget.wants_downloads(0) and not budget.wants_downloads(1)
+    budget.record(True, 10)
+    assert budget.exhausted() == 'count'
+
+
+def test_recrawl_with_url_index_reaches_limit(bench, workdir):
+    def crawl():
+        crawler = AutoCrawler(limit=20, url_index=True, resume=False, http_collectors=['flickr'], base_urls=bench.base_urls)
+        return crawler.download_from_site('kw', Sites.FLICKR)
+
+    # Every crawl finds the results saved before in the url index. The collector has to look past them.
+    for _ in range(4):
+        result = crawl()
+        assert result['status'] == 'done'
+        assert result['count'] == 20
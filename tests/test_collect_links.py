@@ -0,0 +1,79 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from collect_links import CollectLinks
+
+
+class FakeBrowser:
+    """
+    Answers SCRAPE_ATTRIBUTES_JS from a list of {attribute: value} per xpath element, which tests change between passes.
+    """
+    def __init__(self, elements):
+        self.elements = elements
+
+    def execute_script(self, script, xpath, child_xpath, attributes, start):
+        items = []
+        for i, element in enumerate(self.elements[start:], start):
+            item = {'_index': i}
+            item.update((attribute, element.get(attribute)) for attribute in attributes)
+            items.append(item)
+        return {'count': len(self.elements), 'items': items}
+
+
+class FakeCollectLinks(CollectLinks):
+    def open_browser(self):
+        self.browser = FakeBrowser([])
+
+
+def test_placeholders_are_scraped_again_once_loaded():
+    collector = FakeCollectLinks()
+    collector.browser.elements = [{'src': 'http://a/1.jpg'}, {'src': 'data:image/gif;base64,R0lGOD'},
+                                  {'src': 'http://a/3.jpg'}]
+
+    def batches():
+        yield 3
+        collector.browser.elements[1]['src'] = 'http://a/2.jpg'
+        collector.browser.elements.append({'src': 'http://a/4.jpg'})
+        yield 4
+
+    seen = set()
+    links = []
+    for batch in collector.scraped_batches(batches(), '//img', ['src'], collector.scrape_naver):
+        links += collector.new_links(seen, batch)
+    assert links == ['http://a/1.jpg', 'http://a/3.jpg', 'http://a/2.jpg', 'http://a/4.jpg']
+
+
+def test_google_boxes_without_a_link_yet_are_not_none():
+    collector = FakeCollectLinks()
+    collector.browser.elements = [{'src': 'data:image/jpeg;base64,/9j/', 'data-iurl': None},
+                                  {'src': 'http://a/2.jpg', 'data-iurl': None}]
+
+    start, links = collector.scrape_links('//div', ['src', 'data-iurl'], collector.scrape_google)
+    assert (start, links) == (0, ['http://a/2.jpg'])
+
+    collector.browser.elements[0]['data-iurl'] = 'http://a/1.jpg'
+    start, links = collector.scrape_links('//div', ['src', 'data-iurl'], collector.scrape_google, start=start)
+    assert (start, links) == (2, ['http://a/1.jpg', 'http://a/2.jpg'])
+
+
+def test_last_pass_reads_placeholders_loaded_after_scrolling():
+    collector = FakeCollectLinks()
+    collector.browser.elements = [{'src': 'data:image/gif;base64,R0lGOD'}]
+
+    def batches():
+        yield 1
+        collector.browser.elements[0]['src'] = 'http://a/1.jpg'
+
+    assert list(collector.scraped_batches(batches(), '//img', ['src'], collector.scrape_naver)) == [[], ['http://a/1.jpg']]
@@ -0,0 +1,59 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import os
+import pytest
+from PIL import Image
+from content_store import ContentStore, DuplicateImageError, SpoolFile
+from image_stream import write_image
+
+
+def jpeg_bytes(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def test_same_image_is_a_duplicate_in_the_same_folder(tmp_path):
+    store = ContentStore(str(tmp_path))
+    os.makedirs(str(tmp_path / 'kw' / 'google'))
+    image = jpeg_bytes('red')
+    path, _ = write_image(store.open(str(tmp_path / 'kw' / 'google' / '0000')), [image])
+    assert path == str(tmp_path / 'kw' / 'google' / '0000.jpg')
+
+    with pytest.raises(DuplicateImageError):
+        write_image(store.open(str(tmp_path / 'kw' / 'google' / '0001')), [image])
+    assert os.listdir(store.tmp_dir) == []
+
+
+def test_failed_commit_is_not_a_duplicate_on_retry(tmp_path, monkeypatch):
+    store = ContentStore(str(tmp_path))
+    os.makedirs(str(tmp_path / 'kw' / 'google'))
+    image = jpeg_bytes('blue')
+    commit = SpoolFile.commit
+
+    def full_disk(spool, path):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(SpoolFile, 'commit', full_disk)
+    with pytest.raises(OSError):
+        write_image(store.open(str(tmp_path / 'kw' / 'google' / '0000')), [image])
+
+    monkeypatch.setattr(SpoolFile, 'commit', commit)
+    path, sniffer = write_image(store.open(str(tmp_path / 'kw' / 'google' / '0000')), [image])
+    assert sniffer.ext == 'jpg'
+    with open(path, 'rb') as f:
+        assert f.read() == image
@@ -0,0 +1,59 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import json
+import os
+from dataset_stats import StatsIndex
+from main import AutoCrawler, Sites
+
+
+def make_images(folder, n):
+    os.makedirs(folder, exist_ok=True)
+    for i in range(n):
+        with open(os.path.join(folder, '{}.jpg'.format(str(i).zfill(4))), 'wb') as f:
+            f.write(b'\xff\xd8' + b'\0' * 100)
+
+
+def test_old_download_folder_gets_a_stats_index(workdir):
+    make_images('download/many/google', 10)
+    make_images('download/few/google', 1)
+    with open('keywords.txt', 'w') as f:
+        f.write('many\nfew\n')
+
+    crawler = AutoCrawler(do_google=False, do_naver=False, do_unsplash=False, do_flickr=False,
+                          imbalance_policy='prune', metrics_interval=0)
+    crawler.do_crawling()
+
+    index = StatsIndex('download/_stats.json')
+    assert index.exists()
+    # Judged against the keywords on disk, not only this run's (none): 'few' is under-filled and pruned.
+    assert index.keyword_counts() == {'many': 10}
+    assert not os.path.exists('download/few')
+
+
+def test_resume_counts_images_of_a_killed_run(bench, workdir):
+    def crawl():
+        crawler = AutoCrawler(limit=5, http_collectors=['flickr'], base_urls=bench.base_urls)
+        return crawler.download_from_site('kw', Sites.FLICKR)
+
+    assert crawl()['stats']['count'] == 5
+    # Killed before the stats file was saved: only the manifest is left.
+    os.remove('download/kw/flickr_stats.json')
+
+    result = crawl()
+    assert result['count'] == 5
+    assert result['stats']['count'] == 5
+    with open('download/kw/flickr_stats.json') as f:
+        assert sorted(json.load(f)['files']) == ['000{}.jpg'.format(i) for i in range(5)]
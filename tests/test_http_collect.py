@@ -0,0 +1,56 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import os
+from http_collect import HttpCollectLinks
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def test_parse_unsplash_skips_premium_results():
+    links, pages = HttpCollectLinks.parse_unsplash(read_fixture('unsplash_search_photos.json'), 'small')
+    assert pages == 334
+    assert len(links) == 2
+    assert all(link.startswith('https://images.unsplash.com/photo-') and link.endswith('&w=400') for link in links)
+
+    links, _ = HttpCollectLinks.parse_unsplash(read_fixture('unsplash_search_photos.json'), 'full')
+    assert links[0].endswith('&q=85')
+
+
+def test_parse_flickr_reads_only_the_result_grid():
+    links, pages = HttpCollectLinks.parse_flickr(read_fixture('flickr_search.html'))
+    assert pages is None
+    assert links == ['https://live.staticflickr.com/65535/53045178736_0c9f4e6f23_n.jpg',
+                     'https://live.staticflickr.com/65535/52971812350_a7d41c28b9_n.jpg',
+                     'https://live.staticflickr.com/7292/27012358724_1d5b8c0a2e_m.jpg']
+
+    links, _ = HttpCollectLinks.parse_flickr(read_fixture('flickr_search.html'), full=True)
+    assert links == ['https://live.staticflickr.com/65535/53045178736_0c9f4e6f23_b.jpg',
+                     'https://live.staticflickr.com/65535/52971812350_a7d41c28b9_b.jpg',
+                     'https://live.staticflickr.com/7292/27012358724_1d5b8c0a2e_b.jpg']
+
+
+def test_collector_runs_the_base_init():
+    collector = HttpCollectLinks(budget='budget')
+    assert collector.browser is None
+    assert collector.driver_pool is None
+    assert collector.budget == 'budget'
+    assert collector.detail_workers == 1 and collector.network_capture is False
+    assert collector.base_urls['unsplash'] and collector.base_urls['flickr']
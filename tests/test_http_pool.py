@@ -0,0 +1,72 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from http_pool import SessionPool
+from retry import RetryPolicy, RetryableError, RetryError
+
+
+class CountingServer:
+    def __init__(self, status):
+        hits = self.hits = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                hits.append(self.path)
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/img'.format(self.httpd.server_address[1])
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def test_status_is_not_retried_by_the_pool():
+    server = CountingServer(503)
+    try:
+        response = SessionPool(max_retries=3).get(server.url)
+        assert response.status_code == 503
+        assert len(server.hits) == 1
+    finally:
+        server.stop()
+
+
+def test_retry_policy_is_the_only_retry_layer():
+    server = CountingServer(503)
+    pool = SessionPool(max_retries=3)
+
+    def get():
+        response = pool.get(server.url)
+        if response.status_code >= 500:
+            raise RetryableError('HTTP {}'.format(response.status_code))
+        return response
+
+    try:
+        policy = RetryPolicy(max_attempts=3, base_delay=0.01)
+        with pytest.raises(RetryError):
+            policy.call(get, url=server.url, retry_on=(RetryableError,))
+        assert len(server.hits) == 3
+    finally:
+        server.stop()
@@ -0,0 +1,85 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import os
+import pytest
+from image_stream import ImageFilter, HEADER_CHUNK_SIZE
+from main import AutoCrawler
+from metrics import get_metrics
+
+ENGINES = ['thread', 'async']
+
+
+class CountingCrawler(AutoCrawler):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writers = []
+
+    def open_output_writer(self, no_ext_path, expected_size, link):
+        writer = super().open_output_writer(no_ext_path, expected_size, link)
+        self.writers.append(writer)
+        return writer
+
+
+def rejected_counts():
+    return {counter['labels']['reason']: counter['value'] for counter in get_metrics().snapshot()['counters']
+            if counter['name'] == 'images_rejected_total' and counter['labels']['site'] == 'flickr'}
+
+
+def download(bench, engine, image_filter, count=5):
+    crawler = CountingCrawler(n_threads=1, metrics_interval=0, download_engine=engine, image_filter=image_filter)
+    links = [bench.image_url('flickr', 'kw', i) for i in range(count)]
+    before = rejected_counts()
+    saved = crawler.download_images('kw', links, 'flickr')
+    after = rejected_counts()
+    rejected = {reason: after[reason] - before.get(reason, 0) for reason in after if after[reason] != before.get(reason)}
+    return crawler, saved, rejected
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_content_length_rejects_before_the_body(bench, workdir, engine):
+    # Stand-in images are 32KB.
+    crawler, saved, rejected = download(bench, engine, ImageFilter(max_bytes=16 * 1024))
+    assert saved == 0
+    assert rejected == {'bytes': 5}
+    assert crawler.writers == []  # nothing opened
+    assert os.listdir('download/kw/flickr') == []
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('image_filter, reason', [
+    # Stand-in images are 64x48 jpegs.
+    (ImageFilter(min_width=100), 'width'),
+    (ImageFilter(max_height=32), 'height'),
+    (ImageFilter(formats=['png', 'webp']), 'format'),
+    (ImageFilter(max_aspect=1.0), 'aspect'),
+])
+def test_header_rejects_after_the_first_chunk(bench, workdir, engine, image_filter, reason):
+    crawler, saved, rejected = download(bench, engine, image_filter)
+    assert saved == 0
+    assert rejected == {reason: 5}
+    assert len(crawler.writers) == 5
+    assert all(0 < writer.sniffer.length <= HEADER_CHUNK_SIZE for writer in crawler.writers)
+    assert os.listdir('download/kw/flickr') == []
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_passing_images_are_saved_whole(bench, workdir, engine):
+    crawler, saved, rejected = download(bench, engine, ImageFilter(min_width=32, max_aspect=2.0, formats=['jpg'],
+                                                                   max_bytes=64 * 1024))
+    assert saved == 5
+    assert rejected == {}
+    assert all(writer.sniffer.length == bench.image_size for writer in crawler.writers)
+    assert sorted(os.listdir('download/kw/flickr')) == ['000{}.jpg'.format(i) for i in range(5)]
@@ -0,0 +1,78 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import struct
+import pytest
+from PIL import Image
+from image_stream import ImageSniffer, InvalidImageError, MAX_HEADER_BYTES
+
+
+def image_bytes(fmt, size=(64, 48)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'green').save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def with_metadata(jpeg, n_bytes):
+    # APP1 segments (EXIF, XMP) before the frame header, up to 64KB each.
+    segments = b''
+    while len(segments) < n_bytes:
+        payload = b'Exif\x00\x00' + b'\xff' * 65000
+        segments += b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+    return jpeg[:2] + segments + jpeg[2:]
+
+
+def sniff(data, chunk_size):
+    sniffer = ImageSniffer()
+    for i in range(0, len(data), chunk_size):
+        sniffer.feed(data[i:i + chunk_size])
+    sniffer.close()
+    return sniffer
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 8 * 1024, 1024 * 1024])
+def test_jpeg_size_in_any_chunks(chunk_size):
+    data = image_bytes('JPEG')
+    sniffer = sniff(data, chunk_size)
+    assert (sniffer.format, sniffer.ext, sniffer.size, sniffer.length) == ('jpeg', 'jpg', (64, 48), len(data))
+
+
+def test_jpeg_metadata_past_the_header_limit_is_skipped():
+    data = with_metadata(image_bytes('JPEG', (300, 200)), MAX_HEADER_BYTES + 1)
+    assert Image.open(io.BytesIO(data)).size == (300, 200)
+
+    sniffer = sniff(data, 8 * 1024)
+    assert (sniffer.format, sniffer.size, sniffer.length) == ('jpeg', (300, 200), len(data))
+    assert len(sniffer.head) == 0
+
+
+@pytest.mark.parametrize('fmt', ['PNG', 'GIF', 'WEBP', 'BMP'])
+def test_other_formats(fmt):
+    sniffer = sniff(image_bytes(fmt), 5)
+    assert (sniffer.format, sniffer.size) == (fmt.lower(), (64, 48))
+
+
+def test_unknown_format_is_rejected_at_the_header_limit():
+    sniffer = ImageSniffer(max_header_bytes=1000)
+    with pytest.raises(InvalidImageError):
+        for _ in range(1000):
+            sniffer.feed(b'<html>' * 10)
+    assert sniffer.length <= 1060
+
+
+def test_jpeg_without_frame_header_is_rejected():
+    with pytest.raises(InvalidImageError):
+        sniff(b'\xff\xd8\xff\xe0\x00\x04ab\xff\xda\x00\x02' + b'\x00' * 100, 3)
@@ -0,0 +1,46 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import json
+import os
+from dataset_stats import StatsIndex, rebuild_index
+from main import AutoCrawler
+from normalize import Normalizer
+from task_manifest import TaskManifest
+
+
+def test_normalized_images_update_stats_and_manifest(bench, workdir):
+    with open('keywords.txt', 'w') as f:
+        f.write('kw\n')
+    crawler = AutoCrawler(n_threads=1, do_google=False, do_naver=False, do_unsplash=False, limit=5,
+                          http_collectors=['flickr'], base_urls=bench.base_urls, metrics_interval=0,
+                          normalizer=Normalizer(fmt='png', keep_original=True), normalize_processes=1)
+    crawler.do_crawling()
+
+    names = ['000{}.png'.format(i) for i in range(5)]
+    assert sorted(os.listdir('download/kw/flickr')) == names
+    assert len(os.listdir('download/kw/flickr_original')) == 5
+
+    with open('download/kw/flickr_stats.json') as f:
+        assert sorted(json.load(f)['files']) == names
+    manifest = TaskManifest('download/kw/flickr_manifest.jsonl')
+    assert sorted(os.path.basename(record['path']) for record in manifest.done_records()) == names
+    manifest.close()
+    assert StatsIndex('download/_stats.json').entries['kw']['flickr']['formats'] == {'png': 5}
+
+    # Originals are not a site of their own.
+    index = rebuild_index('download', 1)
+    assert set(index.entries['kw']) == {'flickr'}
+    assert index.keyword_counts() == {'kw': 5}
@@ -0,0 +1,168 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import select
+import socket
+import struct
+import threading
+import pytest
+import proxy_manager
+from main import AutoCrawler
+from proxy_manager import ProxyManager, requests_proxy
+
+# Host names only a proxy can reach: requests made without the proxy fail to resolve them.
+REMOTE_HOST = 'images.invalid'
+
+
+def dead_proxy():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return 'http://127.0.0.1:{}'.format(port)
+
+
+def remote_url(path):
+    # Sent to the bench server as an absolute-form request when it is used as an http proxy.
+    return 'http://{}{}'.format(REMOTE_HOST, path)
+
+
+class Socks5Server:
+    def __init__(self, target):
+        """
+        Stand-in SOCKS5 proxy without authentication. Every CONNECT goes to target (host, port),
+        so host names of REMOTE_HOST resolve only through it, like socks5h.
+        """
+        self.target = target
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(16)
+        self.url = 'socks://127.0.0.1:{}'.format(self.sock.getsockname()[1])
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.handle, args=(client,), daemon=True).start()
+
+    def handle(self, client):
+        with client:
+            n_methods = client.recv(2)[1]
+            client.recv(n_methods)
+            client.sendall(b'\x05\x00')
+            _, cmd, _, atyp = client.recv(4)
+            if atyp == 3:
+                client.recv(client.recv(1)[0])
+            else:
+                client.recv(4 if atyp == 1 else 16)
+            client.recv(2)
+            with socket.create_connection(self.target) as upstream:
+                client.sendall(b'\x05\x00\x00\x01' + socket.inet_aton('127.0.0.1') + struct.pack('>H', 0))
+                sockets = [client, upstream]
+                while True:
+                    readable, _, _ = select.select(sockets, [], [], 5)
+                    if not readable:
+                        return
+                    for sock in readable:
+                        data = sock.recv(65536)
+                        if not data:
+                            return
+                        (upstream if sock is client else client).sendall(data)
+
+    def close(self):
+        self.sock.close()
+
+
+def test_requests_proxy():
+    assert requests_proxy('socks://127.0.0.1:1080') == 'socks5h://127.0.0.1:1080'
+    assert requests_proxy('socks5://user:pw@127.0.0.1:1080') == 'socks5h://user:pw@127.0.0.1:1080'
+    assert requests_proxy('socks4://127.0.0.1:1080') == 'socks4://127.0.0.1:1080'
+    assert requests_proxy('http://127.0.0.1:3128') == 'http://127.0.0.1:3128'
+    assert requests_proxy(None) is None
+
+
+def test_probe_cools_down_dead_proxy(bench):
+    alive, dead = bench.url, dead_proxy()
+    manager = ProxyManager([alive, dead])
+
+    results = manager.probe(remote_url('/img/google/probe/0.jpg'), timeout=5)
+
+    assert results[alive] is not None
+    assert results[dead] is None
+    assert {manager.choose('google') for _ in range(50)} == {alive}
+
+
+def test_failing_proxy_rotates_out():
+    bad, good = 'http://127.0.0.1:1', 'http://127.0.0.1:2'
+    manager = ProxyManager([bad, good], max_failures=3)
+    for _ in range(3):
+        manager.report(bad, 'google', False)
+
+    assert {manager.choose('google') for _ in range(50)} == {good}
+    # Cooldowns are per site.
+    assert bad in {manager.choose('naver') for _ in range(200)}
+
+
+def test_use_reports_proxy_errors_only():
+    manager = ProxyManager(['http://127.0.0.1:1'])
+    with pytest.raises(ValueError):
+        with manager.use('google', fail_on=(ValueError,)):
+            raise ValueError('Unable to determine SOCKS version')
+    with pytest.raises(KeyError):
+        with manager.use('google', fail_on=(ValueError,)):
+            raise KeyError()
+
+    stats = manager.get_stats('http://127.0.0.1:1', 'google')
+    assert (stats.successes, stats.failures) == (1, 1)
+
+
+def test_downloads_rotate_to_working_proxy(bench, workdir, monkeypatch):
+    alive, dead = bench.url, dead_proxy()
+    # First ready proxy instead of a weighted random one, so the dead one is tried until it cools down.
+    monkeypatch.setattr(proxy_manager.random, 'choices', lambda population, weights: [population[0]])
+    crawler = AutoCrawler(proxy_list=[dead, alive], download_threads=1, max_attempts=4)
+    links = [remote_url('/img/google/kw/{}.jpg'.format(i)) for i in range(10)]
+
+    assert crawler.download_images('kw', links, 'google') == 10
+
+    manager = crawler.get_proxy_manager()
+    assert manager.get_stats(dead, 'google').successes == 0
+    assert manager.get_stats(dead, 'google').cooldowns == 1
+    assert manager.get_stats(alive, 'google').successes == 10
+
+
+def test_unusable_proxy_url_counts_as_failure(bench, workdir):
+    crawler = AutoCrawler(proxy_list=['foo://127.0.0.1:1'], download_threads=1, max_attempts=2)
+
+    assert crawler.download_images('kw', [remote_url('/img/google/kw/0.jpg')], 'google') == 0
+
+    stats = crawler.get_proxy_manager().get_stats('foo://127.0.0.1:1', 'google')
+    assert (stats.successes, stats.failures) == (0, 2)
+
+
+def test_socks_proxy_downloads(bench, workdir):
+    host, port = bench.httpd.server_address[:2]
+    socks = Socks5Server((host, port))
+    try:
+        crawler = AutoCrawler(proxy_list=[socks.url], download_threads=2)
+        links = [remote_url('/img/google/kw/{}.jpg'.format(i)) for i in range(4)]
+
+        assert crawler.download_images('kw', links, 'google') == 4
+        assert crawler.get_proxy_manager().get_stats(socks.url, 'google').successes == 4
+    finally:
+        socks.close()
@@ -0,0 +1,82 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import os
+import signal
+import time
+import scheduler
+from scheduler import SiteScheduler, ScheduledTask, WorkerLostError
+
+start_task = scheduler.start_task
+
+
+def square_or_die(n):
+    if n < 0:
+        os.kill(os.getpid(), signal.SIGKILL)  # ex) the OOM killer
+    time.sleep(0.05)
+    return n * n
+
+
+def timed_square(n):
+    start = time.time()
+    time.sleep(0.1)
+    return n * n, start, time.time()
+
+
+def start_task_or_die(func, key, args):
+    if args < 0:
+        os.kill(os.getpid(), signal.SIGKILL)  # before start_task tells the pid
+    return start_task(func, key, args)
+
+
+def test_tasks_finish_per_site():
+    site_scheduler = SiteScheduler(3, {'google': 1})
+    tasks = [ScheduledTask(n, 'google' if n % 2 else 'naver') for n in range(8)]
+    results = {task.args: (result, error) for task, result, error in site_scheduler.run(tasks, timed_square)}
+    assert {n: (result[0], error) for n, (result, error) in results.items()} == {n: (n * n, None) for n in range(8)}
+
+    google = sorted(result[1:] for n, (result, _) in results.items() if n % 2)
+    assert all(end <= next_start for (_, end), (next_start, _) in zip(google, google[1:]))
+    naver = sorted(result[1:] for n, (result, _) in results.items() if n % 2 == 0)
+    assert any(next_start < end for (_, end), (next_start, _) in zip(naver, naver[1:]))
+
+
+def test_killed_worker_fails_its_task_instead_of_hanging():
+    site_scheduler = SiteScheduler(2)
+    site_scheduler.poll_interval = 0.2
+    tasks = [ScheduledTask(n, 'google') for n in [1, -1, 2, 3]]
+
+    start = time.time()
+    results = {task.args: (result, error) for task, result, error in site_scheduler.run(tasks, square_or_die)}
+    assert time.time() - start < 30
+
+    result, error = results.pop(-1)
+    assert result is None and isinstance(error, WorkerLostError)
+    assert results == {1: (1, None), 2: (4, None), 3: (9, None)}
+
+
+def test_worker_killed_before_telling_its_pid_fails_its_task(monkeypatch):
+    monkeypatch.setattr(scheduler, 'start_task', start_task_or_die)
+    site_scheduler = SiteScheduler(2)
+    site_scheduler.poll_interval = 0.2
+    tasks = [ScheduledTask(n, 'google') for n in [1, -1, 2, 3]]
+
+    start = time.time()
+    results = {task.args: (result, error) for task, result, error in site_scheduler.run(tasks, square_or_die)}
+    assert time.time() - start < 30
+
+    result, error = results.pop(-1)
+    assert result is None and isinstance(error, WorkerLostError)
+    assert results == {1: (1, None), 2: (4, None), 3: (9, None)}
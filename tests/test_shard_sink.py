@@ -0,0 +1,40 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import os
+import shard_sink
+from dataset_stats import rebuild_index
+from main import AutoCrawler
+from shard_sink import read_indexes, read_sample
+
+
+def test_downloads_again_keep_the_last_entry_of_each_key(bench, workdir, monkeypatch):
+    monkeypatch.setattr(shard_sink, '_shard_sinks', {})  # a sink per test folder
+    crawler = AutoCrawler(n_threads=1, metrics_interval=0, output_format='shards')
+
+    first = [bench.image_url('flickr', 'kw', i) for i in range(3)]
+    again = [bench.image_url('flickr', 'kw', i) for i in range(10, 13)]
+    assert crawler.download_images('kw', first, 'flickr') == 3
+    assert crawler.download_images('kw', again, 'flickr') == 3
+    assert not os.path.exists('download/kw/flickr')
+
+    latest = read_indexes('download/_shards')
+    assert sorted(latest) == ['kw/flickr/0000', 'kw/flickr/0001', 'kw/flickr/0002']
+    for i, key in enumerate(sorted(latest)):
+        data, meta = read_sample(*latest[key])
+        assert meta['url'] == again[i]
+        assert data == bench.image('flickr', 'kw', str(10 + i))
+
+    assert rebuild_index('download', n_workers=1).keyword_counts() == {'kw': 3}
@@ -0,0 +1,165 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import os
+import time
+import pytest
+import main
+from main import AutoCrawler
+from scheduler import ScheduledTask
+from task_queue import SqliteTaskQueue
+from url_index import UrlIndex
+
+
+@pytest.fixture
+def nodes(tmp_path):
+    # Two nodes with their own connection to the same database.
+    queues = [SqliteTaskQueue(str(tmp_path / 'tasks.db'), max_attempts=2) for _ in range(2)]
+    yield queues
+    for task_queue in queues:
+        task_queue.close()
+
+
+def make_tasks(*keywords, site='google'):
+    return [ScheduledTask([keyword, site], site, priority) for priority, keyword in enumerate(keywords)]
+
+
+def test_put_ignores_tasks_of_the_same_round(nodes):
+    a, b = nodes
+    a.put(make_tasks('cat', 'dog'))
+    b.put(make_tasks('cat', 'dog', 'fox'))
+    assert a.counts() == {'pending': 3}
+
+    b.put(make_tasks('cat'), round_name='requeue')
+    assert a.counts() == {'pending': 4}
+
+
+def test_nodes_never_lease_the_same_task(nodes):
+    a, b = nodes
+    a.put(make_tasks('cat', 'dog') + make_tasks('fox', site='naver'))
+
+    first = a.lease('a', 60)
+    second = b.lease('b', 60, exclude_sites=['google'])
+    assert first[1:] == (['cat', 'google'], 'google', 0)
+    assert second[1:] == (['fox', 'naver'], 'naver', 0)
+    assert b.lease('b', 60, exclude_sites=['naver'])[1] == ['dog', 'google']
+    assert a.lease('a', 60) is None
+    assert a.counts() == {'leased': 3}
+
+
+def test_expired_lease_is_taken_over(nodes):
+    a, b = nodes
+    a.put(make_tasks('cat'))
+    task_id = a.lease('a', 0.05)[0]
+    assert b.lease('b', 60) is None
+
+    time.sleep(0.1)
+    assert b.lease('b', 60)[0] == task_id
+    assert a.renew([task_id], 'a', 60) == []
+    assert b.renew([task_id], 'b', 60) == [task_id]
+
+    a.fail(task_id, 'a', 'late')  # not a's task anymore
+    assert a.counts() == {'leased': 1}
+
+
+def test_fail_requeues_until_max_attempts(nodes):
+    a, b = nodes
+    a.put(make_tasks('cat'))
+
+    task_id = a.lease('a', 60)[0]
+    a.fail(task_id, 'a', 'timeout')
+    assert a.counts() == {'pending': 1}
+
+    assert b.lease('b', 60)[0] == task_id
+    b.fail(task_id, 'b', 'timeout')
+    assert a.counts() == {'failed': 1}
+    assert a.lease('a', 60) is None
+
+
+def test_expired_last_attempt_fails(nodes):
+    a, b = nodes
+    a.put(make_tasks('cat'))
+    a.lease('a', 0.01)
+    time.sleep(0.05)
+    b.lease('b', 0.01)
+    time.sleep(0.05)
+
+    assert a.lease('a', 60) is None
+    assert a.counts() == {'failed': 1}
+
+
+def test_complete(nodes):
+    a, b = nodes
+    a.put(make_tasks('cat', 'dog'))
+    task_id = a.lease('a', 60)[0]
+    a.complete(task_id, 'a', count=20)
+
+    assert b.counts() == {'done': 1, 'pending': 1}
+    assert b.unfinished() == 1
+    row = b.db.execute('SELECT count, worker FROM tasks WHERE id = ?', (task_id,)).fetchone()
+    assert row == (20, 'a')
+
+
+def test_finished_round_starts_over(nodes):
+    a, b = nodes
+    a.put(make_tasks('cat', 'dog'))
+    task_id = a.lease('a', 60)[0]
+    a.complete(task_id, 'a')
+
+    # A node joining while the round runs doesn't restart it.
+    b.put(make_tasks('cat', 'dog'))
+    assert a.counts() == {'done': 1, 'pending': 1}
+
+    task_id = b.lease('b', 60)[0]
+    b.fail(task_id, 'b', 'error')
+    b.complete(b.lease('b', 60)[0], 'b')
+    a.put(make_tasks('fox'), round_name='requeue')
+    assert a.counts() == {'done': 2, 'pending': 1}
+
+    # The next run crawls the round again.
+    b.put(make_tasks('cat', 'dog'))
+    assert a.counts() == {'pending': 3}
+
+
+def crawl(bench, **kwargs):
+    with open('keywords.txt', 'w') as f:
+        f.write('kw\n')
+    crawler = AutoCrawler(n_threads=1, do_google=False, do_naver=False, do_unsplash=False, limit=5,
+                          http_collectors=['flickr'], base_urls=bench.base_urls, metrics_interval=0, **kwargs)
+    crawler.do_crawling()
+
+
+def test_shared_queue_leaves_url_index_log_to_runs_on_their_own(bench, workdir, monkeypatch):
+    compacted = []
+    monkeypatch.setattr(UrlIndex, 'compact', lambda self: compacted.append(self.path))
+
+    crawl(bench, url_index=True, task_queue='tasks.db')
+    assert compacted == []
+    assert len(os.listdir('download/kw/flickr')) == 5
+
+    crawl(bench, url_index=True)
+    assert compacted == [os.path.join('download', '_url_index.bin').replace(os.sep, '/')]
+
+
+def test_shared_queue_leaves_open_shards_to_runs_on_their_own(bench, workdir, monkeypatch):
+    repaired = []
+    monkeypatch.setattr(main, 'repair_shards', repaired.append)
+
+    crawl(bench, output_format='shards', task_queue='tasks.db')
+    assert repaired == []
+    assert [name for name in os.listdir('download/_shards') if name.endswith('.tar')]
+
+    crawl(bench, output_format='shards')
+    assert repaired == ['download/_shards']
@@ -0,0 +1,195 @@
+"""
+Copyright 2018 YoongiKim
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: concurrent workers may download a new url twice
+
+# Query parameters that never change the image.
+TRACKING_PARAMS = {'fbclid', 'gclid', 'dclid', 'msclkid', 'igshid', 'ref', 'ref_src', 'spm'}
+TRACKING_PREFIXES = ('utm_',)
+
+# (host suffix, size/format query parameters to drop, path rewrite)
+SITE_RULES = [
+    # https://images.unsplash.com/photo-123?ixlib=rb-1.2.1&w=400&q=80
+    ('unsplash.com', {'w', 'h', 'q', 'fm', 'fit', 'crop', 'auto', 'dpr', 'cs', 'ixlib', 'ixid'}, None),
+    # https://live.staticflickr.com/65535/123_abc_m.jpg -> 123_abc.jpg
+    ('staticflickr.com', set(), (re.compile(r'^(/.*/\d+_[0-9a-f]+)_[a-z0-9]{1,2}(\.\w+)$'), r'\1\2')),
+    # https://search.pstatic.net/common/?src=...&type=b400
+    ('pstatic.net', {'type'}, None),
+    # https://encrypted-tbn0.gstatic.com/images?q=tbn:...&usqp=CAU
+    ('gstatic.com', {'usqp'}, None),
+]
+
+
+def canonicalize_url(url):
+    """
+    Canonical form of an image url, so the same image found with different sizes, tracking parameters,
+    schemes or query orders is recognized as one. Data urls are reduced to a hash of their content.
+    """
+    url = str(url).strip()
+    if url.startswith('data:'):
+        return 'data:sha1:' + hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    parts = urlsplit(url)
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port not in (80, 443):
+        host = '{}:{}'.format(host, parts.port)
+    path = parts.path or '/'
+
+    drop = set(TRACKING_PARAMS)
+    for suffix, params, rewrite in SITE_RULES:
+        if host == suffix or host.endswith('.' + suffix):
+            drop |= params
+            if rewrite is not None:
+                path = rewrite[0].sub(rewrite[1], path)
+
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if k not in drop and not k.startswith(TRACKING_PREFIXES))
+
+    # http and https serve the same image.
+    return urlunsplit(('https', host, path, urlencode(query), ''))
+
+
+def fingerprint(url):
+    """
+    :return: 64-bit hash of the canonical url. Collisions are negligible below billions of urls.
+    """
+    digest = hashlib.blake2b(canonicalize_url(url).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class UrlIndex:
+    def __init__(self, path):
+        """
+        Urls already downloaded, in any run, task or keyword, stored as 8-byte fingerprints of their canonical form.
+        path holds a sorted array of fingerprints (binary search), path.log the ones added since the last compact().
+        Worker processes append to the log and read each other's additions from it.
+        :param path: ex) download/_url_index.bin
+        """
+        self.path = path
+        self.log_path = path + '.log'
+        self.sorted = array('Q')
+        self.recent = set()
+        self.log_offset = 0
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.sorted.frombytes(f.read())
+        self.refresh()
+
+    def refresh(self):
+        # Reads fingerprints other processes appended since the last refresh.
+        if not os.path.exists(self.log_path) or os.path.getsize(self.log_path) == self.log_offset:
+            return
+
+        with open(self.log_path, 'rb') as f:
+            f.seek(self.log_offset)
+            data = f.read()
+        data = data[:len(data) - len(data) % 8]  # an append in progress
+        self.log_offset += len(data)
+
+        recent = array('Q')
+        recent.frombytes(data)
+        self.recent.update(recent)
+
+    def has_fingerprint(self, fp):
+        if fp in self.recent:
+            return True
+        i = bisect_left(self.sorted, fp)
+        return i < len(self.sorted) and self.sorted[i] == fp
+
+    def contains(self, url):
+        with self.lock:
+            self.refresh()
+            return self.has_fingerprint(fingerprint(url))
+
+    def add(self, url):
+        """
+        :return: False if url was already in the index
+        """
+        fp = fingerprint(url)
+
+        with self.lock:
+            with open(self.log_path, 'ab') as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)  # refresh, check and append as one step across processes
+                try:
+                    self.refresh()
+                    if self.has_fingerprint(fp):
+                        return False
+                    f.write(array('Q', [fp]).tobytes())
+                    f.flush()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+            self.recent.add(fp)
+            return True
+
+    def __len__(self):
+        return len(self.sorted) + len(self.recent)
+
+    def compact(self):
+        """
+        Merges the log into the sorted array. Call while no other process is adding urls.
+        """
+        with self.lock:
+            self.refresh()
+            if not self.recent:
+                return
+
+            self.sorted = array('Q', sorted(set(self.sorted) | self.recent))
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(self.sorted.tobytes())
+            os.replace(tmp_path, self.path)
+
+            os.remove(self.log_path)
+            self.recent = set()
+            self.log_offset = 0
+
+
+_url_indexes = {}
+_url_indexes_pid = None
+_url_indexes_lock = threading.Lock()
+
+
+def get_url_index(path):
+    """
+    Returns the UrlIndex shared by every download in this process for path.
+    """
+    global _url_indexes, _url_indexes_pid
+
+    with _url_indexes_lock:
+        if _url_indexes_pid != os.getpid():
+            _url_indexes = {}
+            _url_indexes_pid = os.getpid()
+
+        if path not in _url_indexes:
+            _url_indexes[path] = UrlIndex(path)
+
+        return _url_indexes[path]